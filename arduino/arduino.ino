@@ -8,41 +8,557 @@
 */
 
 char versionMajor = 0;
-char versionMinor = 1;
+char versionMinor = 11;
 char versionMicro = 0;
 
-char cmdByte;
+// Enough bytes to hold one bit per pin for boards with up to 128 pins
+#define MAX_PORT_BYTES 16
+
+// Baud rates the host can ask for by index. The sketch always starts at the first
+#define N_BAUD_RATES 5
+const unsigned long baudRates[N_BAUD_RATES] = {115200, 250000, 500000, 1000000, 2000000};
+#define BAUD_CONFIRM_TIMEOUT_MS 500
+#define BAUD_UNSUPPORTED 0xFF
+
+#define MAX_STREAM_PINS 16
+#define STREAM_FRAME 0xA5
+#define STREAM_END 0x5A
+
+#define MAX_OVERSAMPLE 64
+#define OVERSAMPLE_MEAN 0
+#define OVERSAMPLE_MEDIAN 1
+
+#define MAX_SCHEDULED 8
+#define SCHEDULE_FULL 0xFF
+#define SCHEDULE_ALL 0xFF
+
+#define MAX_MACROS 4
+#define MAX_MACRO_SIZE 48
+
+// Framed protocol: FRAME_START, body length, sequence number, body, CRC-8 of
+// everything after the start byte. Request bodies are a command and its arguments;
+// reply bodies are a status followed by the reply data
+#define FRAME_START 0x7E
+#define MAX_FRAME_BODY 64
+#define FRAME_TIMEOUT_MS 20
+#define FRAME_OK 0
+#define FRAME_BAD_CRC 1
+#define FRAME_UNKNOWN_COMMAND 2
+#define FRAME_TOO_LONG 3
+#define FRAME_EVENT 4
+#define FRAME_OUT_OF_ORDER 5
+#define FRAME_DUPLICATE 6
+
+#define MAX_WATCHED 16
+#define WATCH_FULL 0
+#define WATCH_POLLING 1
+#define WATCH_INTERRUPT 2
+#define UNWATCH_ALL 0xFF
+#define MAX_ANALOG_WATCHED 8
+#define NO_THRESHOLD 0xFFFF
+#define EVENT_DIGITAL 0
+#define EVENT_ANALOG_RISE 1
+#define EVENT_ANALOG_FALL 2
+#define EVENT_ANALOG_DELTA 3
+
 char pinNum;
 char dataByte;
+byte portMask[MAX_PORT_BYTES];
+
+unsigned long currentBaud = 115200;
+unsigned long previousBaud;
+// A baud rate change waits until any reply has been sent, then is undone unless a
+// parrot command arrives at the new rate within BAUD_CONFIRM_TIMEOUT_MS
+unsigned long requestedBaud = 0;
+bool baudUnconfirmed = false;
+unsigned long baudChangedMs;
+
+bool streaming = false;
+byte streamPins[MAX_STREAM_PINS];
+byte nStreamPins = 0;
+unsigned long streamPeriodUs;
+unsigned long nextSampleUs;
+
+// Pin changes timed by the sketch's clock. Each writes state at nextUs, then keeps
+// alternating, holding HIGH for highUs and LOW for lowUs, until edgesLeft edges have
+// been written. An edgesLeft of 0 repeats until cancelled
+struct ScheduledAction {
+  bool active;
+  byte pin;
+  byte state;
+  unsigned long nextUs;
+  unsigned long highUs;
+  unsigned long lowUs;
+  unsigned long edgesLeft;
+};
+ScheduledAction scheduled[MAX_SCHEDULED];
+
+// Watched pins are reported with an event once they change and then keep their new
+// state for debounceUs. Changes to pins using an interrupt are recorded by the
+// interrupt handler, so they are timestamped accurately
+struct WatchedPin {
+  byte pin;
+  bool useInterrupt;
+  byte raw;
+  byte reported;
+  unsigned long changedUs;
+  unsigned long debounceUs;
+};
+volatile WatchedPin watched[MAX_WATCHED];
+volatile byte nWatched = 0;
+byte eventSeq = 0;
+
+// Watched analog pins are sampled every intervalUs. An event is sent when the value
+// reaches the threshold, drops below the threshold less the hysteresis, or otherwise
+// moves by at least minDelta since the last event
+struct AnalogWatch {
+  byte pin;
+  unsigned int threshold;
+  unsigned int hysteresis;
+  unsigned int minDelta;
+  unsigned long intervalUs;
+  unsigned long nextUs;
+  unsigned int lastReported;
+  bool above;
+};
+AnalogWatch analogWatched[MAX_ANALOG_WATCHED];
+byte nAnalogWatched = 0;
+
+// Macros are sequences of unframed commands, stored to be run by a single command.
+// While one runs, arguments are read from the macro
+byte macros[MAX_MACROS][MAX_MACRO_SIZE];
+byte macroLen[MAX_MACROS];
+bool inMacro = false;
+byte macroSlot;
+byte macroPos;
+
+// While a frame is being run, arguments are read from frameBody and replies are
+// collected in replyBody. The reply to the last frame run is kept there, so that it
+// can be sent again if the frame is resent
+bool inFrame = false;
+byte frameBody[MAX_FRAME_BODY];
+byte frameLen;
+byte framePos;
+byte replyBody[MAX_FRAME_BODY];
+byte replyLen;
+byte replyStatus;
+// Only the frame numbered expectedSeq is run. Any unframed command clears seqSynced,
+// so that the next frame is run whatever its number
+byte expectedSeq = 0;
+bool seqSynced = false;
+// After a bad frame, bytes are skipped until the next start byte, or until the host
+// goes quiet in case it only speaks the unframed protocol
+bool resyncing = false;
 
 void sendByte(char databyte) {
+  if (inFrame) {
+    if (replyLen < MAX_FRAME_BODY) {
+      replyBody[replyLen++] = databyte;
+    }
+    return;
+  }
   Serial.write(databyte);
   return;
 }
 
-char recvByte() {
-  while (!Serial.available());
+void sendUInt16(unsigned int value) {
+  sendByte(value & 0xFF);
+  sendByte((value >> 8) & 0xFF);
+}
+
+void sendUInt32(unsigned long value) {
+  sendUInt16(value & 0xFFFF);
+  sendUInt16((value >> 16) & 0xFFFF);
+}
+
+void sendStreamFrame(byte header) {
+  // Stream frames are never wrapped in a reply frame
+  bool wasInFrame = inFrame;
+  inFrame = false;
+  sendByte(header);
+  sendUInt32(micros());
+  for (byte i = 0; i < nStreamPins; i++) {
+    sendUInt16(header == STREAM_FRAME ? analogRead(streamPins[i]) : 0);
+  }
+  inFrame = wasInFrame;
+}
+
+void serviceStream() {
+  if (!streaming) {
+    return;
+  }
+  unsigned long now = micros();
+  if ((long)(now - nextSampleUs) < 0) {
+    return;
+  }
+  nextSampleUs += streamPeriodUs;
+  if ((long)(now - nextSampleUs) > 0) {
+    // Fell more than a period behind, so skip the missed samples
+    nextSampleUs = now + streamPeriodUs;
+  }
+  sendStreamFrame(STREAM_FRAME);
+}
+
+// Supported if the UART, running at double speed, gets within 2.5% of the rate
+byte supportedBaudRates() {
+  byte mask = 1;
+  for (byte i = 1; i < N_BAUD_RATES; i++) {
+    unsigned long divisor = (F_CPU / 8 + baudRates[i] / 2) / baudRates[i];
+    if (divisor == 0) {
+      continue;
+    }
+    long error = (long)(F_CPU / 8 / divisor) - (long)baudRates[i];
+    if (labs(error) * 40 <= baudRates[i]) {
+      mask |= 1 << i;
+    }
+  }
+  return mask;
+}
+
+void switchBaud(unsigned long baud) {
+  Serial.flush();
+  Serial.end();
+  Serial.begin(baud);
+  currentBaud = baud;
+}
+
+void serviceBaud() {
+  if (baudUnconfirmed && millis() - baudChangedMs > BAUD_CONFIRM_TIMEOUT_MS) {
+    baudUnconfirmed = false;
+    switchBaud(previousBaud);
+  }
+}
+
+void serviceSchedule() {
+  for (byte i = 0; i < MAX_SCHEDULED; i++) {
+    ScheduledAction *action = &scheduled[i];
+    if (!action->active || (long)(micros() - action->nextUs) < 0) {
+      continue;
+    }
+    digitalWrite(action->pin, action->state ? HIGH : LOW);
+    if (action->edgesLeft == 1) {
+      action->active = false;
+      continue;
+    }
+    if (action->edgesLeft > 0) {
+      action->edgesLeft--;
+    }
+    // Counting from when the edge was due, rather than when it was written, stops
+    // the timing drifting
+    action->nextUs += action->state ? action->highUs : action->lowUs;
+    action->state = !action->state;
+  }
+}
+
+void onWatchedPinChange() {
+  unsigned long now = micros();
+  for (byte i = 0; i < nWatched; i++) {
+    if (!watched[i].useInterrupt) {
+      continue;
+    }
+    byte state = digitalRead(watched[i].pin);
+    if (state != watched[i].raw) {
+      watched[i].raw = state;
+      watched[i].changedUs = now;
+    }
+  }
+}
+
+// Events are always framed, and are sent whole even when a reply is being built
+void sendEventFrame(byte eventType, byte pin, unsigned int value, unsigned long timestamp) {
+  byte body[9] = {
+    FRAME_EVENT, eventType, pin, value & 0xFF, (value >> 8) & 0xFF,
+    timestamp & 0xFF, (timestamp >> 8) & 0xFF, (timestamp >> 16) & 0xFF, (timestamp >> 24) & 0xFF
+  };
+  byte crc = crc8(crc8(0, sizeof(body)), eventSeq);
+  Serial.write(FRAME_START);
+  Serial.write(sizeof(body));
+  Serial.write(eventSeq);
+  for (byte i = 0; i < sizeof(body); i++) {
+    Serial.write(body[i]);
+    crc = crc8(crc, body[i]);
+  }
+  Serial.write(crc);
+  eventSeq++;
+}
+
+void serviceWatch() {
+  // Unframed stream frames cannot be mixed with events
+  if (streaming) {
+    return;
+  }
+  for (byte i = 0; i < nWatched; i++) {
+    noInterrupts();
+    if (!watched[i].useInterrupt) {
+      byte state = digitalRead(watched[i].pin);
+      if (state != watched[i].raw) {
+        watched[i].raw = state;
+        watched[i].changedUs = micros();
+      }
+    }
+    byte raw = watched[i].raw;
+    unsigned long changedUs = watched[i].changedUs;
+    interrupts();
+    if (raw != watched[i].reported && micros() - changedUs >= watched[i].debounceUs) {
+      watched[i].reported = raw;
+      sendEventFrame(EVENT_DIGITAL, watched[i].pin, raw, changedUs);
+    }
+  }
+}
+
+void serviceAnalogWatch() {
+  if (streaming) {
+    return;
+  }
+  for (byte i = 0; i < nAnalogWatched; i++) {
+    AnalogWatch *watch = &analogWatched[i];
+    unsigned long now = micros();
+    if ((long)(now - watch->nextUs) < 0) {
+      continue;
+    }
+    watch->nextUs += watch->intervalUs;
+    if ((long)(now - watch->nextUs) > 0) {
+      // Fell more than an interval behind, so skip the missed samples
+      watch->nextUs = now + watch->intervalUs;
+    }
+    unsigned int value = analogRead(watch->pin);
+    byte eventType = 0xFF;
+    if (watch->threshold != NO_THRESHOLD) {
+      if (!watch->above && value >= watch->threshold) {
+        watch->above = true;
+        eventType = EVENT_ANALOG_RISE;
+      }
+      else if (watch->above && value + watch->hysteresis < watch->threshold) {
+        watch->above = false;
+        eventType = EVENT_ANALOG_FALL;
+      }
+    }
+    if (eventType == 0xFF && watch->minDelta) {
+      unsigned int delta = value > watch->lastReported ? value - watch->lastReported : watch->lastReported - value;
+      if (delta >= watch->minDelta) {
+        eventType = EVENT_ANALOG_DELTA;
+      }
+    }
+    if (eventType != 0xFF) {
+      watch->lastReported = value;
+      sendEventFrame(eventType, watch->pin, value, now);
+    }
+  }
+}
+
+unsigned int oversampleBuffer[MAX_OVERSAMPLE];
+
+// The mean or median of nSamples readings, which is a power of 4, with an extra bit
+// of resolution for each factor of 4 samples
+unsigned int analogReadOversampled(byte pin, byte nSamples, byte mode) {
+  byte extraBits = 0;
+  while ((1 << (2 * extraBits)) < nSamples) {
+    extraBits++;
+  }
+  if (mode == OVERSAMPLE_MEDIAN) {
+    // Insertion sort the samples as they are taken
+    for (byte i = 0; i < nSamples; i++) {
+      unsigned int value = analogRead(pin);
+      byte j = i;
+      while (j > 0 && oversampleBuffer[j - 1] > value) {
+        oversampleBuffer[j] = oversampleBuffer[j - 1];
+        j--;
+      }
+      oversampleBuffer[j] = value;
+    }
+    unsigned long middle = (unsigned long)oversampleBuffer[(nSamples - 1) / 2] + oversampleBuffer[nSamples / 2];
+    return (middle << extraBits) >> 1;
+  }
+  unsigned long sum = 0;
+  for (byte i = 0; i < nSamples; i++) {
+    sum += analogRead(pin);
+  }
+  // The mean is sum / 4^extraBits, so shifting it up by extraBits leaves sum >> extraBits
+  return sum >> extraBits;
+}
+
+// Work that must carry on while waiting for the next command byte
+void serviceBackground() {
+  serviceSchedule();
+  serviceWatch();
+  serviceAnalogWatch();
+  serviceStream();
+  serviceBaud();
+}
+
+byte recvByte() {
+  if (inMacro) {
+    return macroPos < macroLen[macroSlot] ? macros[macroSlot][macroPos++] : 0;
+  }
+  if (inFrame) {
+    return framePos < frameLen ? frameBody[framePos++] : 0;
+  }
+  while (!Serial.available()) {
+    serviceBackground();
+  }
   return Serial.read();
 }
 
+// Returns -1 if no byte arrives within FRAME_TIMEOUT_MS
+int recvByteWithTimeout() {
+  unsigned long start = millis();
+  while (!Serial.available()) {
+    serviceBackground();
+    if (millis() - start > FRAME_TIMEOUT_MS) {
+      return -1;
+    }
+  }
+  return Serial.read();
+}
+
+byte crc8(byte crc, byte data) {
+  crc ^= data;
+  for (byte bit = 0; bit < 8; bit++) {
+    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+void sendFrame(byte seq, byte status, byte len) {
+  byte crc = crc8(crc8(crc8(0, len + 1), seq), status);
+  Serial.write(FRAME_START);
+  Serial.write(len + 1);
+  Serial.write(seq);
+  Serial.write(status);
+  for (byte i = 0; i < len; i++) {
+    Serial.write(replyBody[i]);
+    crc = crc8(crc, replyBody[i]);
+  }
+  Serial.write(crc);
+}
+
+// A reply with a status only, leaving the last reply in replyBody alone
+void sendStatusFrame(byte seq, byte status) {
+  sendFrame(seq, status, 0);
+}
+
+void recvFrame() {
+  int len = recvByteWithTimeout();
+  int seq = recvByteWithTimeout();
+  if (len < 0 || seq < 0) {
+    resyncing = true;
+    return;
+  }
+  byte crc = crc8(crc8(0, len), seq);
+  for (byte i = 0; i < len; i++) {
+    int data = recvByteWithTimeout();
+    if (data < 0) {
+      resyncing = true;
+      sendStatusFrame(seq, FRAME_BAD_CRC);
+      return;
+    }
+    crc = crc8(crc, data);
+    if (i < MAX_FRAME_BODY) {
+      frameBody[i] = data;
+    }
+  }
+  int expectedCrc = recvByteWithTimeout();
+
+  if (len > MAX_FRAME_BODY) {
+    sendStatusFrame(seq, FRAME_TOO_LONG);
+    return;
+  }
+  if (expectedCrc != crc) {
+    resyncing = true;
+    sendStatusFrame(seq, FRAME_BAD_CRC);
+    return;
+  }
+  byte offset = seqSynced ? (byte)(seq - expectedSeq) : 0;
+  if (offset == 0) {
+    replyStatus = FRAME_OK;
+    replyLen = 0;
+    frameLen = len;
+    framePos = 1;
+    inFrame = true;
+    if (len == 0 || !runCommand(frameBody[0])) {
+      replyStatus = FRAME_UNKNOWN_COMMAND;
+    }
+    inFrame = false;
+    expectedSeq = seq + 1;
+    seqSynced = true;
+    sendFrame(seq, replyStatus, replyLen);
+  }
+  else if (offset < 128) {
+    // An earlier frame was lost, so this one must wait to be resent
+    sendStatusFrame(seq, FRAME_OUT_OF_ORDER);
+  }
+  else if (offset == 255) {
+    // The last frame run, resent because its reply was lost
+    sendFrame(seq, replyStatus, replyLen);
+  }
+  else {
+    sendStatusFrame(seq, FRAME_DUPLICATE);
+  }
+}
+
+unsigned int recvUInt16() {
+  unsigned int low = recvByte();
+  unsigned int high = recvByte();
+  return low | (high << 8);
+}
+
+unsigned long recvUInt32() {
+  unsigned long low = recvUInt16();
+  unsigned long high = recvUInt16();
+  return low | (high << 16);
+}
+
 void setup() {
-  Serial.begin(115200);
+  Serial.begin(currentBaud);
 }
 
 void loop() {
+  if (resyncing) {
+    int data = recvByteWithTimeout();
+    if (data == FRAME_START) {
+      resyncing = false;
+      recvFrame();
+    }
+    else if (data < 0) {
+      resyncing = false;
+    }
+  }
+  else {
+    // Receive the Command Byte, or the start of a frame
+    byte firstByte = recvByte();
+    if (firstByte == FRAME_START) {
+      recvFrame();
+    }
+    else {
+      seqSynced = false;
+      runCommand(firstByte);
+    }
+  }
 
-  // Receive the Command Byte
-  cmdByte = recvByte();
+  if (requestedBaud) {
+    previousBaud = currentBaud;
+    switchBaud(requestedBaud);
+    requestedBaud = 0;
+    baudUnconfirmed = true;
+    baudChangedMs = millis();
+  }
+}
+
+// Returns false if the command is not known
+bool runCommand(char cmdByte) {
 
   // poll
   if (cmdByte == 0) {
     sendByte(1);
+    return true;
   }
 
   // parrot
   if (cmdByte == 1) {
     char dataByte = recvByte();
-    Serial.write(dataByte);
+    sendByte(dataByte);
+    baudUnconfirmed = false;
+    return true;
   }
 
   // version
@@ -50,6 +566,26 @@ void loop() {
     sendByte(versionMajor);
     sendByte(versionMinor);
     sendByte(versionMicro);
+    return true;
+  }
+
+  // baudRates
+  if (cmdByte == 3) {
+    sendByte(supportedBaudRates());
+    return true;
+  }
+
+  // setBaud
+  if (cmdByte == 4) {
+    byte index = recvByte();
+    if (index >= N_BAUD_RATES || !(supportedBaudRates() & (1 << index))) {
+      sendByte(BAUD_UNSUPPORTED);
+    }
+    else {
+      sendByte(index);
+      requestedBaud = baudRates[index];
+    }
+    return true;
   }
 
   // pinMode
@@ -65,6 +601,7 @@ void loop() {
     else if (dataByte == 2) {
       pinMode(pinNum, INPUT_PULLUP);
     }
+    return true;
   }
 
   // digitalRead
@@ -72,11 +609,12 @@ void loop() {
     pinNum = recvByte();
     dataByte = digitalRead(pinNum);
     if (dataByte == LOW) {
-      Serial.write(0);
+      sendByte(0);
     }
     else if (dataByte == HIGH) {
-      Serial.write(1);
+      sendByte(1);
     }
+    return true;
   }
 
   // digitalWrite
@@ -89,13 +627,53 @@ void loop() {
     else if (dataByte == 1) {
       digitalWrite(pinNum, HIGH);
     }
+    return true;
+  }
+
+  // digitalWriteMany
+  if (cmdByte == 22) {
+    byte nBytes = recvByte();
+    for (byte i = 0; i < nBytes; i++) {
+      byte mask = recvByte();
+      if (i < MAX_PORT_BYTES) {
+        portMask[i] = mask;
+      }
+    }
+    for (byte i = 0; i < nBytes; i++) {
+      byte states = recvByte();
+      if (i >= MAX_PORT_BYTES) {
+        continue;
+      }
+      for (byte bit = 0; bit < 8; bit++) {
+        if (portMask[i] & (1 << bit)) {
+          digitalWrite(i * 8 + bit, (states & (1 << bit)) ? HIGH : LOW);
+        }
+      }
+    }
+    return true;
+  }
+
+  // digitalReadAll
+  if (cmdByte == 23) {
+    byte nBytes = recvByte();
+    for (byte i = 0; i < nBytes; i++) {
+      byte states = 0;
+      for (byte bit = 0; bit < 8; bit++) {
+        int pin = i * 8 + bit;
+        if (pin < NUM_DIGITAL_PINS && digitalRead(pin) == HIGH) {
+          states |= (1 << bit);
+        }
+      }
+      sendByte(states);
+    }
+    return true;
   }
 
   // analogRead
   if (cmdByte == 30) {
     pinNum = recvByte();
-    dataByte = analogRead(pinNum);
-    Serial.write(dataByte);
+    sendUInt16(analogRead(pinNum));
+    return true;
   }
 
   // analogWrite
@@ -104,6 +682,243 @@ void loop() {
     pinNum = recvByte();
     int value = recvByte();
     analogWrite(pinNum, value);
+    return true;
+  }
+
+  // analogReadMany
+  if (cmdByte == 32) {
+    byte nPins = recvByte();
+    for (byte i = 0; i < nPins; i++) {
+      pinNum = recvByte();
+      sendUInt16(analogRead(pinNum));
+    }
+    return true;
+  }
+
+  // analogReadOversampled
+  if (cmdByte == 33) {
+    pinNum = recvUInt32();
+    unsigned long nSamples = recvUInt32();
+    byte mode = recvUInt32();
+    sendUInt16(analogReadOversampled(pinNum, min(max(nSamples, 1UL), (unsigned long)MAX_OVERSAMPLE), mode));
+    return true;
+  }
+
+  // streamStart
+  if (cmdByte == 40) {
+    unsigned int rateHz = recvUInt16();
+    byte nPins = recvUInt16();
+    for (byte i = 0; i < nPins; i++) {
+      byte pin = recvUInt16();
+      if (i < MAX_STREAM_PINS) {
+        streamPins[i] = pin;
+      }
+    }
+    nStreamPins = min(nPins, MAX_STREAM_PINS);
+    streamPeriodUs = 1000000UL / max(rateHz, 1);
+    nextSampleUs = micros();
+    streaming = true;
+    return true;
+  }
+
+  // streamStop
+  if (cmdByte == 41) {
+    streaming = false;
+    sendStreamFrame(STREAM_END);
+    return true;
+  }
+
+  // schedule
+  if (cmdByte == 50) {
+    byte pin = recvUInt32();
+    byte state = recvUInt32();
+    unsigned long delayUs = recvUInt32();
+    unsigned long highUs = recvUInt32();
+    unsigned long lowUs = recvUInt32();
+    unsigned long nEdges = recvUInt32();
+    byte slot = SCHEDULE_FULL;
+    for (byte i = 0; i < MAX_SCHEDULED; i++) {
+      if (!scheduled[i].active) {
+        slot = i;
+        break;
+      }
+    }
+    if (slot != SCHEDULE_FULL) {
+      ScheduledAction *action = &scheduled[slot];
+      action->pin = pin;
+      action->state = state;
+      action->nextUs = micros() + delayUs;
+      action->highUs = highUs;
+      action->lowUs = lowUs;
+      action->edgesLeft = nEdges;
+      action->active = true;
+    }
+    sendByte(slot);
+    return true;
+  }
+
+  // cancelSchedule
+  if (cmdByte == 51) {
+    byte slot = recvByte();
+    for (byte i = 0; i < MAX_SCHEDULED; i++) {
+      if (slot == SCHEDULE_ALL || slot == i) {
+        scheduled[i].active = false;
+      }
+    }
+    return true;
+  }
+
+  // pulseIn
+  if (cmdByte == 52) {
+    byte pin = recvUInt32();
+    byte state = recvUInt32();
+    unsigned long timeoutUs = recvUInt32();
+    sendUInt32(pulseIn(pin, state ? HIGH : LOW, timeoutUs));
+    return true;
+  }
+
+  // watchDigital
+  if (cmdByte == 70) {
+    byte pin = recvUInt32();
+    unsigned long debounceUs = recvUInt32();
+    bool useInterrupt = recvUInt32() && digitalPinToInterrupt(pin) != NOT_AN_INTERRUPT;
+    byte slot = 0;
+    while (slot < nWatched && watched[slot].pin != pin) {
+      slot++;
+    }
+    if (slot == MAX_WATCHED) {
+      sendByte(WATCH_FULL);
+      sendByte(0);
+      return true;
+    }
+    byte state = digitalRead(pin);
+    noInterrupts();
+    watched[slot].pin = pin;
+    watched[slot].useInterrupt = useInterrupt;
+    watched[slot].raw = state;
+    watched[slot].reported = state;
+    watched[slot].changedUs = micros();
+    watched[slot].debounceUs = debounceUs;
+    if (slot == nWatched) {
+      nWatched++;
+    }
+    interrupts();
+    if (useInterrupt) {
+      attachInterrupt(digitalPinToInterrupt(pin), onWatchedPinChange, CHANGE);
+    }
+    sendByte(useInterrupt ? WATCH_INTERRUPT : WATCH_POLLING);
+    sendByte(state);
+    return true;
+  }
+
+  // unwatch
+  if (cmdByte == 71) {
+    byte pin = recvByte();
+    noInterrupts();
+    byte kept = 0;
+    for (byte i = 0; i < nWatched; i++) {
+      if (pin == UNWATCH_ALL || watched[i].pin == pin) {
+        if (watched[i].useInterrupt) {
+          detachInterrupt(digitalPinToInterrupt(watched[i].pin));
+        }
+        continue;
+      }
+      watched[kept].pin = watched[i].pin;
+      watched[kept].useInterrupt = watched[i].useInterrupt;
+      watched[kept].raw = watched[i].raw;
+      watched[kept].reported = watched[i].reported;
+      watched[kept].changedUs = watched[i].changedUs;
+      watched[kept].debounceUs = watched[i].debounceUs;
+      kept++;
+    }
+    nWatched = kept;
+    interrupts();
+    kept = 0;
+    for (byte i = 0; i < nAnalogWatched; i++) {
+      if (pin != UNWATCH_ALL && analogWatched[i].pin != pin) {
+        analogWatched[kept++] = analogWatched[i];
+      }
+    }
+    nAnalogWatched = kept;
+    return true;
+  }
+
+  // watchAnalog
+  if (cmdByte == 72) {
+    byte pin = recvUInt32();
+    unsigned int threshold = recvUInt32();
+    unsigned int hysteresis = recvUInt32();
+    unsigned int minDelta = recvUInt32();
+    unsigned long intervalUs = recvUInt32();
+    byte slot = 0;
+    while (slot < nAnalogWatched && analogWatched[slot].pin != pin) {
+      slot++;
+    }
+    if (slot == MAX_ANALOG_WATCHED) {
+      sendUInt16(WATCH_FULL);
+      sendUInt16(0);
+      return true;
+    }
+    unsigned int value = analogRead(pin);
+    AnalogWatch *watch = &analogWatched[slot];
+    watch->pin = pin;
+    watch->threshold = threshold;
+    watch->hysteresis = hysteresis;
+    watch->minDelta = minDelta;
+    watch->intervalUs = max(intervalUs, 1);
+    watch->nextUs = micros() + watch->intervalUs;
+    watch->lastReported = value;
+    watch->above = threshold != NO_THRESHOLD && value >= threshold;
+    if (slot == nAnalogWatched) {
+      nAnalogWatched++;
+    }
+    sendUInt16(WATCH_POLLING);
+    sendUInt16(value);
+    return true;
+  }
+
+  // macroWrite
+  if (cmdByte == 60) {
+    if (inMacro) {
+      return false;
+    }
+    byte slot = recvByte();
+    byte offset = recvByte();
+    byte nBytes = recvByte();
+    for (byte i = 0; i < nBytes; i++) {
+      byte data = recvByte();
+      if (slot < MAX_MACROS && offset + i < MAX_MACRO_SIZE) {
+        macros[slot][offset + i] = data;
+      }
+    }
+    if (slot < MAX_MACROS) {
+      macroLen[slot] = min(offset + nBytes, MAX_MACRO_SIZE);
+    }
+    return true;
+  }
+
+  // macroRun
+  if (cmdByte == 61) {
+    if (inMacro) {
+      return false;
+    }
+    byte slot = recvByte();
+    byte nRepeats = recvByte();
+    if (slot >= MAX_MACROS) {
+      return true;
+    }
+    inMacro = true;
+    macroSlot = slot;
+    bool ok = true;
+    for (byte i = 0; i < nRepeats && ok; i++) {
+      macroPos = 0;
+      while (ok && macroPos < macroLen[slot]) {
+        ok = runCommand(recvByte());
+      }
+    }
+    inMacro = false;
+    return true;
   }
 
+  return false;
 }
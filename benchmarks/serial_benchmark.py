@@ -0,0 +1,181 @@
+"""Benchmarks for the hot path from Arduino down to the serial port.
+
+Runs against the in-process emulator by default, which measures the Python stack
+alone. Pass --pty to talk to an emulated board through a pseudo-terminal instead, so
+that real serial I/O is included.
+
+    python -m benchmarks.serial_benchmark
+    python -m benchmarks.serial_benchmark --pty --iterations 2000 --json results.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.boards.pool import BoardPool
+from rapiduino.communication.command_spec import CMD_ANALOGWRITE, CMD_DIGITALWRITE
+from rapiduino.communication.serial import SerialConnection
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import EmulatedSerialConnection, PtyServer
+from rapiduino.globals.common import HIGH, LOW, OUTPUT
+
+Result = Dict[str, Any]
+
+
+def measure(name: str, operation: Callable[[int], Any], iterations: int) -> Result:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "name": name,
+        "ops_per_sec": iterations / elapsed,
+        "p50_us": statistics.median(latencies) * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+    }
+
+
+class BoardFactory:
+    def __init__(self, use_pty: bool) -> None:
+        self.use_pty = use_pty
+        self.servers: List[PtyServer] = []
+
+    def __call__(self, name: str = "") -> Arduino:
+        if not self.use_pty:
+            return Arduino.uno(name, conn_class=EmulatedSerialConnection)
+        server = PtyServer(EmulatedBoard())
+        self.servers.append(server)
+        return Arduino.uno(server.port, conn_class=SerialConnection)
+
+    def close(self) -> None:
+        for server in self.servers:
+            server.close()
+
+
+def bench_commands(arduino: Arduino, iterations: int) -> List[Result]:
+    arduino.pin_mode(13, OUTPUT)
+    states = (LOW, HIGH)
+    return [
+        measure("poll", lambda i: arduino.poll(), iterations),
+        measure("pin_mode", lambda i: arduino.pin_mode(13, OUTPUT), iterations),
+        measure(
+            "digital_write",
+            lambda i: arduino.digital_write(13, states[i & 1]),
+            iterations,
+        ),
+        measure("digital_read", lambda i: arduino.digital_read(13), iterations),
+        measure("analog_write", lambda i: arduino.analog_write(3, i & 255), iterations),
+        measure("analog_read", lambda i: arduino.analog_read(14), iterations),
+        measure(
+            "digital_write x12 (batch)",
+            lambda i: batch_write(arduino, states[i & 1]),
+            iterations,
+        ),
+        measure(
+            "digital_write_many x12",
+            lambda i: arduino.digital_write_many(
+                {pin_no: states[i & 1] for pin_no in range(2, 14)}
+            ),
+            iterations,
+        ),
+        measure("digital_read_all", lambda i: arduino.digital_read_all(), iterations),
+    ]
+
+
+def batch_write(arduino: Arduino, state: Any) -> None:
+    with arduino.batch():
+        for pin_no in range(2, 14):
+            arduino.digital_write(pin_no, state)
+
+
+def bench_python_overhead(arduino: Arduino, iterations: int) -> List[Result]:
+    return [
+        measure(
+            "validate digital_write",
+            lambda i: arduino._assert_can_digital_write(13, HIGH, None),
+            iterations,
+        ),
+        measure(
+            "validate analog_write",
+            lambda i: arduino._assert_can_analog_write(3, 100, None),
+            iterations,
+        ),
+        measure(
+            "encode digital_write",
+            lambda i: CMD_DIGITALWRITE.encode(13, 1),
+            iterations,
+        ),
+        measure(
+            "encode analog_write",
+            lambda i: CMD_ANALOGWRITE.encode(3, 100),
+            iterations,
+        ),
+    ]
+
+
+def bench_board_scaling(
+    factory: BoardFactory, board_counts: Sequence[int], iterations: int
+) -> List[Result]:
+    results = []
+    for n_boards in board_counts:
+        boards = {str(i): factory(str(i)) for i in range(n_boards)}
+        pool = BoardPool(boards)
+        results.append(
+            measure(
+                f"pool.analog_read x{n_boards} boards",
+                lambda i, pool=pool: pool.analog_read(14),  # type: ignore
+                iterations,
+            )
+        )
+        pool.close()
+    return results
+
+
+def print_results(title: str, results: List[Result]) -> None:
+    print(f"\n{title}")
+    print(f"{'benchmark':<36}{'ops/sec':>12}{'p50 (us)':>12}{'p99 (us)':>12}")
+    for r in results:
+        print(
+            f"{r['name']:<36}{r['ops_per_sec']:>12.0f}"
+            f"{r['p50_us']:>12.1f}{r['p99_us']:>12.1f}"
+        )
+
+
+def main(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--pty", action="store_true", help="use a pseudo-terminal")
+    parser.add_argument("--boards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    factory = BoardFactory(args.pty)
+    try:
+        arduino = factory()
+        all_results = {
+            "commands": bench_commands(arduino, args.iterations),
+            "python_overhead": bench_python_overhead(arduino, args.iterations),
+            "board_scaling": bench_board_scaling(
+                factory, args.boards, max(args.iterations // 10, 1)
+            ),
+        }
+    finally:
+        factory.close()
+
+    for title, results in all_results.items():
+        print_results(title, results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
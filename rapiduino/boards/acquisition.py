@@ -0,0 +1,195 @@
+import array
+import sys
+from typing import Any, List, Tuple
+
+from rapiduino.communication.command_spec import stream_frame_struct
+
+# NumPy is optional, so it is typed as Any whether or not it is installed
+np: Any
+try:
+    import numpy  # type: ignore
+
+    np = numpy
+except ImportError:
+    np = None
+
+# Timestamps and values as NumPy arrays, or as memoryviews of array.arrays
+Samples = Tuple[Any, Any]
+
+
+class SampleBuffer:
+    """A ring of stream samples held in arrays allocated up front, so that long
+    captures create no Python objects per sample.
+
+    The arrays are NumPy arrays when NumPy is installed, with the values shaped
+    (capacity, n_pins), and otherwise array.arrays with the values of each frame
+    side by side. Timestamps are in microseconds since the Arduino started, with
+    wraps of its 32-bit clock taken out. Once full, each new frame replaces the
+    oldest.
+    """
+
+    def __init__(self, n_pins: int, capacity: int, use_numpy: bool = True) -> None:
+        if n_pins < 1 or capacity < 1:
+            raise ValueError("A SampleBuffer needs at least one pin and one frame")
+        self.n_pins = n_pins
+        self.capacity = capacity
+        self.use_numpy = use_numpy and np is not None
+        # NumPy arrays or array.arrays, depending on use_numpy
+        self.timestamps_us: Any
+        self.values: Any
+        if self.use_numpy:
+            self.timestamps_us = np.zeros(capacity, dtype=np.uint64)
+            self.values = np.zeros((capacity, n_pins), dtype=np.uint16)
+            self._frame_dtype = np.dtype(
+                [("header", "u1"), ("timestamp", "<u4"), ("values", "<u2", (n_pins,))]
+            )
+        else:
+            self.timestamps_us = array.array("Q", bytes(8 * capacity))
+            self.values = array.array("H", bytes(2 * capacity * n_pins))
+        self.n_frames_total = 0
+        self._wraps = 0
+        self._last_timestamp = 0
+
+    def __len__(self) -> int:
+        return min(self.n_frames_total, self.capacity)
+
+    @property
+    def n_frames_dropped(self) -> int:
+        """How many frames have been overwritten by newer ones"""
+        return self.n_frames_total - len(self)
+
+    def clear(self) -> None:
+        self.n_frames_total = 0
+        self._wraps = 0
+        self._last_timestamp = 0
+
+    def extend_frames(self, data: bytes) -> int:
+        """Decode whole stream frames, as sent by the Arduino, straight into the ring.
+        Returns the number of frames added"""
+        frame_size = stream_frame_struct(self.n_pins).size
+        if len(data) % frame_size:
+            raise ValueError(f"Stream frames are {frame_size} bytes each")
+        n_frames = len(data) // frame_size
+        if self.use_numpy:
+            self._extend_numpy(data, n_frames)
+        else:
+            self._extend_array(data, n_frames)
+        self.n_frames_total += n_frames
+        return n_frames
+
+    def views(self) -> List[Samples]:
+        """The timestamps and values held, oldest first, as views of the buffer's
+        arrays rather than copies. The ring wraps, so there are up to two segments.
+        Views are only valid until more frames are added"""
+        if self.n_frames_dropped:
+            start = self.n_frames_total % self.capacity
+            segments = [(start, self.capacity), (0, start)]
+        else:
+            segments = [(0, len(self))]
+        return [self._view(begin, end) for begin, end in segments if end > begin]
+
+    def to_arrays(self) -> Samples:
+        """A copy of the timestamps and values held, oldest first, in single arrays"""
+        segments = self.views()
+        if self.use_numpy:
+            if not segments:
+                return self.timestamps_us[:0].copy(), self.values[:0].copy()
+            return (
+                np.concatenate([timestamps for timestamps, _ in segments]),
+                np.concatenate([values for _, values in segments]),
+            )
+        timestamps_us = array.array("Q")
+        values = array.array("H")
+        for segment_timestamps, segment_values in segments:
+            timestamps_us.frombytes(segment_timestamps.cast("B"))
+            values.frombytes(segment_values.cast("B"))
+        return timestamps_us, values
+
+    def _view(self, begin: int, end: int) -> Samples:
+        if self.use_numpy:
+            return self.timestamps_us[begin:end], self.values[begin:end]
+        return (
+            memoryview(self.timestamps_us)[begin:end],
+            memoryview(self.values)[begin * self.n_pins : end * self.n_pins],
+        )
+
+    def _extend_numpy(self, data: bytes, n_frames: int) -> None:
+        frames = np.frombuffer(data, dtype=self._frame_dtype)
+        timestamps = frames["timestamp"].astype(np.uint64)
+        previous = np.concatenate(
+            (np.array([self._last_timestamp], dtype=np.uint64), timestamps[:-1])
+        )
+        wraps = self._wraps + np.cumsum(timestamps < previous, dtype=np.uint64)
+        if n_frames:
+            self._wraps = int(wraps[-1])
+            self._last_timestamp = int(timestamps[-1])
+        # Only the newest capacity frames can be kept
+        keep = min(n_frames, self.capacity)
+        timestamps = timestamps[n_frames - keep :] + (wraps[n_frames - keep :] << 32)
+        values = frames["values"][n_frames - keep :]
+        start = (self.n_frames_total + n_frames - keep) % self.capacity
+        first = min(keep, self.capacity - start)
+        self.timestamps_us[start : start + first] = timestamps[:first]
+        self.values[start : start + first] = values[:first]
+        self.timestamps_us[: keep - first] = timestamps[first:]
+        self.values[: keep - first] = values[first:]
+
+    def _extend_array(self, data: bytes, n_frames: int) -> None:
+        # Each byte of a field is gathered from every frame by one strided slice, and
+        # the gathered bytes decoded with array.frombytes
+        if not n_frames:
+            return
+        frame_size = stream_frame_struct(self.n_pins).size
+        first = _frame_timestamp(data, frame_size, 0)
+        last = _frame_timestamp(data, frame_size, n_frames - 1)
+        wraps = self._wraps + (first < self._last_timestamp)
+        # A batch of frames spans far less than the 71 minutes the clock takes to
+        # wrap, so it wraps at most once, where the timestamps drop below the first
+        split = n_frames
+        if last < first:
+            low, high = 1, n_frames - 1
+            while low < high:
+                middle = (low + high) // 2
+                if _frame_timestamp(data, frame_size, middle) < first:
+                    high = middle
+                else:
+                    low = middle + 1
+            split = low
+        self._wraps = wraps + (split < n_frames)
+        self._last_timestamp = last
+        # Only the newest capacity frames can be kept
+        keep = min(n_frames, self.capacity)
+        frames = data[(n_frames - keep) * frame_size :]
+        split = max(split - (n_frames - keep), 0)
+        timestamps = bytearray(8 * keep)
+        for byte in range(4):
+            timestamps[byte::8] = frames[1 + byte :: frame_size]
+            low_wraps = bytes(((wraps >> 8 * byte) & 0xFF,))
+            high_wraps = bytes((((wraps + 1) >> 8 * byte) & 0xFF,))
+            timestamps[4 + byte : 8 * split : 8] = low_wraps * split
+            timestamps[8 * split + 4 + byte :: 8] = high_wraps * (keep - split)
+        row_size = 2 * self.n_pins
+        values = bytearray(row_size * keep)
+        for byte in range(row_size):
+            values[byte::row_size] = frames[5 + byte :: frame_size]
+        timestamps_us = array.array("Q")
+        timestamps_us.frombytes(timestamps)
+        frame_values = array.array("H")
+        frame_values.frombytes(values)
+        if sys.byteorder == "big":
+            timestamps_us.byteswap()
+            frame_values.byteswap()
+        n_pins = self.n_pins
+        start = (self.n_frames_total + n_frames - keep) % self.capacity
+        head = min(keep, self.capacity - start)
+        self.timestamps_us[start : start + head] = timestamps_us[:head]
+        self.values[start * n_pins : (start + head) * n_pins] = frame_values[
+            : head * n_pins
+        ]
+        self.timestamps_us[: keep - head] = timestamps_us[head:]
+        self.values[: (keep - head) * n_pins] = frame_values[head * n_pins :]
+
+
+def _frame_timestamp(data: bytes, frame_size: int, index: int) -> int:
+    offset = index * frame_size + 1
+    return int.from_bytes(data[offset : offset + 4], "little")
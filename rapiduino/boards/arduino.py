@@ -1,41 +1,107 @@
-from typing import Dict, Optional, Tuple, Type
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
+from rapiduino.boards.acquisition import SampleBuffer
+from rapiduino.boards.base_board import BaseBoard
+from rapiduino.boards.events import AnalogEvent, DigitalEvent
+from rapiduino.boards.macro import Macro
+from rapiduino.boards.pin_cache import PinStateCache
 from rapiduino.boards.pins import Pin, get_mega_pins, get_nano_pins, get_uno_pins
+from rapiduino.boards.stream import StreamFrame
 from rapiduino.communication.command_spec import (
+    ANALOG_EVENTS_VERSION,
+    BAUD_NEGOTIATION_VERSION,
+    BAUD_RATES,
     CMD_ANALOGREAD,
+    CMD_ANALOGREADOVERSAMPLED,
     CMD_ANALOGWRITE,
+    CMD_BAUDRATES,
+    CMD_CANCELSCHEDULE,
     CMD_DIGITALREAD,
     CMD_DIGITALWRITE,
     CMD_PARROT,
     CMD_PINMODE,
     CMD_POLL,
+    CMD_PULSEIN,
+    CMD_SCHEDULE,
+    CMD_SETBAUD,
+    CMD_STREAMSTOP,
+    CMD_UNWATCH,
     CMD_VERSION,
+    CMD_WATCHANALOG,
+    CMD_WATCHDIGITAL,
+    EVENT_ANALOG_DELTA,
+    EVENT_ANALOG_FALL,
+    EVENT_ANALOG_RISE,
+    EVENT_DIGITAL,
+    EVENTS_VERSION,
+    MACRO_CHUNK_SIZE,
+    MACRO_EXCLUDED_CMDS,
+    MACRO_VERSION,
+    MAX_ANALOG_WATCHED,
+    MAX_MACRO_SIZE,
+    MAX_MACROS,
+    MAX_SCHEDULED,
+    MAX_WATCHED,
+    NO_THRESHOLD,
+    OVERSAMPLE_MEAN,
+    OVERSAMPLE_MEDIAN,
+    OVERSAMPLING_VERSION,
+    SCHEDULE_ALL,
+    SCHEDULE_FULL,
+    SCHEDULING_VERSION,
+    UNWATCH_ALL,
+    WATCH_FULL,
+    CommandSpec,
+    cmd_analogreadmany,
+    cmd_digitalreadall,
+    cmd_digitalwritemany,
+    cmd_macrorun,
+    cmd_macrowrite,
+    cmd_streamstart,
+    event_struct,
 )
-from rapiduino.communication.serial import SerialConnection
+from rapiduino.communication.framing import FRAMED_PROTOCOL_VERSION, MAX_FRAME_BODY
+from rapiduino.communication.metrics import ConnectionMetrics
+from rapiduino.communication.serial import Command, SerialConnection
 from rapiduino.exceptions import (
+    ArduinoScheduleFullError,
     ArduinoSketchVersionIncompatibleError,
-    ComponentAlreadyRegisteredError,
-    NotAnalogPinError,
-    NotPwmPinError,
-    PinAlreadyRegisteredError,
-    PinDoesNotExistError,
-    PinIsReservedForSerialCommsError,
-    ProtectedPinError,
-)
-from rapiduino.globals.common import (
-    HIGH,
-    INPUT,
-    INPUT_PULLUP,
-    LOW,
-    OUTPUT,
-    PinMode,
-    PinState,
+    ArduinoWatchListFullError,
+    SerialConnectionAckError,
+    SerialConnectionFrameError,
+    SerialConnectionReceiveDataError,
 )
+from rapiduino.globals.common import HIGH, LOW, PinMode, PinState
 
+_ANALOG_EVENT_KINDS = {
+    EVENT_ANALOG_RISE: "rise",
+    EVENT_ANALOG_FALL: "fall",
+    EVENT_ANALOG_DELTA: "delta",
+}
 
-class Arduino:
 
-    min_version = (0, 1, 0)
+class Arduino(BaseBoard):
+    # Time for the Arduino to switch baud rate, and to switch back after a failed test
+    baud_switch_delay_s = 0.01
+    baud_revert_delay_s = 0.6
+    # Sketch versions already verified, by port
+    version_cache: Dict[str, Tuple[int, ...]] = {}
 
     def __init__(
         self,
@@ -44,62 +110,236 @@ class Arduino:
         rx_pin: int = 0,
         tx_pin: int = 1,
         conn_class: Type[SerialConnection] = SerialConnection,
+        reset_on_open: bool = True,
+        ready_timeout: float = 5,
+        cache_version: bool = False,
     ) -> None:
-        self._pins = pins
-        self.connection = conn_class.build(port)
-        self.pin_register: Dict[int, str] = {}
-        self.reserved_pin_nums = (rx_pin, tx_pin)
-        self._assert_compatible_sketch_version()
+        """Connect to the Arduino on port, waiting up to ready_timeout seconds for it
+        to respond. With reset_on_open=False the Arduino is not reset by opening the
+        port, where the operating system allows it. With cache_version=True, the
+        sketch version is only read the first time a port is connected to; clear
+        version_cache after uploading a new sketch.
+        """
+        super().__init__(pins, rx_pin=rx_pin, tx_pin=tx_pin)
+        self.connection = conn_class.build(port, reset_on_open=reset_on_open)
+        self._batch: Optional[List[Command]] = None
+        self._macro: Optional[Macro] = None
+        self._digital_callbacks: Dict[int, List[Callable[[DigitalEvent], None]]] = {}
+        self._analog_callbacks: Dict[int, List[Callable[[AnalogEvent], None]]] = {}
+        self.pin_cache: Optional[PinStateCache] = None
+        self.connection.wait_until_ready(ready_timeout)
+        version = self.version_cache.get(port) if cache_version else None
+        if version is None:
+            version = self.version()
+            self._assert_compatible_sketch_version(version)
+            if cache_version:
+                self.version_cache[port] = version
+        self.sketch_version = version
+        if version >= FRAMED_PROTOCOL_VERSION:
+            self.connection.enable_framing()
 
     @classmethod
     def uno(
         cls,
         port: str,
         conn_class: Type[SerialConnection] = SerialConnection,
+        reset_on_open: bool = True,
+        ready_timeout: float = 5,
+        cache_version: bool = False,
     ) -> "Arduino":
-        return cls(get_uno_pins(), port, conn_class=conn_class)
+        return cls(
+            get_uno_pins(),
+            port,
+            conn_class=conn_class,
+            reset_on_open=reset_on_open,
+            ready_timeout=ready_timeout,
+            cache_version=cache_version,
+        )
 
     @classmethod
     def nano(
         cls,
         port: str,
         conn_class: Type[SerialConnection] = SerialConnection,
+        reset_on_open: bool = True,
+        ready_timeout: float = 5,
+        cache_version: bool = False,
     ) -> "Arduino":
-        return cls(get_nano_pins(), port, conn_class=conn_class)
+        return cls(
+            get_nano_pins(),
+            port,
+            conn_class=conn_class,
+            reset_on_open=reset_on_open,
+            ready_timeout=ready_timeout,
+            cache_version=cache_version,
+        )
 
     @classmethod
     def mega(
         cls,
         port: str,
         conn_class: Type[SerialConnection] = SerialConnection,
+        reset_on_open: bool = True,
+        ready_timeout: float = 5,
+        cache_version: bool = False,
     ) -> "Arduino":
-        return cls(get_mega_pins(), port, conn_class=conn_class)
+        return cls(
+            get_mega_pins(),
+            port,
+            conn_class=conn_class,
+            reset_on_open=reset_on_open,
+            ready_timeout=ready_timeout,
+            cache_version=cache_version,
+        )
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Queue up pin_mode, digital_write and analog_write calls made inside the
+        context and send them to the Arduino in a single write when it exits.
+
+        Any read made inside the context first sends the queued commands, so the
+        Arduino always sees commands in the order they were called. If an exception
+        is raised inside the context, or sending the queued commands fails, the
+        queued commands are discarded and the pin cache is invalidated.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+            self._flush_batch()
+        except BaseException:
+            if self.pin_cache is not None:
+                self.pin_cache.invalidate()
+            raise
+        finally:
+            self._batch = None
+
+    def flush(self) -> None:
+        """Send any writes that are waiting in a batch or in the connection's buffer"""
+        self._flush_batch()
+        with self._invalidate_cache_on_ack_error():
+            self.connection.flush()
+
+    def __enter__(self) -> "Arduino":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Send any waiting writes and close the connection to the Arduino"""
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+    def negotiate_baudrate(self, max_baudrate: Optional[int] = None) -> int:
+        """Switch both ends of the connection to the fastest baud rate, up to
+        max_baudrate, that the Arduino supports and that passes a parrot test. Returns
+        the baud rate in use afterwards. Sketches older than BAUD_NEGOTIATION_VERSION
+        stay at the current baud rate.
+        """
+        self.flush()
+        current_baudrate = self.connection.baudrate
+        if self.version() < BAUD_NEGOTIATION_VERSION:
+            return current_baudrate
+        supported = self._process_command(CMD_BAUDRATES)[0]
+        for index in sorted(
+            range(len(BAUD_RATES)), key=BAUD_RATES.__getitem__, reverse=True
+        ):
+            baudrate = BAUD_RATES[index]
+            if (
+                supported & (1 << index)
+                and baudrate > current_baudrate
+                and (max_baudrate is None or baudrate <= max_baudrate)
+                and self._try_baudrate(index, current_baudrate)
+            ):
+                return baudrate
+        return current_baudrate
+
+    def _try_baudrate(self, index: int, fallback_baudrate: int) -> bool:
+        if self._process_command(CMD_SETBAUD, index)[0] != index:
+            return False
+        time.sleep(self.baud_switch_delay_s)
+        self.connection.set_baudrate(BAUD_RATES[index])
+        try:
+            # The first parrot also tells the Arduino to keep the new baud rate
+            if all(self.parrot(value) == value for value in (0x55, 0xAA, 0x7E)):
+                return True
+        except (SerialConnectionReceiveDataError, SerialConnectionFrameError):
+            pass
+        time.sleep(self.baud_revert_delay_s)
+        self.connection.set_baudrate(fallback_baudrate)
+        self.poll()
+        return False
+
+    def enable_metrics(self) -> ConnectionMetrics:
+        """Start counting the commands, bytes, errors and retries on the connection
+        and measuring how long each command takes"""
+        return self.connection.enable_metrics()
+
+    def enable_cache(self) -> None:
+        """Remember the last mode, state and PWM value written to each pin. Writes
+        that would not change anything are then not sent, and digital reads of OUTPUT
+        pins are answered without asking the Arduino.
+
+        The cache only knows about changes made through this object, so call
+        invalidate_cache if the Arduino may have been changed in some other way,
+        for example by being reset.
+        """
+        if self.pin_cache is None:
+            self.pin_cache = PinStateCache(len(self.pins))
+
+    def disable_cache(self) -> None:
+        self.pin_cache = None
+
+    def invalidate_cache(self, pin_no: Optional[int] = None) -> None:
+        """Forget the cached values for one pin, or for all pins"""
+        if self.pin_cache is not None:
+            self.pin_cache.invalidate(pin_no)
 
-    @property
-    def pins(self) -> Tuple[Pin, ...]:
-        return self._pins
+    def resync_cache(self) -> None:
+        """Refresh the cached states of OUTPUT pins by reading them from the Arduino.
+        Pin modes cannot be read back, so they are kept as last set"""
+        if self.pin_cache is None:
+            return
+        n_bytes = self._n_port_bytes
+        packed_states = self._process_command(cmd_digitalreadall(n_bytes), n_bytes)
+        self.pin_cache.record_read_states(
+            {
+                pin_no: (packed_states[pin_no // 8] >> (pin_no % 8)) & 1
+                for pin_no in range(len(self.pins))
+            }
+        )
 
     def poll(self) -> int:
-        return self.connection.process_command(CMD_POLL)[0]
+        return self._process_command(CMD_POLL)[0]
 
     def parrot(self, value: int) -> int:
-        return self.connection.process_command(CMD_PARROT, value)[0]
+        return self._process_command(CMD_PARROT, value)[0]
 
     def version(self) -> Tuple[int, ...]:
-        return self.connection.process_command(CMD_VERSION)
+        return self._process_command(CMD_VERSION)
 
     def pin_mode(self, pin_no: int, mode: PinMode, token: Optional[str] = None) -> None:
-        self._assert_valid_pin_number(pin_no)
-        self._assert_pin_not_reserved(pin_no)
-        self._assert_valid_pin_mode(mode)
-        self._assert_pin_not_protected(pin_no, token)
-        self.connection.process_command(CMD_PINMODE, pin_no, mode.value)
+        self._assert_can_pin_mode(pin_no, mode, token)
+        if self.pin_cache is not None and self.pin_cache.modes[pin_no] == mode.value:
+            return
+        self._process_write((pin_no,), CMD_PINMODE, pin_no, mode.value)
+        if self.pin_cache is not None:
+            self.pin_cache.set_mode(pin_no, mode.value)
 
     def digital_read(self, pin_no: int, token: Optional[str] = None) -> PinState:
-        self._assert_valid_pin_number(pin_no)
-        self._assert_pin_not_reserved(pin_no)
-        self._assert_pin_not_protected(pin_no, token)
-        state = self.connection.process_command(CMD_DIGITALREAD, pin_no)
+        self._assert_can_digital_read(pin_no, token)
+        if self.pin_cache is not None:
+            cached_state = self.pin_cache.cached_output_state(pin_no)
+            if cached_state is not None:
+                return HIGH if cached_state == 1 else LOW
+        state = self._process_command(CMD_DIGITALREAD, pin_no)
+        if self.pin_cache is not None:
+            self.pin_cache.record_read_states({pin_no: state[0]})
         if state[0] == 1:
             return HIGH
         else:
@@ -108,107 +348,492 @@ class Arduino:
     def digital_write(
         self, pin_no: int, state: PinState, token: Optional[str] = None
     ) -> None:
-        self._assert_valid_pin_number(pin_no)
-        self._assert_pin_not_reserved(pin_no)
-        self._assert_valid_pin_state(state)
-        self._assert_pin_not_protected(pin_no, token)
-        self.connection.process_command(CMD_DIGITALWRITE, pin_no, state.value)
+        self._assert_can_digital_write(pin_no, state, token)
+        if self.pin_cache is not None and self.pin_cache.states[pin_no] == state.value:
+            return
+        self._process_write((pin_no,), CMD_DIGITALWRITE, pin_no, state.value)
+        if self.pin_cache is not None:
+            self.pin_cache.set_state(pin_no, state.value)
 
-    def analog_read(self, pin_no: int, token: Optional[str] = None) -> int:
-        self._assert_valid_pin_number(pin_no)
-        self._assert_pin_not_reserved(pin_no)
-        self._assert_analog_pin(pin_no)
-        self._assert_pin_not_protected(pin_no, token)
-        return self.connection.process_command(CMD_ANALOGREAD, pin_no)[0]
+    def analog_read(
+        self,
+        pin_no: int,
+        token: Optional[str] = None,
+        oversample: int = 1,
+        median: bool = False,
+    ) -> int:
+        """Read an analog pin. With oversample set to 4, 16 or 64, the Arduino takes
+        that many samples and returns their mean, or their median if median is set,
+        with an extra bit of resolution for each factor of 4: 11, 12 or 13 bits
+        rather than 10."""
+        self._assert_can_analog_read(pin_no, token)
+        self._assert_valid_oversample(oversample)
+        if oversample == 1:
+            return self._process_command(CMD_ANALOGREAD, pin_no)[0]
+        self._assert_sketch_supports(OVERSAMPLING_VERSION)
+        self._flush_batch()
+        # Each sample takes the Arduino's ADC a little over 100 microseconds
+        with self.connection.slow_replies(oversample * 0.00012):
+            (value,) = self._process_command(
+                CMD_ANALOGREADOVERSAMPLED,
+                pin_no,
+                oversample,
+                OVERSAMPLE_MEDIAN if median else OVERSAMPLE_MEAN,
+            )
+        return value
 
     def analog_write(
         self, pin_no: int, value: int, token: Optional[str] = None
     ) -> None:
-        self._assert_valid_pin_number(pin_no)
-        self._assert_pin_not_reserved(pin_no)
-        self._assert_valid_analog_write_range(value)
-        self._assert_pwm_pin(pin_no)
-        self._assert_pin_not_protected(pin_no, token)
-        self.connection.process_command(CMD_ANALOGWRITE, pin_no, value)
-
-    def register_component(self, component_token: str, pins: Tuple[Pin, ...]) -> None:
-        self._assert_requested_pins_are_valid(component_token, pins)
-        for pin in pins:
-            self.pin_register[pin.pin_id] = component_token
-
-    def deregister_component(self, component_token: str) -> None:
-        keys_to_delete = [
-            k for k, v in self.pin_register.items() if v == component_token
-        ]
-        for key in keys_to_delete:
-            del self.pin_register[key]
-
-    def _assert_compatible_sketch_version(self) -> None:
-        version = self.version()
-        if any(
-            (
-                version[0] > self.min_version[0],
-                version[0] < self.min_version[0],
-                version[1] < self.min_version[1],
-                version[2] < self.min_version[2],
-            )
-        ):
-            raise ArduinoSketchVersionIncompatibleError(version, self.min_version)
+        self._assert_can_analog_write(pin_no, value, token)
+        if self.pin_cache is not None and self.pin_cache.pwm_values[pin_no] == value:
+            return
+        self._process_write((pin_no,), CMD_ANALOGWRITE, pin_no, value)
+        if self.pin_cache is not None:
+            self.pin_cache.set_pwm_value(pin_no, value)
 
-    def _assert_requested_pins_are_valid(
-        self, component_token: str, pins: Tuple[Pin, ...]
+    def digital_write_many(
+        self, states: Mapping[int, PinState], token: Optional[str] = None
     ) -> None:
-        for pin in pins:
-            if pin.pin_id in self.pin_register:
-                raise PinAlreadyRegisteredError(pin.pin_id)
-            if pin.pin_id >= len(self._pins):
-                self._assert_valid_pin_number(pin.pin_id)
-            if pin.is_analog and not self._pins[pin.pin_id].is_analog:
-                raise NotAnalogPinError(pin.pin_id)
-            if pin.is_pwm and not self._pins[pin.pin_id].is_pwm:
-                raise NotPwmPinError(pin.pin_id)
-            self._assert_pin_not_reserved(pin.pin_id)
-        if component_token in self.pin_register.values():
-            raise ComponentAlreadyRegisteredError
-
-    def _assert_valid_pin_number(self, pin_no: int) -> None:
-        if (pin_no >= len(self.pins)) or (pin_no < 0):
-            raise PinDoesNotExistError(pin_no)
-
-    def _assert_analog_pin(self, pin_no: int) -> None:
-        if not self.pins[pin_no].is_analog:
-            raise NotAnalogPinError(pin_no)
-
-    def _assert_pwm_pin(self, pin_no: int) -> None:
-        if not self.pins[pin_no].is_pwm:
-            raise NotPwmPinError(pin_no)
-
-    def _assert_pin_not_reserved(self, pin_no: int) -> None:
-        if pin_no in self.reserved_pin_nums:
-            raise PinIsReservedForSerialCommsError(pin_no)
-
-    def _assert_pin_not_protected(self, pin_no: int, token: Optional[str]) -> None:
-        if pin_no in self.pin_register and self.pin_register[pin_no] != token:
-            raise ProtectedPinError(token)
-
-    @staticmethod
-    def _assert_valid_analog_write_range(value: int) -> None:
-        if (value < 0) or (value > 255):
+        """Set the state of several pins using a single command"""
+        self._assert_can_digital_write_many(states, token)
+        if self.pin_cache is not None:
+            cache = self.pin_cache
+            states = {
+                pin_no: state
+                for pin_no, state in states.items()
+                if cache.states[pin_no] != state.value
+            }
+            if not states:
+                return
+        self._process_write(
+            tuple(states),
+            cmd_digitalwritemany(self._n_port_bytes),
+            *self._pack_digital_states(states),
+        )
+        if self.pin_cache is not None:
+            for pin_no, state in states.items():
+                self.pin_cache.set_state(pin_no, state.value)
+
+    def digital_read_all(self, token: Optional[str] = None) -> Dict[int, PinState]:
+        """Read the state of every pin using a single command. Pins that are reserved,
+        or registered to a component other than the one owning the token, are omitted
+        """
+        n_bytes = self._n_port_bytes
+        packed_states = self._process_command(cmd_digitalreadall(n_bytes), n_bytes)
+        states = self._unpack_digital_states(packed_states, token)
+        if self.pin_cache is not None:
+            self.pin_cache.record_read_states(
+                {pin_no: state.value for pin_no, state in states.items()}
+            )
+        return states
+
+    def analog_read_many(
+        self, pin_nos: Sequence[int], token: Optional[str] = None
+    ) -> Tuple[int, ...]:
+        """Read several analog pins using a single command. Values are returned in
+        the order the pins were given"""
+        self._assert_can_analog_read_many(pin_nos, token)
+        return self._process_command(
+            cmd_analogreadmany(len(pin_nos)), len(pin_nos), *pin_nos
+        )
+
+    def stream(
+        self, pin_nos: Sequence[int], rate_hz: int, token: Optional[str] = None
+    ) -> Generator[StreamFrame, None, None]:
+        """Sample the analog pins on the Arduino at rate_hz and yield each set of
+        samples as it arrives, without a round trip per sample. The Arduino keeps
+        sampling until the iterator is closed, so close it (for example with
+        contextlib.closing) once you are done. No other commands can be sent while
+        streaming.
+        """
+        if self._macro is not None:
+            raise ValueError("Streams cannot be run from a macro")
+        self._assert_can_analog_read_many(pin_nos, token)
+        self._assert_valid_stream_size(len(pin_nos))
+        self._assert_valid_stream_rate(rate_hz)
+        return self._stream(pin_nos, rate_hz)
+
+    def acquire(
+        self,
+        pin_nos: Sequence[int],
+        rate_hz: int,
+        n_frames: int,
+        buffer: Optional[SampleBuffer] = None,
+        token: Optional[str] = None,
+    ) -> SampleBuffer:
+        """Stream the analog pins at rate_hz until n_frames sets of samples have
+        arrived, decoding them in bulk straight into buffer, or into a new
+        SampleBuffer holding n_frames, and return the buffer. Unlike stream, nothing
+        is created per sample, so long captures at high rates stay cheap.
+        """
+        if self._macro is not None:
+            raise ValueError("Streams cannot be run from a macro")
+        self._assert_can_analog_read_many(pin_nos, token)
+        self._assert_valid_stream_size(len(pin_nos))
+        self._assert_valid_stream_rate(rate_hz)
+        if buffer is None:
+            buffer = SampleBuffer(len(pin_nos), n_frames)
+        elif buffer.n_pins != len(pin_nos):
             raise ValueError(
-                f"Specified analog value {value} should be an int in the range 0 to 255"
+                f"Buffer holds {buffer.n_pins} pins but {len(pin_nos)} given"
             )
+        self._start_stream(pin_nos, rate_hz)
+        ended = False
+        try:
+            remaining = n_frames
+            while remaining > 0 and not ended:
+                data, ended = self.connection.recv_stream_frames(
+                    len(pin_nos), remaining
+                )
+                remaining -= buffer.extend_frames(data)
+        finally:
+            if not ended:
+                self._stop_stream(len(pin_nos))
+        return buffer
+
+    def schedule(
+        self,
+        pin_no: int,
+        state: PinState,
+        delay_us: int = 0,
+        high_us: int = 0,
+        low_us: int = 0,
+        n_edges: int = 1,
+        token: Optional[str] = None,
+    ) -> int:
+        """Have the Arduino write state to an OUTPUT pin delay_us from now, timed by
+        its own clock rather than by the host. With n_edges above 1 the pin then keeps
+        changing, held HIGH for high_us and LOW for low_us, until n_edges have been
+        written; n_edges=0 carries on until cancelled. Returns a slot number to pass
+        to cancel_scheduled.
+
+        Edges are written between commands, so a long running command such as
+        pulse_in delays them. The pin cache cannot follow scheduled changes, so the
+        pin is dropped from it.
+        """
+        self._assert_can_digital_write(pin_no, state, token)
+        for duration_us in (delay_us, high_us, low_us):
+            self._assert_valid_duration_us(duration_us)
+        if (n_edges < 0) or (n_edges >= 1 << 32):
+            raise ValueError(f"Specified number of edges {n_edges} is out of range")
+        self._assert_sketch_supports(SCHEDULING_VERSION)
+        if self.pin_cache is not None:
+            self.pin_cache.invalidate(pin_no)
+        slot = self._process_command(
+            CMD_SCHEDULE, pin_no, state.value, delay_us, high_us, low_us, n_edges
+        )[0]
+        if slot == SCHEDULE_FULL:
+            raise ArduinoScheduleFullError(MAX_SCHEDULED)
+        return slot
+
+    def pulse_train(
+        self,
+        pin_no: int,
+        n_pulses: int,
+        high_us: int,
+        low_us: int,
+        delay_us: int = 0,
+        token: Optional[str] = None,
+    ) -> int:
+        """Have the Arduino write n_pulses HIGH pulses of high_us, separated by low_us,
+        starting delay_us from now"""
+        if n_pulses < 1:
+            raise ValueError(f"Specified number of pulses {n_pulses} should be >= 1")
+        return self.schedule(
+            pin_no, HIGH, delay_us, high_us, low_us, 2 * n_pulses, token
+        )
 
-    @staticmethod
-    def _assert_valid_pin_mode(mode: PinMode) -> None:
-        if mode not in [INPUT, OUTPUT, INPUT_PULLUP]:
+    def toggle(
+        self,
+        pin_no: int,
+        period_us: int,
+        delay_us: int = 0,
+        token: Optional[str] = None,
+    ) -> int:
+        """Have the Arduino toggle a pin with the given period, starting delay_us from
+        now, until cancelled"""
+        high_us = period_us // 2
+        return self.schedule(
+            pin_no, HIGH, delay_us, high_us, period_us - high_us, 0, token
+        )
+
+    def cancel_scheduled(self, slot: Optional[int] = None) -> None:
+        """Cancel one scheduled action, or all of them"""
+        self._assert_sketch_supports(SCHEDULING_VERSION)
+        self._process_command(
+            CMD_CANCELSCHEDULE, SCHEDULE_ALL if slot is None else slot
+        )
+
+    def pulse_in(
+        self,
+        pin_no: int,
+        state: PinState,
+        timeout_us: int = 1000000,
+        token: Optional[str] = None,
+    ) -> int:
+        """Measure the length in microseconds of the next pulse at state on a pin, as
+        Arduino's pulseIn does, or return 0 if none is complete within timeout_us.
+        The Arduino can do nothing else while measuring."""
+        self._assert_can_digital_read(pin_no, token)
+        self._assert_valid_pin_state(state)
+        self._assert_valid_duration_us(timeout_us)
+        self._assert_sketch_supports(SCHEDULING_VERSION)
+        self._flush_batch()
+        with self.connection.slow_replies(timeout_us / 1e6):
+            (length_us,) = self._process_command(
+                CMD_PULSEIN, pin_no, state.value, timeout_us
+            )
+        return length_us
+
+    @contextmanager
+    def record_macro(self, slot: int = 0) -> Iterator[Macro]:
+        """Record the commands made inside the context instead of sending them, then
+        upload them to the Arduino as a macro in slot, replacing whatever was there.
+        run_macro then runs them all with a single round trip.
+
+        Reads inside the context return zeros; their real values are returned by
+        run_macro. The pin cache is bypassed while recording.
+        """
+        if not 0 <= slot < MAX_MACROS:
             raise ValueError(
-                f"pin_mode must be INPUT, OUTPUT or INPUT_PULLUP"
-                f"but {mode.name} was found"
+                f"Specified macro slot {slot} should be in the range 0 to"
+                f" {MAX_MACROS - 1}"
+            )
+        self._assert_sketch_supports(MACRO_VERSION)
+        self._flush_batch()
+        macro = Macro(slot)
+        pin_cache = self.pin_cache
+        self.pin_cache = None
+        self._macro = macro
+        try:
+            yield macro
+        finally:
+            self._macro = None
+            self.pin_cache = pin_cache
+        code = macro.code
+        if len(code) > MAX_MACRO_SIZE:
+            raise ValueError(
+                f"Macro is {len(code)} bytes, but can be at most {MAX_MACRO_SIZE}"
+            )
+        for offset in range(0, max(len(code), 1), MACRO_CHUNK_SIZE):
+            chunk = code[offset : offset + MACRO_CHUNK_SIZE]
+            self._process_command(
+                cmd_macrowrite(len(chunk)), slot, offset, len(chunk), *chunk
             )
 
-    @staticmethod
-    def _assert_valid_pin_state(state: PinState) -> None:
-        if state not in [HIGH, LOW]:
+    def run_macro(self, macro: Macro, n_repeats: int = 1) -> List[Tuple[int, ...]]:
+        """Run a macro uploaded by record_macro n_repeats times over, with a single
+        round trip. Returns the replies to each command in it that has one, in the
+        order they ran"""
+        if not 1 <= n_repeats <= 255:
+            raise ValueError(
+                f"Specified number of repeats {n_repeats} should be in the range 1 to"
+                " 255"
+            )
+        rx_size = macro.rx_size * n_repeats
+        # Framed replies also carry a status byte
+        if self.connection.framing and rx_size >= MAX_FRAME_BODY:
             raise ValueError(
-                f"pin_state must be HIGH or LOW but {state.name} was found"
+                f"Macro replies are {rx_size} bytes, but can be at most"
+                f" {MAX_FRAME_BODY - 1}"
             )
+        if self.pin_cache is not None:
+            self.pin_cache.invalidate()
+        reply = self._process_command(cmd_macrorun(rx_size), macro.slot, n_repeats)
+        return macro.decode_replies(bytes(reply))
+
+    def watch_digital(
+        self,
+        pin_no: int,
+        callback: Optional[Callable[[DigitalEvent], None]] = None,
+        debounce_us: int = 5000,
+        use_interrupt: bool = False,
+        token: Optional[str] = None,
+    ) -> PinState:
+        """Have the Arduino send an event whenever the pin changes state and then keeps
+        its new state for debounce_us, instead of polling it with digital_read.
+        With use_interrupt=True, pins with a hardware interrupt are timestamped by it,
+        so that short changes are not missed. Returns the pin's current state.
+
+        Events are read by process_events, which calls the callbacks, or by iterating
+        over events. They are not sent while streaming.
+        """
+        self._assert_can_digital_read(pin_no, token)
+        self._assert_valid_duration_us(debounce_us)
+        self._assert_sketch_supports(EVENTS_VERSION)
+        mode, state = self._process_command(
+            CMD_WATCHDIGITAL, pin_no, debounce_us, int(use_interrupt)
+        )
+        if mode == WATCH_FULL:
+            raise ArduinoWatchListFullError(MAX_WATCHED)
+        if callback is not None:
+            self._digital_callbacks.setdefault(pin_no, []).append(callback)
+        return HIGH if state == 1 else LOW
+
+    def watch_analog(
+        self,
+        pin_no: int,
+        callback: Optional[Callable[[AnalogEvent], None]] = None,
+        threshold: Optional[int] = None,
+        hysteresis: int = 0,
+        min_delta: int = 0,
+        interval_us: int = 1000,
+        token: Optional[str] = None,
+    ) -> int:
+        """Have the Arduino sample an analog pin every interval_us and send an event
+        only when the value changes meaningfully, instead of polling it with
+        analog_read: a "rise" event once it reaches threshold, a "fall" event once it
+        drops below threshold - hysteresis, or otherwise a "delta" event once it has
+        moved by at least min_delta since the last event. Returns the pin's current
+        value.
+        """
+        self._assert_can_analog_read(pin_no, token)
+        for value in (threshold or 0, hysteresis, min_delta):
+            self._assert_valid_analog_read_range(value)
+        if threshold is None and not min_delta:
+            raise ValueError("Specify a threshold, a min_delta or both")
+        self._assert_valid_duration_us(interval_us)
+        self._assert_sketch_supports(ANALOG_EVENTS_VERSION)
+        mode, value = self._process_command(
+            CMD_WATCHANALOG,
+            pin_no,
+            NO_THRESHOLD if threshold is None else threshold,
+            hysteresis,
+            min_delta,
+            interval_us,
+        )
+        if mode == WATCH_FULL:
+            raise ArduinoWatchListFullError(MAX_ANALOG_WATCHED)
+        if callback is not None:
+            self._analog_callbacks.setdefault(pin_no, []).append(callback)
+        return value
+
+    def unwatch(self, pin_no: Optional[int] = None) -> None:
+        """Stop watching one pin, digital or analog, or all of them, and drop their
+        callbacks"""
+        self._assert_sketch_supports(EVENTS_VERSION)
+        self._process_command(CMD_UNWATCH, UNWATCH_ALL if pin_no is None else pin_no)
+        for callbacks in (self._digital_callbacks, self._analog_callbacks):
+            if pin_no is None:
+                callbacks.clear()
+            else:
+                callbacks.pop(pin_no, None)
+
+    def process_events(
+        self, timeout: float = 0
+    ) -> List[Union[DigitalEvent, AnalogEvent]]:
+        """Read the events the Arduino has sent, waiting up to timeout seconds for one
+        if none has arrived yet, and pass each to the callbacks for its pin"""
+        self._flush_batch()
+        events: List[Union[DigitalEvent, AnalogEvent]] = []
+        for body in self.connection.recv_events(timeout):
+            event_type, pin_no, value, timestamp_us = event_struct.unpack_from(body)
+            if event_type == EVENT_DIGITAL:
+                digital_event = DigitalEvent(
+                    pin_no, HIGH if value == 1 else LOW, timestamp_us
+                )
+                for digital_callback in self._digital_callbacks.get(pin_no, ()):
+                    digital_callback(digital_event)
+                events.append(digital_event)
+            elif event_type in _ANALOG_EVENT_KINDS:
+                analog_event = AnalogEvent(
+                    pin_no, _ANALOG_EVENT_KINDS[event_type], value, timestamp_us
+                )
+                for analog_callback in self._analog_callbacks.get(pin_no, ()):
+                    analog_callback(analog_event)
+                events.append(analog_event)
+        return events
+
+    async def events(
+        self, poll_interval_s: float = 0.005
+    ) -> AsyncIterator[Union[DigitalEvent, AnalogEvent]]:
+        """Yield events from watched pins as they arrive, checking for them every
+        poll_interval_s without blocking the event loop. Checking reads only what the
+        Arduino has already sent, so sends nothing over the link"""
+        while True:
+            for event in self.process_events():
+                yield event
+            await asyncio.sleep(poll_interval_s)
+
+    def _assert_sketch_supports(self, version: Tuple[int, int, int]) -> None:
+        if self.sketch_version < version:
+            raise ArduinoSketchVersionIncompatibleError(self.sketch_version, version)
+
+    def _process_command(self, command: CommandSpec, *args: int) -> Tuple[int, ...]:
+        if self._macro is not None:
+            if command.cmd in MACRO_EXCLUDED_CMDS:
+                raise ValueError(f"Command {command.cmd} cannot be run from a macro")
+            self._macro.commands.append((command, args))
+            return (0,) * command.rx_len
+        if self._batch is not None:
+            if command.rx_len == 0:
+                self._batch.append((command, args))
+                return ()
+            self._flush_batch()
+        with self._invalidate_cache_on_ack_error():
+            return self.connection.process_command(command, *args)
+
+    def _process_write(
+        self, pin_nos: Sequence[int], command: CommandSpec, *args: int
+    ) -> None:
+        """Send a command that changes pin_nos, forgetting their cached state if it
+        fails, as the Arduino may or may not have run it"""
+        try:
+            self._process_command(command, *args)
+        except BaseException:
+            if self.pin_cache is not None:
+                for pin_no in pin_nos:
+                    self.pin_cache.invalidate(pin_no)
+            raise
+
+    @contextmanager
+    def _invalidate_cache_on_ack_error(self) -> Iterator[None]:
+        """A deferred connection reports commands lost earlier on a later call, so
+        any cached state may be wrong"""
+        try:
+            yield
+        except SerialConnectionAckError:
+            if self.pin_cache is not None:
+                self.pin_cache.invalidate()
+            raise
+
+    def _stream(
+        self, pin_nos: Sequence[int], rate_hz: int
+    ) -> Generator[StreamFrame, None, None]:
+        self._start_stream(pin_nos, rate_hz)
+        ended = False
+        try:
+            wraps = 0
+            last_timestamp = 0
+            while True:
+                frame = self.connection.recv_stream_frame(len(pin_nos))
+                if frame is None:
+                    ended = True
+                    return
+                timestamp = frame[0]
+                if timestamp < last_timestamp:
+                    wraps += 1
+                last_timestamp = timestamp
+                yield StreamFrame(timestamp + (wraps << 32), frame[1:])
+        finally:
+            if not ended:
+                self._stop_stream(len(pin_nos))
+
+    def _start_stream(self, pin_nos: Sequence[int], rate_hz: int) -> None:
+        self._flush_batch()
+        with self._invalidate_cache_on_ack_error():
+            self.connection.process_command(
+                cmd_streamstart(len(pin_nos)), rate_hz, len(pin_nos), *pin_nos
+            )
+
+    def _stop_stream(self, n_pins: int) -> None:
+        self.connection.send_unframed(CMD_STREAMSTOP)
+        while self.connection.recv_stream_frame(n_pins) is not None:
+            pass
+
+    def _flush_batch(self) -> None:
+        if self._batch:
+            with self._invalidate_cache_on_ack_error():
+                self.connection.process_commands(self._batch)
+            self._batch = []
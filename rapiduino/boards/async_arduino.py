@@ -0,0 +1,140 @@
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Type
+
+from rapiduino.boards.base_board import BaseBoard
+from rapiduino.boards.pins import Pin, get_mega_pins, get_nano_pins, get_uno_pins
+from rapiduino.communication.async_serial import AsyncSerialConnection
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_ANALOGWRITE,
+    CMD_DIGITALREAD,
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_PINMODE,
+    CMD_POLL,
+    CMD_VERSION,
+    cmd_analogreadmany,
+    cmd_digitalreadall,
+    cmd_digitalwritemany,
+)
+from rapiduino.globals.common import HIGH, LOW, PinMode, PinState
+
+
+class AsyncArduino(BaseBoard):
+    """An Arduino driven from asyncio. Create one with the connect, uno, nano or mega
+    coroutines. Requests made concurrently, for example with asyncio.gather, are
+    pipelined over the serial connection rather than waiting for each other."""
+
+    def __init__(
+        self,
+        pins: Tuple[Pin, ...],
+        connection: AsyncSerialConnection,
+        rx_pin: int = 0,
+        tx_pin: int = 1,
+    ) -> None:
+        super().__init__(pins, rx_pin=rx_pin, tx_pin=tx_pin)
+        self.connection = connection
+
+    @classmethod
+    async def connect(
+        cls,
+        pins: Tuple[Pin, ...],
+        port: str,
+        rx_pin: int = 0,
+        tx_pin: int = 1,
+        conn_class: Type[AsyncSerialConnection] = AsyncSerialConnection,
+    ) -> "AsyncArduino":
+        connection = await conn_class.build(port)
+        arduino = cls(pins, connection, rx_pin=rx_pin, tx_pin=tx_pin)
+        arduino._assert_compatible_sketch_version(await arduino.version())
+        return arduino
+
+    @classmethod
+    async def uno(
+        cls,
+        port: str,
+        conn_class: Type[AsyncSerialConnection] = AsyncSerialConnection,
+    ) -> "AsyncArduino":
+        return await cls.connect(get_uno_pins(), port, conn_class=conn_class)
+
+    @classmethod
+    async def nano(
+        cls,
+        port: str,
+        conn_class: Type[AsyncSerialConnection] = AsyncSerialConnection,
+    ) -> "AsyncArduino":
+        return await cls.connect(get_nano_pins(), port, conn_class=conn_class)
+
+    @classmethod
+    async def mega(
+        cls,
+        port: str,
+        conn_class: Type[AsyncSerialConnection] = AsyncSerialConnection,
+    ) -> "AsyncArduino":
+        return await cls.connect(get_mega_pins(), port, conn_class=conn_class)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    async def poll(self) -> int:
+        return (await self.connection.process_command(CMD_POLL))[0]
+
+    async def parrot(self, value: int) -> int:
+        return (await self.connection.process_command(CMD_PARROT, value))[0]
+
+    async def version(self) -> Tuple[int, ...]:
+        return await self.connection.process_command(CMD_VERSION)
+
+    async def pin_mode(
+        self, pin_no: int, mode: PinMode, token: Optional[str] = None
+    ) -> None:
+        self._assert_can_pin_mode(pin_no, mode, token)
+        await self.connection.process_command(CMD_PINMODE, pin_no, mode.value)
+
+    async def digital_read(self, pin_no: int, token: Optional[str] = None) -> PinState:
+        self._assert_can_digital_read(pin_no, token)
+        state = await self.connection.process_command(CMD_DIGITALREAD, pin_no)
+        if state[0] == 1:
+            return HIGH
+        else:
+            return LOW
+
+    async def digital_write(
+        self, pin_no: int, state: PinState, token: Optional[str] = None
+    ) -> None:
+        self._assert_can_digital_write(pin_no, state, token)
+        await self.connection.process_command(CMD_DIGITALWRITE, pin_no, state.value)
+
+    async def analog_read(self, pin_no: int, token: Optional[str] = None) -> int:
+        self._assert_can_analog_read(pin_no, token)
+        return (await self.connection.process_command(CMD_ANALOGREAD, pin_no))[0]
+
+    async def analog_write(
+        self, pin_no: int, value: int, token: Optional[str] = None
+    ) -> None:
+        self._assert_can_analog_write(pin_no, value, token)
+        await self.connection.process_command(CMD_ANALOGWRITE, pin_no, value)
+
+    async def digital_write_many(
+        self, states: Mapping[int, PinState], token: Optional[str] = None
+    ) -> None:
+        self._assert_can_digital_write_many(states, token)
+        await self.connection.process_command(
+            cmd_digitalwritemany(self._n_port_bytes), *self._pack_digital_states(states)
+        )
+
+    async def digital_read_all(
+        self, token: Optional[str] = None
+    ) -> Dict[int, PinState]:
+        n_bytes = self._n_port_bytes
+        packed_states = await self.connection.process_command(
+            cmd_digitalreadall(n_bytes), n_bytes
+        )
+        return self._unpack_digital_states(packed_states, token)
+
+    async def analog_read_many(
+        self, pin_nos: Sequence[int], token: Optional[str] = None
+    ) -> Tuple[int, ...]:
+        self._assert_can_analog_read_many(pin_nos, token)
+        return await self.connection.process_command(
+            cmd_analogreadmany(len(pin_nos)), len(pin_nos), *pin_nos
+        )
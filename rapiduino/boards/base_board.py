@@ -0,0 +1,278 @@
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from rapiduino.boards.pins import Pin
+from rapiduino.exceptions import (
+    ArduinoSketchVersionIncompatibleError,
+    ComponentAlreadyRegisteredError,
+    NotAnalogPinError,
+    NotPwmPinError,
+    PinAlreadyRegisteredError,
+    PinDoesNotExistError,
+    PinIsReservedForSerialCommsError,
+    ProtectedPinError,
+)
+from rapiduino.globals.common import (
+    HIGH,
+    INPUT,
+    INPUT_PULLUP,
+    LOW,
+    OUTPUT,
+    PinMode,
+    PinState,
+)
+
+# Flags in the pin capability table
+_PWM = 1
+_ANALOG = 2
+_RESERVED = 4
+
+
+class BaseBoard:
+    """Pin bookkeeping and validation shared by the blocking and asyncio boards.
+
+    Validation first tries a fast check against tables of pin capabilities and owners
+    built up front. Only when that check fails are the individual checks run, to work
+    out which error to raise.
+
+    Set trust_components to True to skip the pin capability checks for calls made
+    with the token of the component that owns the pin. The pins were checked when the
+    component was registered, so this only relaxes checks for capabilities that the
+    component did not declare when registering.
+    """
+
+    min_version = (0, 2, 0)
+    trust_components = False
+
+    def __init__(self, pins: Tuple[Pin, ...], rx_pin: int = 0, tx_pin: int = 1) -> None:
+        self._pins = pins
+        self.pin_register: Dict[int, str] = {}
+        self.reserved_pin_nums = (rx_pin, tx_pin)
+        self._pin_caps = bytearray(
+            (_PWM if pin.is_pwm else 0)
+            | (_ANALOG if pin.is_analog else 0)
+            | (_RESERVED if pin_no in self.reserved_pin_nums else 0)
+            for pin_no, pin in enumerate(pins)
+        )
+        self._pin_owners: List[Optional[str]] = [None] * len(pins)
+
+    @property
+    def pins(self) -> Tuple[Pin, ...]:
+        return self._pins
+
+    def register_component(self, component_token: str, pins: Tuple[Pin, ...]) -> None:
+        self._assert_requested_pins_are_valid(component_token, pins)
+        for pin in pins:
+            self.pin_register[pin.pin_id] = component_token
+            self._pin_owners[pin.pin_id] = component_token
+
+    def deregister_component(self, component_token: str) -> None:
+        keys_to_delete = [
+            k for k, v in self.pin_register.items() if v == component_token
+        ]
+        for key in keys_to_delete:
+            del self.pin_register[key]
+            self._pin_owners[key] = None
+
+    @property
+    def _n_port_bytes(self) -> int:
+        return (len(self.pins) + 7) // 8
+
+    def _pack_digital_states(self, states: Mapping[int, PinState]) -> Tuple[int, ...]:
+        n_bytes = self._n_port_bytes
+        mask = [0] * n_bytes
+        values = [0] * n_bytes
+        for pin_no, state in states.items():
+            mask[pin_no // 8] |= 1 << (pin_no % 8)
+            values[pin_no // 8] |= state.value << (pin_no % 8)
+        return (n_bytes, *mask, *values)
+
+    def _unpack_digital_states(
+        self, packed_states: Tuple[int, ...], token: Optional[str]
+    ) -> Dict[int, PinState]:
+        states = {}
+        for pin in self.pins:
+            pin_no = pin.pin_id
+            if pin_no in self.reserved_pin_nums:
+                continue
+            if pin_no in self.pin_register and self.pin_register[pin_no] != token:
+                continue
+            bit = (packed_states[pin_no // 8] >> (pin_no % 8)) & 1
+            states[pin_no] = HIGH if bit else LOW
+        return states
+
+    def _can_use_pin(
+        self, pin_no: int, required_caps: int, token: Optional[str]
+    ) -> bool:
+        if not 0 <= pin_no < len(self._pin_caps):
+            return False
+        owner = self._pin_owners[pin_no]
+        if owner is not None:
+            if owner != token:
+                return False
+            if self.trust_components:
+                return True
+        return self._pin_caps[pin_no] & (_RESERVED | required_caps) == required_caps
+
+    def _assert_can_pin_mode(
+        self, pin_no: int, mode: PinMode, token: Optional[str]
+    ) -> None:
+        if self._can_use_pin(pin_no, 0, token) and (
+            mode is INPUT or mode is OUTPUT or mode is INPUT_PULLUP
+        ):
+            return
+        self._assert_valid_pin_number(pin_no)
+        self._assert_pin_not_reserved(pin_no)
+        self._assert_valid_pin_mode(mode)
+        self._assert_pin_not_protected(pin_no, token)
+
+    def _assert_can_digital_read(self, pin_no: int, token: Optional[str]) -> None:
+        if self._can_use_pin(pin_no, 0, token):
+            return
+        self._assert_valid_pin_number(pin_no)
+        self._assert_pin_not_reserved(pin_no)
+        self._assert_pin_not_protected(pin_no, token)
+
+    def _assert_can_digital_write(
+        self, pin_no: int, state: PinState, token: Optional[str]
+    ) -> None:
+        if self._can_use_pin(pin_no, 0, token) and (state is HIGH or state is LOW):
+            return
+        self._assert_valid_pin_number(pin_no)
+        self._assert_pin_not_reserved(pin_no)
+        self._assert_valid_pin_state(state)
+        self._assert_pin_not_protected(pin_no, token)
+
+    def _assert_can_analog_read(self, pin_no: int, token: Optional[str]) -> None:
+        if self._can_use_pin(pin_no, _ANALOG, token):
+            return
+        self._assert_valid_pin_number(pin_no)
+        self._assert_pin_not_reserved(pin_no)
+        self._assert_analog_pin(pin_no)
+        self._assert_pin_not_protected(pin_no, token)
+
+    def _assert_can_analog_write(
+        self, pin_no: int, value: int, token: Optional[str]
+    ) -> None:
+        if self._can_use_pin(pin_no, _PWM, token) and 0 <= value <= 255:
+            return
+        self._assert_valid_pin_number(pin_no)
+        self._assert_pin_not_reserved(pin_no)
+        self._assert_valid_analog_write_range(value)
+        self._assert_pwm_pin(pin_no)
+        self._assert_pin_not_protected(pin_no, token)
+
+    def _assert_can_analog_read_many(
+        self, pin_nos: Sequence[int], token: Optional[str]
+    ) -> None:
+        for pin_no in pin_nos:
+            self._assert_can_analog_read(pin_no, token)
+
+    def _assert_can_digital_write_many(
+        self, states: Mapping[int, PinState], token: Optional[str]
+    ) -> None:
+        for pin_no, state in states.items():
+            self._assert_can_digital_write(pin_no, state, token)
+
+    def _assert_compatible_sketch_version(self, version: Tuple[int, ...]) -> None:
+        if any(
+            (
+                version[0] > self.min_version[0],
+                version[0] < self.min_version[0],
+                version[1] < self.min_version[1],
+                version[2] < self.min_version[2],
+            )
+        ):
+            raise ArduinoSketchVersionIncompatibleError(version, self.min_version)
+
+    def _assert_requested_pins_are_valid(
+        self, component_token: str, pins: Tuple[Pin, ...]
+    ) -> None:
+        for pin in pins:
+            if pin.pin_id in self.pin_register:
+                raise PinAlreadyRegisteredError(pin.pin_id)
+            if pin.pin_id >= len(self._pins):
+                self._assert_valid_pin_number(pin.pin_id)
+            if pin.is_analog and not self._pins[pin.pin_id].is_analog:
+                raise NotAnalogPinError(pin.pin_id)
+            if pin.is_pwm and not self._pins[pin.pin_id].is_pwm:
+                raise NotPwmPinError(pin.pin_id)
+            self._assert_pin_not_reserved(pin.pin_id)
+        if component_token in self.pin_register.values():
+            raise ComponentAlreadyRegisteredError
+
+    def _assert_valid_pin_number(self, pin_no: int) -> None:
+        if (pin_no >= len(self.pins)) or (pin_no < 0):
+            raise PinDoesNotExistError(pin_no)
+
+    def _assert_analog_pin(self, pin_no: int) -> None:
+        if not self.pins[pin_no].is_analog:
+            raise NotAnalogPinError(pin_no)
+
+    def _assert_pwm_pin(self, pin_no: int) -> None:
+        if not self.pins[pin_no].is_pwm:
+            raise NotPwmPinError(pin_no)
+
+    def _assert_pin_not_reserved(self, pin_no: int) -> None:
+        if pin_no in self.reserved_pin_nums:
+            raise PinIsReservedForSerialCommsError(pin_no)
+
+    def _assert_pin_not_protected(self, pin_no: int, token: Optional[str]) -> None:
+        if pin_no in self.pin_register and self.pin_register[pin_no] != token:
+            raise ProtectedPinError(token)
+
+    @staticmethod
+    def _assert_valid_analog_write_range(value: int) -> None:
+        if (value < 0) or (value > 255):
+            raise ValueError(
+                f"Specified analog value {value} should be an int in the range 0 to 255"
+            )
+
+    @staticmethod
+    def _assert_valid_analog_read_range(value: int) -> None:
+        if (value < 0) or (value > 1023):
+            raise ValueError(
+                f"Specified analog value {value} should be an int from 0 to 1023"
+            )
+
+    @staticmethod
+    def _assert_valid_oversample(n_samples: int) -> None:
+        if n_samples not in (1, 4, 16, 64):
+            raise ValueError(
+                f"Specified oversample {n_samples} should be one of 1, 4, 16 or 64"
+            )
+
+    @staticmethod
+    def _assert_valid_stream_size(n_pins: int) -> None:
+        if (n_pins < 1) or (n_pins > 16):
+            raise ValueError(f"Can stream between 1 and 16 pins but {n_pins} given")
+
+    @staticmethod
+    def _assert_valid_stream_rate(rate_hz: int) -> None:
+        if (rate_hz < 1) or (rate_hz > 65535):
+            raise ValueError(
+                f"Specified rate {rate_hz} should be an int in the range 1 to 65535"
+            )
+
+    @staticmethod
+    def _assert_valid_duration_us(duration_us: int) -> None:
+        # The sketch compares times as signed 32-bit differences
+        if (duration_us < 0) or (duration_us >= 1 << 31):
+            raise ValueError(
+                f"Specified duration {duration_us} should be an int in the range 0 to"
+                f" {(1 << 31) - 1} microseconds"
+            )
+
+    @staticmethod
+    def _assert_valid_pin_mode(mode: PinMode) -> None:
+        if mode not in [INPUT, OUTPUT, INPUT_PULLUP]:
+            raise ValueError(
+                f"pin_mode must be INPUT, OUTPUT or INPUT_PULLUP"
+                f"but {mode.name} was found"
+            )
+
+    @staticmethod
+    def _assert_valid_pin_state(state: PinState) -> None:
+        if state not in [HIGH, LOW]:
+            raise ValueError(
+                f"pin_state must be HIGH or LOW but {state.name} was found"
+            )
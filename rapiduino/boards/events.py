@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+
+from rapiduino.globals.common import PinState
+
+
+@dataclass(frozen=True)
+class DigitalEvent:
+    """A watched pin changing state. The timestamp is the Arduino's 32-bit micros()
+    when the change happened, so it wraps around every 71 minutes"""
+
+    pin_no: int
+    state: PinState
+    timestamp_us: int
+
+
+@dataclass(frozen=True)
+class AnalogEvent:
+    """A watched analog pin crossing its threshold, when kind is "rise" or "fall", or
+    moving by at least its minimum delta, when kind is "delta". The timestamp is the
+    Arduino's 32-bit micros() when the value was sampled"""
+
+    pin_no: int
+    kind: str
+    value: int
+    timestamp_us: int
@@ -0,0 +1,34 @@
+from typing import List, Tuple
+
+from rapiduino.communication.serial import Command
+
+
+class Macro:
+    """Commands recorded by Arduino.record_macro, to be run on the Arduino by
+    Arduino.run_macro. The code is the commands encoded just as they are sent without
+    framing"""
+
+    def __init__(self, slot: int) -> None:
+        self.slot = slot
+        self.commands: List[Command] = []
+
+    @property
+    def code(self) -> bytes:
+        return b"".join(command.encode(*args) for command, args in self.commands)
+
+    @property
+    def rx_size(self) -> int:
+        """The number of bytes the Arduino replies with each time the macro runs"""
+        return sum(command.rx_size for command, _ in self.commands)
+
+    def decode_replies(self, data: bytes) -> List[Tuple[int, ...]]:
+        """Split the replies to one or more runs of the macro into the replies to
+        each command"""
+        replies = []
+        offset = 0
+        while offset < len(data):
+            for command, _ in self.commands:
+                if command.rx_len:
+                    replies.append(command.decode(data[offset:]))
+                    offset += command.rx_size
+        return replies
@@ -0,0 +1,47 @@
+from typing import List, Mapping, Optional
+
+from rapiduino.globals.common import OUTPUT
+
+
+class PinStateCache:
+    """The last mode, digital state and PWM value written to each pin, or None where
+    it is not known"""
+
+    def __init__(self, n_pins: int) -> None:
+        self.modes: List[Optional[int]] = [None] * n_pins
+        self.states: List[Optional[int]] = [None] * n_pins
+        self.pwm_values: List[Optional[int]] = [None] * n_pins
+
+    def invalidate(self, pin_no: Optional[int] = None) -> None:
+        pin_nos = range(len(self.modes)) if pin_no is None else (pin_no,)
+        for pin in pin_nos:
+            self.modes[pin] = None
+            self.states[pin] = None
+            self.pwm_values[pin] = None
+
+    def cached_output_state(self, pin_no: int) -> Optional[int]:
+        if self.modes[pin_no] != OUTPUT.value:
+            return None
+        return self.states[pin_no]
+
+    def set_mode(self, pin_no: int, mode: int) -> None:
+        if self.modes[pin_no] != mode:
+            # Changing the mode can change the output register, e.g. INPUT_PULLUP
+            self.states[pin_no] = None
+            self.pwm_values[pin_no] = None
+        self.modes[pin_no] = mode
+
+    def set_state(self, pin_no: int, state: int) -> None:
+        self.states[pin_no] = state
+        self.pwm_values[pin_no] = None
+
+    def set_pwm_value(self, pin_no: int, value: int) -> None:
+        # analogWrite makes the pin an output and fully on/off at the extremes
+        self.modes[pin_no] = OUTPUT.value
+        self.pwm_values[pin_no] = value
+        self.states[pin_no] = {0: 0, 255: 1}.get(value)
+
+    def record_read_states(self, states: Mapping[int, int]) -> None:
+        for pin_no, state in states.items():
+            if self.modes[pin_no] == OUTPUT.value:
+                self.states[pin_no] = state
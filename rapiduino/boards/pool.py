@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Mapping, Optional, TypeVar
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.globals.common import PinMode, PinState
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class BoardHealth:
+    ok: bool
+    latency_s: Optional[float]
+    error: Optional[str] = None
+
+
+class BoardPool:
+    """Drive many Arduinos at once. Each board is driven from its own worker thread,
+    so an operation on every board completes in about the time of the slowest board
+    rather than the sum of all of them."""
+
+    def __init__(
+        self, boards: Mapping[str, Arduino], max_workers: Optional[int] = None
+    ) -> None:
+        self.boards = dict(boards)
+        self.latencies: Dict[str, float] = {}
+        self._locks = {name: threading.Lock() for name in self.boards}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(len(self.boards), 1)
+        )
+
+    def __enter__(self) -> "BoardPool":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    @classmethod
+    def connect(
+        cls,
+        ports: Iterable[str],
+        factory: Callable[[str], Arduino] = Arduino.uno,
+        max_workers: Optional[int] = None,
+    ) -> "BoardPool":
+        """Connect to a board on each port in parallel. The boards are named after
+        their ports. If any connection fails, the boards that did connect are closed
+        and the first exception is raised"""
+        ports = list(ports)
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(ports), 1)) as ex:
+            futures = {port: ex.submit(factory, port) for port in ports}
+        error = _first_exception(futures)
+        if error is not None:
+            for future in futures.values():
+                if future.exception() is None:
+                    future.result().close()
+            raise error
+        boards = {port: future.result() for port, future in futures.items()}
+        return cls(boards, max_workers=max_workers)
+
+    def map(self, function: Callable[[Arduino], T]) -> Dict[str, T]:
+        """Call function on every board concurrently, returning the results by board
+        name. If any call raises, the first exception is raised once all calls have
+        finished."""
+        futures = {
+            name: self._executor.submit(self._call, name, function)
+            for name in self.boards
+        }
+        error = _first_exception(futures)
+        if error is not None:
+            raise error
+        return {name: future.result() for name, future in futures.items()}
+
+    def pin_mode(self, pin_no: int, mode: PinMode) -> None:
+        self.map(lambda board: board.pin_mode(pin_no, mode))
+
+    def digital_read(self, pin_no: int) -> Dict[str, PinState]:
+        return self.map(lambda board: board.digital_read(pin_no))
+
+    def digital_write(self, pin_no: int, state: PinState) -> None:
+        self.map(lambda board: board.digital_write(pin_no, state))
+
+    def analog_read(self, pin_no: int) -> Dict[str, int]:
+        return self.map(lambda board: board.analog_read(pin_no))
+
+    def analog_write(self, pin_no: int, value: int) -> None:
+        self.map(lambda board: board.analog_write(pin_no, value))
+
+    def health(self) -> Dict[str, BoardHealth]:
+        """Poll every board, reporting whether it replied and how long it took"""
+        futures = {
+            name: self._executor.submit(self._check_health, name)
+            for name in self.boards
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self) -> None:
+        """Stop the worker threads and close every board. If any board fails to
+        close, the rest are still closed and the first exception is raised"""
+        self._executor.shutdown()
+        error: Optional[Exception] = None
+        for board in self.boards.values():
+            try:
+                board.close()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def _call(self, name: str, function: Callable[[Arduino], T]) -> T:
+        with self._locks[name]:
+            start = time.perf_counter()
+            result = function(self.boards[name])
+            self.latencies[name] = time.perf_counter() - start
+        return result
+
+    def _check_health(self, name: str) -> BoardHealth:
+        try:
+            ok = self._call(name, lambda board: board.poll()) == 1
+        except Exception as e:
+            return BoardHealth(ok=False, latency_s=None, error=str(e))
+        return BoardHealth(ok=ok, latency_s=self.latencies[name])
+
+
+def _first_exception(futures: Mapping[str, "Future[T]"]) -> Optional[BaseException]:
+    """Wait for every future, returning the exception of the first, in order, that
+    raised"""
+    wait(futures.values())
+    for future in futures.values():
+        error = future.exception()
+        if error is not None:
+            return error
+    return None
@@ -0,0 +1,219 @@
+import csv
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from rapiduino.boards.stream import StreamFrame
+
+# A recording is a header, then capacity records in a ring. The header holds
+# RECORDING_MAGIC, the capacity, the number of records ever written, so the oldest
+# record is found from the newest, and the wall-clock time in microseconds since the
+# epoch that default timestamps count from, so they stay in order across reopening.
+# Each record is a timestamp in microseconds, a pin
+# and a value, laid out as the NPY dtype below so that exports are plain copies
+RECORDING_MAGIC = b"RPDRING2"
+_header = struct.Struct("<8sIQQ")
+_record = struct.Struct("<QHH")
+_npy_dtype = "[('timestamp_us', '<u8'), ('pin_no', '<u2'), ('value', '<u2')]"
+
+
+@dataclass(frozen=True)
+class Sample:
+    timestamp_us: int
+    pin_no: int
+    value: int
+
+
+class _Timestamps:
+    """The timestamps of a recording's records, oldest first, as a sequence that
+    bisect can search without reading every record"""
+
+    def __init__(self, recorder: "SampleRecorder") -> None:
+        self._recorder = recorder
+
+    def __len__(self) -> int:
+        return len(self._recorder)
+
+    def __getitem__(self, index: int) -> int:
+        offset = self._recorder._record_offset(index)
+        timestamp_us: int = _record.unpack_from(self._recorder._mmap, offset)[0]
+        return timestamp_us
+
+
+class SampleRecorder:
+    """Records samples to a ring of fixed-size records in a memory-mapped file, so
+    that a long recording uses a fixed amount of memory and disk. Once full, each new
+    record replaces the oldest.
+
+    Samples must be recorded in time order, which lets query and the exports find a
+    time range by binary search, so record rejects a timestamp older than the newest
+    recorded. Opening an existing recording carries on from where
+    it left off, keeping the capacity it was created with.
+    """
+
+    def __init__(self, path: str, capacity: int = 1_000_000) -> None:
+        if capacity < 1:
+            raise ValueError("A SampleRecorder needs a capacity of at least one")
+        self.path = path
+        size = _header.size + capacity * _record.size
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r+b") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0)
+            magic, self.capacity, self.n_records_total, self.origin_us = (
+                _header.unpack_from(self._mmap)
+            )
+            if magic != RECORDING_MAGIC:
+                self._mmap.close()
+                raise ValueError(f"{path} is not a rapiduino recording")
+        else:
+            with open(path, "w+b") as f:
+                f.truncate(size)
+                self._mmap = mmap.mmap(f.fileno(), size)
+            self.capacity = capacity
+            self.n_records_total = 0
+            self.origin_us = _now_us()
+            self._write_header()
+        self._newest_us = _Timestamps(self)[len(self) - 1] if len(self) else 0
+
+    def __len__(self) -> int:
+        return min(self.n_records_total, self.capacity)
+
+    def __enter__(self) -> "SampleRecorder":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def record(
+        self, pin_no: int, value: int, timestamp_us: Optional[int] = None
+    ) -> None:
+        """Record one sample, for example from a loop calling analog_read. Without a
+        timestamp, the time since the recording was created is used"""
+        if timestamp_us is None:
+            timestamp_us = self._elapsed_us()
+        if timestamp_us < self._newest_us:
+            raise ValueError(
+                f"Samples must be recorded in time order, but {timestamp_us} us is "
+                f"before the newest recorded at {self._newest_us} us"
+            )
+        offset = _header.size + (self.n_records_total % self.capacity) * _record.size
+        _record.pack_into(self._mmap, offset, timestamp_us, pin_no, value)
+        self.n_records_total += 1
+        self._newest_us = timestamp_us
+        self._write_header()
+
+    def recording(
+        self, frames: Iterable[StreamFrame], pin_nos: Sequence[int]
+    ) -> Iterator[StreamFrame]:
+        """Record every frame of a stream of pin_nos, such as one from
+        Arduino.stream, passing the frames on. Frames are timed by the Arduino's
+        clock, which restarts with the board, so they are recorded on the recorder's
+        clock instead: the first when it arrives, and the rest after it by the
+        Arduino's time between them"""
+        offset_us = None
+        for frame in frames:
+            if offset_us is None:
+                offset_us = self._elapsed_us() - frame.timestamp_us
+            for pin_no, value in zip(pin_nos, frame.values):
+                self.record(pin_no, value, frame.timestamp_us + offset_us)
+            yield frame
+
+    def query(
+        self,
+        start_us: Optional[int] = None,
+        end_us: Optional[int] = None,
+        pin_no: Optional[int] = None,
+    ) -> List[Sample]:
+        """The samples recorded from start_us up to, but not including, end_us,
+        optionally only those of one pin"""
+        samples = []
+        for index in range(*self._index_range(start_us, end_us)):
+            sample = Sample(
+                *_record.unpack_from(self._mmap, self._record_offset(index))
+            )
+            if pin_no is None or sample.pin_no == pin_no:
+                samples.append(sample)
+        return samples
+
+    def to_csv(
+        self, path: str, start_us: Optional[int] = None, end_us: Optional[int] = None
+    ) -> None:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("timestamp_us", "pin_no", "value"))
+            writer.writerows(_record.iter_unpack(self._raw_records(start_us, end_us)))
+
+    def to_npy(
+        self, path: str, start_us: Optional[int] = None, end_us: Optional[int] = None
+    ) -> None:
+        """Export the samples as a NumPy .npy file of records with timestamp_us,
+        pin_no and value fields. NumPy is not needed to write it"""
+        data = self._raw_records(start_us, end_us)
+        header = (
+            f"{{'descr': {_npy_dtype}, 'fortran_order': False, "
+            f"'shape': ({len(data) // _record.size},), }}"
+        )
+        # The magic, version, header length and header are padded to a multiple
+        # of 64 bytes, ending in a newline
+        padding = -(10 + len(header) + 1) % 64
+        header += " " * padding + "\n"
+        with open(path, "wb") as f:
+            f.write(b"\x93NUMPY\x01\x00")
+            f.write(struct.pack("<H", len(header)))
+            f.write(header.encode("latin1"))
+            f.write(data)
+
+    def flush(self) -> None:
+        self._mmap.flush()
+
+    def close(self) -> None:
+        if not self._mmap.closed:
+            self._mmap.flush()
+            self._mmap.close()
+
+    def _elapsed_us(self) -> int:
+        """The time since the recording was created, but never before the newest
+        record, in case the wall clock has been set back"""
+        return max(_now_us() - self.origin_us, self._newest_us)
+
+    def _write_header(self) -> None:
+        _header.pack_into(
+            self._mmap,
+            0,
+            RECORDING_MAGIC,
+            self.capacity,
+            self.n_records_total,
+            self.origin_us,
+        )
+
+    def _record_offset(self, index: int) -> int:
+        oldest = self.n_records_total - len(self)
+        return _header.size + ((oldest + index) % self.capacity) * _record.size
+
+    def _index_range(
+        self, start_us: Optional[int], end_us: Optional[int]
+    ) -> Tuple[int, int]:
+        timestamps = _Timestamps(self)
+        begin = 0 if start_us is None else bisect_left(timestamps, start_us)
+        end = len(self) if end_us is None else bisect_left(timestamps, end_us)
+        return begin, max(begin, end)
+
+    def _raw_records(self, start_us: Optional[int], end_us: Optional[int]) -> bytes:
+        """The records in a time range, oldest first, copied straight from the file"""
+        begin, end = self._index_range(start_us, end_us)
+        if begin == end:
+            return b""
+        first = self._record_offset(begin)
+        last = self._record_offset(end - 1) + _record.size
+        if first < last:
+            return self._mmap[first:last]
+        # The range wraps around the end of the ring
+        return self._mmap[first:] + self._mmap[_header.size : last]
+
+
+def _now_us() -> int:
+    return int(time.time() * 1e6)
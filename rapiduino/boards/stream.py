@@ -0,0 +1,8 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+
+@dataclass(frozen=True)
+class StreamFrame:
+    timestamp_us: int
+    values: Tuple[int, ...]
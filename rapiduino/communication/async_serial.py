@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from serial import Serial
+
+from rapiduino.communication.command_spec import CMD_PARROT, CommandSpec
+from rapiduino.exceptions import SerialConnectionReceiveDataError
+
+PendingReply = Tuple[CommandSpec, "asyncio.Future[Tuple[int, ...]]"]
+
+
+class AsyncSerialConnection:
+    """An asyncio equivalent of SerialConnection.
+
+    Commands are written as soon as they are awaited, without waiting for the replies
+    to earlier commands, so concurrent requests are pipelined. The Arduino replies in
+    the order it received the commands, so replies are matched to requests in order.
+    After a missing reply, the connection resyncs as SerialConnection does, so that
+    late replies are not matched to later requests.
+    """
+
+    max_resync_bytes = 1024
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.WriteTransport,
+        timeout: float = 1,
+        read_transport: Optional[asyncio.ReadTransport] = None,
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self._read_transport = read_transport
+        self._pending: Deque[PendingReply] = deque()
+        self._reader_task: Optional["asyncio.Future[None]"] = None
+        self._n_resyncs = 0
+        self._resync_marker: Optional[bytes] = None
+
+    @classmethod
+    async def build(
+        cls, port: str, baudrate: int = 115200, timeout: float = 1
+    ) -> "AsyncSerialConnection":
+        conn = Serial(port, baudrate=baudrate, timeout=0)
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader()
+        read_transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), conn
+        )
+        writer, _ = await loop.connect_write_pipe(asyncio.Protocol, conn)
+        return cls(reader, writer, timeout=timeout, read_transport=read_transport)
+
+    async def process_command(
+        self, command: CommandSpec, *args: int
+    ) -> Tuple[int, ...]:
+        bytes_to_send = command.encode(*args)
+        if command.rx_size == 0:
+            self.writer.write(bytes_to_send)
+            return ()
+
+        future: "asyncio.Future[Tuple[int, ...]]" = (
+            asyncio.get_event_loop().create_future()
+        )
+        self._pending.append((command, future))
+        self.writer.write(bytes_to_send)
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.ensure_future(self._read_replies())
+        return await future
+
+    def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._fail_pending(ConnectionError("The connection was closed"))
+        if self._read_transport is not None:
+            self._read_transport.close()
+        self.writer.close()
+
+    async def _read_replies(self) -> None:
+        while self._pending:
+            command, future = self._pending[0]
+            try:
+                if self._resync_marker is not None:
+                    await self._resync()
+                bytes_read = await self._read(command.rx_size)
+            except SerialConnectionReceiveDataError as e:
+                # Replies can no longer be matched to requests, so fail them all
+                self._fail_pending(e)
+                self._start_resync()
+                return
+            self._pending.popleft()
+            if not future.done():
+                future.set_result(command.decode(bytes_read))
+
+    def _start_resync(self) -> None:
+        """Send a pair of parrot commands, whose echoes mark where the replies to the
+        commands sent after them start. They are sent straight away, ahead of any
+        later command, and read back before its reply"""
+        self._n_resyncs = (self._n_resyncs + 1) % 256
+        marker = bytes((self._n_resyncs, self._n_resyncs ^ 0xFF))
+        self.writer.write(CMD_PARROT.encode(marker[0]) + CMD_PARROT.encode(marker[1]))
+        self._resync_marker = marker
+
+    async def _resync(self) -> None:
+        """Throw away everything up to the echoes of the resync marker, such as late
+        replies to failed requests"""
+        marker = self._resync_marker
+        received = await self._read(2)
+        for _ in range(self.max_resync_bytes):
+            if received == marker:
+                self._resync_marker = None
+                return
+            received = received[1:] + await self._read(1)
+        raise SerialConnectionReceiveDataError(n_bytes_intended=2, n_bytes_actual=0)
+
+    async def _read(self, n_bytes: int) -> bytes:
+        bytes_read = b""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+        while len(bytes_read) < n_bytes:
+            try:
+                chunk = await asyncio.wait_for(
+                    self.reader.read(n_bytes - len(bytes_read)),
+                    max(deadline - loop.time(), 0),
+                )
+            except asyncio.TimeoutError:
+                chunk = b""
+            if not chunk:
+                raise SerialConnectionReceiveDataError(
+                    n_bytes_intended=n_bytes, n_bytes_actual=len(bytes_read)
+                )
+            bytes_read += chunk
+        return bytes_read
+
+    def _fail_pending(self, exception: Exception) -> None:
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exception)
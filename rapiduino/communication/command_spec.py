@@ -1,4 +1,7 @@
-from dataclasses import dataclass
+import struct
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Tuple
 
 
 @dataclass
@@ -8,13 +11,195 @@ class CommandSpec:
     tx_type: str
     rx_len: int
     rx_type: str
+    tx_struct: struct.Struct = field(init=False, repr=False, compare=False)
+    rx_struct: struct.Struct = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Compile the formats once, rather than parsing them on every command
+        self.tx_struct = struct.Struct(f"<B{self.tx_len}{self.tx_type}")
+        self.rx_struct = struct.Struct(
+            f"<{self.rx_len}{self.rx_type}" if self.rx_len else "<"
+        )
+
+    @property
+    def tx_size(self) -> int:
+        """The number of bytes sent to the Arduino for this command"""
+        return self.tx_struct.size
+
+    @property
+    def rx_size(self) -> int:
+        """The number of bytes the Arduino sends in reply to this command"""
+        return self.rx_struct.size
+
+    def encode(self, *args: int) -> bytes:
+        try:
+            return self.tx_struct.pack(self.cmd, *args)
+        except struct.error:
+            self._assert_valid_args(args)
+            raise
+
+    def encode_into(self, buffer: bytearray, offset: int, *args: int) -> None:
+        try:
+            self.tx_struct.pack_into(buffer, offset, self.cmd, *args)
+        except struct.error:
+            self._assert_valid_args(args)
+            raise
+
+    def decode(self, data: bytes) -> Tuple[int, ...]:
+        return self.rx_struct.unpack_from(data)
+
+    def _assert_valid_args(self, args: Tuple[int, ...]) -> None:
+        if len(args) != self.tx_len:
+            raise ValueError(
+                f"Expected args to be length {self.tx_len}, "
+                f"but received length {len(args)}"
+            )
 
 
 CMD_POLL = CommandSpec(cmd=0, tx_len=0, tx_type="B", rx_len=1, rx_type="B")
 CMD_PARROT = CommandSpec(cmd=1, tx_len=1, tx_type="B", rx_len=1, rx_type="B")
 CMD_VERSION = CommandSpec(cmd=2, tx_len=0, tx_type="B", rx_len=3, rx_type="B")
+# Returns a bitmask of the BAUD_RATES the Arduino supports
+CMD_BAUDRATES = CommandSpec(cmd=3, tx_len=0, tx_type="B", rx_len=1, rx_type="B")
+# Arg is an index into BAUD_RATES. Returns the index, or 0xFF if the baud rate is not
+# supported, then switches. The Arduino switches back unless a parrot command arrives
+# at the new baud rate within half a second
+CMD_SETBAUD = CommandSpec(cmd=4, tx_len=1, tx_type="B", rx_len=1, rx_type="B")
 CMD_PINMODE = CommandSpec(cmd=10, tx_len=2, tx_type="B", rx_len=0, rx_type="")
 CMD_DIGITALREAD = CommandSpec(cmd=20, tx_len=1, tx_type="B", rx_len=1, rx_type="B")
 CMD_DIGITALWRITE = CommandSpec(cmd=21, tx_len=2, tx_type="B", rx_len=0, rx_type="")
 CMD_ANALOGREAD = CommandSpec(cmd=30, tx_len=1, tx_type="B", rx_len=1, rx_type="H")
 CMD_ANALOGWRITE = CommandSpec(cmd=31, tx_len=2, tx_type="B", rx_len=0, rx_type="")
+# Args are the pin, the number of samples to take, a power of 4 up to MAX_OVERSAMPLE,
+# and OVERSAMPLE_MEAN or OVERSAMPLE_MEDIAN. Returns the mean or median of the samples
+# with an extra bit of resolution for each factor of 4 samples
+CMD_ANALOGREADOVERSAMPLED = CommandSpec(
+    cmd=33, tx_len=3, tx_type="I", rx_len=1, rx_type="H"
+)
+# Args are the pin, the state to write first, the delay in microseconds before writing
+# it, how long to hold HIGH and LOW before each following edge and the number of edges
+# to write, where 0 repeats until cancelled. The edges are timed by the Arduino's
+# clock. Returns the slot given to the action, or SCHEDULE_FULL
+CMD_SCHEDULE = CommandSpec(cmd=50, tx_len=6, tx_type="I", rx_len=1, rx_type="B")
+# Arg is a slot returned by CMD_SCHEDULE, or SCHEDULE_ALL
+CMD_CANCELSCHEDULE = CommandSpec(cmd=51, tx_len=1, tx_type="B", rx_len=0, rx_type="")
+# Args are the pin, the state of the pulse and a timeout in microseconds. Returns the
+# length of the pulse in microseconds, or 0 if the timeout expired first
+CMD_PULSEIN = CommandSpec(cmd=52, tx_len=3, tx_type="I", rx_len=1, rx_type="I")
+
+
+BAUD_RATES = (115200, 250000, 500000, 1000000, 2000000)
+BAUD_NEGOTIATION_VERSION = (0, 5, 0)
+
+MAX_OVERSAMPLE = 64
+OVERSAMPLE_MEAN = 0
+OVERSAMPLE_MEDIAN = 1
+OVERSAMPLING_VERSION = (0, 10, 0)
+
+MAX_SCHEDULED = 8
+SCHEDULE_FULL = 0xFF
+SCHEDULE_ALL = 0xFF
+SCHEDULING_VERSION = (0, 6, 0)
+
+# Args are the pin, the debounce time in microseconds and whether to use a hardware
+# interrupt, where the pin has one. Returns WATCH_FULL, WATCH_POLLING or
+# WATCH_INTERRUPT, then the pin's current state. A pin that has changed and then kept
+# its new state for the debounce time is reported with an EVENT_DIGITAL event
+CMD_WATCHDIGITAL = CommandSpec(cmd=70, tx_len=3, tx_type="I", rx_len=2, rx_type="B")
+# Arg is a pin to stop watching, digital or analog, or UNWATCH_ALL
+CMD_UNWATCH = CommandSpec(cmd=71, tx_len=1, tx_type="B", rx_len=0, rx_type="")
+# Args are the pin, a threshold, or NO_THRESHOLD, the hysteresis, the minimum delta,
+# or 0 for none, and the sampling interval in microseconds. The pin is sampled at
+# that interval and an EVENT_ANALOG_RISE event is sent once it reaches the threshold,
+# an EVENT_ANALOG_FALL event once it drops below the threshold less the hysteresis and
+# otherwise an EVENT_ANALOG_DELTA event once it has moved by the minimum delta since
+# the last event. Returns WATCH_FULL or WATCH_POLLING, then the pin's current value
+CMD_WATCHANALOG = CommandSpec(cmd=72, tx_len=5, tx_type="I", rx_len=2, rx_type="H")
+
+MAX_WATCHED = 16
+MAX_ANALOG_WATCHED = 8
+NO_THRESHOLD = 0xFFFF
+WATCH_FULL = 0
+WATCH_POLLING = 1
+WATCH_INTERRUPT = 2
+UNWATCH_ALL = 0xFF
+EVENTS_VERSION = (0, 8, 0)
+# Events are the event type, the pin, a value and the time in microseconds at which
+# the value changed
+EVENT_DIGITAL = 0
+EVENT_ANALOG_RISE = 1
+EVENT_ANALOG_FALL = 2
+EVENT_ANALOG_DELTA = 3
+ANALOG_EVENTS_VERSION = (0, 9, 0)
+event_struct = struct.Struct("<BBHI")
+
+MAX_MACROS = 4
+MAX_MACRO_SIZE = 48
+MACRO_CHUNK_SIZE = 32
+MACRO_VERSION = (0, 7, 0)
+# Commands that cannot be run from a macro: changing the baud rate, streaming,
+# pulseIn and oversampled analog reads, which could outlast the read timeout, watching
+# a pin, whose reply says whether the watch list was full, and the macro commands
+# themselves
+MACRO_EXCLUDED_CMDS = frozenset((4, 33, 40, 41, 52, 60, 61, 70, 72))
+
+
+@lru_cache(maxsize=None)
+def cmd_digitalwritemany(n_bytes: int) -> CommandSpec:
+    """Args are n_bytes, then n_bytes of pin mask, then n_bytes of pin states.
+    Bit i of byte j refers to pin 8 * j + i"""
+    return CommandSpec(
+        cmd=22, tx_len=1 + 2 * n_bytes, tx_type="B", rx_len=0, rx_type=""
+    )
+
+
+@lru_cache(maxsize=None)
+def cmd_digitalreadall(n_bytes: int) -> CommandSpec:
+    """Args are n_bytes. Returns n_bytes of pin states, packed as for
+    cmd_digitalwritemany"""
+    return CommandSpec(cmd=23, tx_len=1, tx_type="B", rx_len=n_bytes, rx_type="B")
+
+
+@lru_cache(maxsize=None)
+def cmd_analogreadmany(n_pins: int) -> CommandSpec:
+    """Args are n_pins, then the n_pins pin numbers. Returns one value per pin"""
+    return CommandSpec(
+        cmd=32, tx_len=1 + n_pins, tx_type="B", rx_len=n_pins, rx_type="H"
+    )
+
+
+@lru_cache(maxsize=None)
+def cmd_macrowrite(n_bytes: int) -> CommandSpec:
+    """Args are the macro slot, the offset to write at, n_bytes, then n_bytes of macro
+    code. The macro ends after the last byte written. Macro code is a sequence of
+    commands, encoded as they are sent without framing"""
+    return CommandSpec(cmd=60, tx_len=3 + n_bytes, tx_type="B", rx_len=0, rx_type="")
+
+
+@lru_cache(maxsize=None)
+def cmd_macrorun(rx_size: int) -> CommandSpec:
+    """Args are the macro slot and the number of times to run it. Returns the replies
+    to every command run, rx_size bytes in all"""
+    return CommandSpec(cmd=61, tx_len=2, tx_type="B", rx_len=rx_size, rx_type="B")
+
+
+STREAM_FRAME = 0xA5
+STREAM_END = 0x5A
+
+
+@lru_cache(maxsize=None)
+def stream_frame_struct(n_values: int) -> struct.Struct:
+    """The layout of the frames sent while streaming n_values pins"""
+    return struct.Struct(f"<BI{n_values}H")
+
+
+CMD_STREAMSTOP = CommandSpec(cmd=41, tx_len=0, tx_type="B", rx_len=0, rx_type="")
+
+
+@lru_cache(maxsize=None)
+def cmd_streamstart(n_pins: int) -> CommandSpec:
+    """Args are the sample rate in Hz, n_pins, then the n_pins pin numbers. The Arduino
+    replies with a stream of frames until CMD_STREAMSTOP is sent. Each frame is a
+    STREAM_FRAME byte, a 32-bit timestamp in microseconds and one value per pin. The
+    last frame has the same layout but starts with a STREAM_END byte"""
+    return CommandSpec(cmd=40, tx_len=2 + n_pins, tx_type="H", rx_len=0, rx_type="")
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, List, Optional, Sequence, Tuple, Union
+
+from serial import Serial
+
+from rapiduino.communication.command_spec import CMD_PARROT, CommandSpec
+from rapiduino.communication.serial import Command, SerialConnection
+from rapiduino.exceptions import SerialConnectionAckError, SerialConnectionFrameError
+
+
+class DeferredSerialConnection(SerialConnection):
+    """A SerialConnection that does not wait for commands without a reply.
+
+    Such commands are added to an outgoing buffer which is written once it holds
+    max_buffer_size bytes, once its oldest command is max_delay seconds old, before
+    any command with a reply, or when flush is called. A timer thread keeps to
+    max_delay even if no further call is made. Every ack_interval commands
+    a parrot command carrying a sequence number is sent along with the buffer. The
+    echoed sequence numbers are checked as they arrive, so a lost or rejected
+    command raises SerialConnectionAckError on a later call rather than going
+    unnoticed. With framing enabled no parrot commands are needed, as the Arduino
+    acknowledges every frame: the acknowledgements are read along with the reply to
+    the next command with one, or waited for once ack_interval frames are awaiting
+    them, and frames that were lost or rejected are resent.
+    """
+
+    max_buffer_size = 64
+    max_delay = 0.01
+    ack_interval = 32
+
+    def __init__(self, conn: Serial) -> None:
+        super().__init__(conn)
+        self._buffer = bytearray()
+        self._buffered_since = 0.0
+        self._n_buffered = 0
+        self._n_unacked = 0
+        self._next_ack_seq = 0
+        self._pending_acks: Deque[int] = deque()
+        # Sequence numbers of the frames in the buffer, when framing is enabled
+        self._buffered_frames: List[int] = []
+        # Held while the buffer is changed or anything is written, so that the timer
+        # thread never writes in the middle of a command
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        self._timer_error: Optional[Exception] = None
+
+    def _process_command(
+        self, command: CommandSpec, args: Tuple[int, ...]
+    ) -> Tuple[int, ...]:
+        with self._lock:
+            if command.rx_len == 0:
+                if not self._buffer:
+                    self._buffered_since = time.perf_counter()
+                    self._start_timer()
+                encoded = self._encode_command(command, args)
+                if self.framing:
+                    self._buffered_frames.append(encoded[2])
+                self._buffer += encoded
+                self._n_buffered += 1
+                self._n_unacked += 1
+                if (
+                    len(self._buffer) >= self.max_buffer_size
+                    or time.perf_counter() - self._buffered_since >= self.max_delay
+                ):
+                    self._write_buffer(with_ack=self._n_unacked >= self.ack_interval)
+                    self._check_acks(block=False)
+                return ()
+            self._write_buffer(with_ack=self._n_unacked >= self.ack_interval)
+            # Acknowledgements of frames are read along with the reply
+            if not self.framing:
+                self._check_acks(block=True)
+            with self._lost_frames_as_ack_errors():
+                return super()._process_command(command, args)
+
+    def _process_commands(self, commands: Sequence[Command]) -> List[Tuple[int, ...]]:
+        with self._lock:
+            self._write_buffer(with_ack=self._n_unacked >= self.ack_interval)
+            if not self.framing:
+                self._check_acks(block=True)
+            with self._lost_frames_as_ack_errors():
+                return super()._process_commands(commands)
+
+    def recv_stream_frame(self, n_values: int) -> Optional[Tuple[int, ...]]:
+        # An acknowledgement requested while streaming would be mixed in with the
+        # frames, so the buffer is written without one
+        with self._lock:
+            self._write_buffer(with_ack=False)
+            self._check_acks(block=True)
+            return super().recv_stream_frame(n_values)
+
+    def recv_stream_frames(self, n_values: int, max_frames: int) -> Tuple[bytes, bool]:
+        with self._lock:
+            self._write_buffer(with_ack=False)
+            self._check_acks(block=True)
+            return super().recv_stream_frames(n_values, max_frames)
+
+    def recv_events(self, timeout: float = 0) -> List[bytes]:
+        # Acknowledgements of frames would otherwise be taken for late replies
+        with self._lock:
+            self._write_buffer(with_ack=False)
+            self._check_acks(block=True)
+        return super().recv_events(timeout)
+
+    def send_unframed(self, command: CommandSpec, *args: int) -> None:
+        # An unframed command restarts the Arduino's frame numbering, so every frame
+        # must have been run first
+        with self._lock:
+            self._write_buffer(with_ack=False)
+            self._check_acks(block=True)
+            super().send_unframed(command, *args)
+
+    def flush(self) -> None:
+        """Write the buffer and wait until every command sent has been acknowledged"""
+        with self._lock:
+            self._write_buffer(with_ack=self._n_unacked > 0)
+            self._check_acks(block=True)
+
+    def close(self) -> None:
+        """Write the buffer, without waiting for acknowledgements, and close the port"""
+        with self._lock:
+            try:
+                self._write_buffer(with_ack=False)
+            finally:
+                super().close()
+
+    def _write(
+        self, bytes_to_send: Union[bytes, bytearray], n_commands: int = 1
+    ) -> None:
+        with self._lock:
+            super()._write(bytes_to_send, n_commands)
+
+    def _start_timer(self) -> None:
+        self._timer = threading.Timer(self.max_delay, self._write_buffer_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _write_buffer_on_timer(self) -> None:
+        # Acknowledgements are left for the caller's thread to request and read
+        with self._lock:
+            try:
+                self._write_buffer(with_ack=False)
+            except Exception as e:
+                self._timer_error = e
+
+    def _write_buffer(self, with_ack: bool) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._timer_error is not None:
+            error, self._timer_error = self._timer_error, None
+            raise error
+        if with_ack and not self.framing:
+            self._buffer += CMD_PARROT.encode(self._next_ack_seq)
+            self._n_buffered += 1
+            self._pending_acks.append(self._next_ack_seq)
+            self._next_ack_seq = (self._next_ack_seq + 1) % 256
+            self._n_unacked = 0
+        if self._buffer:
+            bytes_to_send = bytes(self._buffer)
+            self._buffer.clear()
+            self._unconfirmed_frames += self._buffered_frames
+            self._buffered_frames = []
+            n_commands, self._n_buffered = self._n_buffered, 0
+            self._write(bytes_to_send, n_commands)
+
+    @contextmanager
+    def _lost_frames_as_ack_errors(self) -> Iterator[None]:
+        """Report a buffered frame that failed as a lost acknowledgement, as it is
+        reported on a later call than the one that sent it"""
+        unconfirmed = set(self._unconfirmed_frames)
+        try:
+            yield
+        except SerialConnectionFrameError as e:
+            if e.seq in unconfirmed:
+                raise SerialConnectionAckError(e.seq, None) from e
+            raise
+
+    def _check_acks(self, block: bool) -> None:
+        if self.framing:
+            n_awaited = min(self.ack_interval, self.max_frames_in_flight)
+            if self._unconfirmed_frames and (
+                block or len(self._unconfirmed_frames) >= n_awaited
+            ):
+                with self._lost_frames_as_ack_errors():
+                    self._confirm_frames()
+            return
+        while self._pending_acks and (block or self.conn.in_waiting > 0):
+            expected_seq = self._pending_acks.popleft()
+            bytes_read = self.conn.read(CMD_PARROT.rx_size)
+            if len(bytes_read) != CMD_PARROT.rx_size:
+                self._pending_acks.clear()
+                raise SerialConnectionAckError(expected_seq, None)
+            (actual_seq,) = CMD_PARROT.decode(bytes_read)
+            if actual_seq != expected_seq:
+                self._pending_acks.clear()
+                raise SerialConnectionAckError(expected_seq, actual_seq)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+from typing import List, Union
+
+# A frame is FRAME_START, the length of the body, a sequence number, the body and a
+# CRC-8 of everything after the start byte. Requests have the command number and its
+# arguments as the body; replies have a status followed by the reply data. Events
+# pushed by the Arduino are frames with the FRAME_EVENT status, numbered by their own
+# counter.
+#
+# The Arduino replies to every request frame, and only runs the one numbered after the
+# last it ran. A frame from further ahead, sent after one that was lost, is answered
+# with FRAME_OUT_OF_ORDER; one it has already run is answered with FRAME_DUPLICATE, or
+# with the reply it sent before if it was the last one run. Any unframed command
+# starts the numbering afresh from the next frame. Sketches before version 0.11.0 only
+# replied to frames that failed or had reply data, so they are driven unframed
+FRAME_START = 0x7E
+MAX_FRAME_BODY = 64
+FRAMED_PROTOCOL_VERSION = (0, 11, 0)
+
+FRAME_OK = 0
+FRAME_BAD_CRC = 1
+FRAME_UNKNOWN_COMMAND = 2
+FRAME_TOO_LONG = 3
+FRAME_EVENT = 4
+FRAME_OUT_OF_ORDER = 5
+FRAME_DUPLICATE = 6
+
+
+def _make_crc8_table() -> bytes:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8_TABLE = _make_crc8_table()
+
+
+def crc8(data: Union[bytes, bytearray]) -> int:
+    """CRC-8 with polynomial 0x07, as calculated by the sketch"""
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(seq: int, body: bytes) -> bytes:
+    if len(body) > MAX_FRAME_BODY:
+        raise ValueError(
+            f"Frame body is {len(body)} bytes, but can be at most {MAX_FRAME_BODY}"
+        )
+    checked = bytes((len(body), seq)) + body
+    return bytes((FRAME_START,)) + checked + bytes((crc8(checked),))
+
+
+@dataclass(frozen=True)
+class Frame:
+    seq: int
+    body: bytes
+
+
+class FrameDecoder:
+    """Splits bytes received in arbitrary chunks into frames. Whenever a frame fails
+    its checksum, decoding restarts from the next start byte"""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self.n_corrupt = 0
+
+    @property
+    def bytes_needed(self) -> int:
+        """The number of bytes that can be read without reading past the end of the
+        frame currently being decoded"""
+        if len(self._buffer) < 2:
+            return 2 - len(self._buffer)
+        return self._buffer[1] + 4 - len(self._buffer)
+
+    def feed(self, data: bytes) -> List[Frame]:
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(FRAME_START)
+            if start < 0:
+                self._buffer.clear()
+                break
+            del self._buffer[:start]
+            if len(self._buffer) < 2:
+                break
+            frame_size = self._buffer[1] + 4
+            if len(self._buffer) < frame_size:
+                break
+            if crc8(self._buffer[1 : frame_size - 1]) == self._buffer[frame_size - 1]:
+                frames.append(
+                    Frame(self._buffer[2], bytes(self._buffer[3 : frame_size - 1]))
+                )
+                del self._buffer[:frame_size]
+            else:
+                self.n_corrupt += 1
+                del self._buffer[:1]
+        return frames
+
+    def skip_frame(self) -> List[Frame]:
+        """Give up on the frame currently being decoded, for example because the rest
+        of it never arrived, and decode whatever follows it"""
+        if self._buffer:
+            self.n_corrupt += 1
+            del self._buffer[:1]
+        return self.feed(b"")
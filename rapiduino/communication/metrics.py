@@ -0,0 +1,195 @@
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Called after every command with the command number (None for a batch), how long it
+# took in seconds and the exception it raised, if any
+CommandCallback = Callable[[Optional[int], float, Optional[BaseException]], None]
+
+LATENCY_BUCKETS_S = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+class Histogram:
+    """Counts of observations falling at or below each of LATENCY_BUCKETS_S, plus one
+    more for anything slower"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS_S) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS_S, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[int]:
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+@dataclass(frozen=True)
+class HistogramSnapshot:
+    bucket_bounds_s: Tuple[float, ...]
+    cumulative_counts: Tuple[int, ...]
+    count: int
+    sum_s: float
+
+
+@dataclass(frozen=True)
+class MetricsSnapshot:
+    commands: Dict[int, int]
+    latency: Dict[str, HistogramSnapshot]
+    errors: Dict[str, int]
+    bytes_sent: int
+    bytes_received: int
+    timeouts: int
+    retries: int
+
+
+class ConnectionMetrics:
+    """Counters and latency histograms for a SerialConnection.
+
+    Latencies are kept per command number, with batches sent by process_commands
+    kept together under "batch". Read the metrics with snapshot or to_prometheus, or
+    register callbacks to be told about each command as it completes.
+    """
+
+    def __init__(self, callbacks: Sequence[CommandCallback] = ()) -> None:
+        self.callbacks = list(callbacks)
+        self.commands: Dict[int, int] = {}
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def measure_command(self, cmd: int, function: Callable[[], T]) -> T:
+        return self._measure((cmd,), cmd, function)
+
+    def measure_batch(self, cmds: Sequence[int], function: Callable[[], T]) -> T:
+        return self._measure(cmds, None, function)
+
+    def record_bytes(self, n_sent: int = 0, n_received: int = 0) -> None:
+        with self._lock:
+            self.bytes_sent += n_sent
+            self.bytes_received += n_received
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def record_retries(self, n_retries: int = 1) -> None:
+        with self._lock:
+            self.retries += n_retries
+
+    def snapshot(self) -> MetricsSnapshot:
+        with self._lock:
+            return MetricsSnapshot(
+                commands=dict(self.commands),
+                latency={
+                    name: HistogramSnapshot(
+                        LATENCY_BUCKETS_S,
+                        tuple(histogram.cumulative_counts()),
+                        histogram.count,
+                        histogram.sum,
+                    )
+                    for name, histogram in self.latency.items()
+                },
+                errors=dict(self.errors),
+                bytes_sent=self.bytes_sent,
+                bytes_received=self.bytes_received,
+                timeouts=self.timeouts,
+                retries=self.retries,
+            )
+
+    def to_prometheus(self, labels: Optional[Mapping[str, str]] = None) -> str:
+        """The metrics in the Prometheus text exposition format, with labels, such as
+        the port, added to every sample"""
+        snapshot = self.snapshot()
+        base_labels = dict(labels or {})
+        lines = []
+
+        def sample(name: str, value: float, **extra_labels: str) -> None:
+            all_labels = {**base_labels, **extra_labels}
+            label_text = ",".join(f'{k}="{v}"' for k, v in all_labels.items())
+            lines.append(
+                f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+            )
+
+        lines.append("# TYPE rapiduino_commands_total counter")
+        for cmd, count in sorted(snapshot.commands.items()):
+            sample("rapiduino_commands_total", count, cmd=str(cmd))
+        lines.append("# TYPE rapiduino_command_latency_seconds histogram")
+        for name, histogram in sorted(snapshot.latency.items()):
+            bounds = [str(bound) for bound in histogram.bucket_bounds_s] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.cumulative_counts):
+                sample(
+                    "rapiduino_command_latency_seconds_bucket",
+                    count,
+                    cmd=name,
+                    le=bound,
+                )
+            sample("rapiduino_command_latency_seconds_sum", histogram.sum_s, cmd=name)
+            sample("rapiduino_command_latency_seconds_count", histogram.count, cmd=name)
+        lines.append("# TYPE rapiduino_errors_total counter")
+        for error, count in sorted(snapshot.errors.items()):
+            sample("rapiduino_errors_total", count, error=error)
+        for name, value in (
+            ("rapiduino_bytes_sent_total", snapshot.bytes_sent),
+            ("rapiduino_bytes_received_total", snapshot.bytes_received),
+            ("rapiduino_timeouts_total", snapshot.timeouts),
+            ("rapiduino_retries_total", snapshot.retries),
+        ):
+            lines.append(f"# TYPE {name} counter")
+            sample(name, value)
+        return "\n".join(lines) + "\n"
+
+    def _measure(
+        self, cmds: Sequence[int], cmd: Optional[int], function: Callable[[], T]
+    ) -> T:
+        start = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            return function()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                for counted_cmd in cmds:
+                    self.commands[counted_cmd] = self.commands.get(counted_cmd, 0) + 1
+                latency_name = "batch" if cmd is None else str(cmd)
+                if latency_name not in self.latency:
+                    self.latency[latency_name] = Histogram()
+                self.latency[latency_name].observe(elapsed)
+                if error is not None:
+                    name = type(error).__name__
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            for callback in self.callbacks:
+                callback(cmd, elapsed, error)
@@ -0,0 +1,252 @@
+import mmap
+import re
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Generator, Iterator, Optional
+
+from serial import Serial
+
+from rapiduino.communication.serial import SerialConnection
+from rapiduino.exceptions import ReplayMismatchError
+
+# A capture is CAPTURE_MAGIC followed by records, each a direction, the time since the
+# capture started in nanoseconds and the length of the data, followed by the data.
+# Every write and every read is recorded, including reads that timed out short, as is
+# every check of in_waiting, with the count as the data
+CAPTURE_MAGIC = b"RPDCAP01"
+CAPTURE_TX = 0
+CAPTURE_RX = 1
+CAPTURE_WAITING = 2
+_record_header = struct.Struct("<BQI")
+_waiting = struct.Struct("<I")
+
+capture_paths: Dict[str, str] = {}
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    direction: int
+    timestamp_ns: int
+    data: bytes
+
+
+class _Capture:
+    """A capture file, memory-mapped so that large captures are not read into memory"""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a rapiduino capture")
+
+    def records(
+        self, direction: Optional[int] = None
+    ) -> Generator[CaptureRecord, None, None]:
+        offset = len(CAPTURE_MAGIC)
+        while offset + _record_header.size <= len(self._mmap):
+            record_direction, timestamp_ns, size = _record_header.unpack_from(
+                self._mmap, offset
+            )
+            offset += _record_header.size
+            if direction is None or record_direction == direction:
+                yield CaptureRecord(
+                    record_direction,
+                    timestamp_ns,
+                    self._mmap[offset : offset + size],
+                )
+            offset += size
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """Every record in a capture, in the order they were recorded"""
+    capture = _Capture(path)
+    try:
+        yield from capture.records()
+    finally:
+        capture.close()
+
+
+class RecordingSerial:
+    """Wraps a serial.Serial, or anything like it, recording everything written to and
+    read from it into a capture file. Everything else is passed straight through.
+    Each record is flushed to the file as it is made, so a capture is complete up to
+    the moment a session crashes"""
+
+    def __init__(self, conn: Serial, path: str) -> None:
+        object.__setattr__(self, "conn", conn)
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "_file", open(path, "wb"))
+        object.__setattr__(self, "_start", time.perf_counter())
+        self._file.write(CAPTURE_MAGIC)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # So that, for example, setting the timeout configures the port
+        setattr(self.conn, name, value)
+
+    @property
+    def in_waiting(self) -> int:
+        n_waiting: int = self.conn.in_waiting
+        self._record(CAPTURE_WAITING, _waiting.pack(n_waiting))
+        return n_waiting
+
+    def write(self, data: bytes) -> int:
+        self._record(CAPTURE_TX, bytes(data))
+        n_bytes: int = self.conn.write(data)
+        return n_bytes
+
+    def read(self, size: int = 1) -> bytes:
+        data: bytes = self.conn.read(size)
+        self._record(CAPTURE_RX, data)
+        return data
+
+    def close(self) -> None:
+        self.conn.close()
+        self._file.close()
+
+    def _record(self, direction: int, data: bytes) -> None:
+        timestamp_ns = int((time.perf_counter() - self._start) * 1e9)
+        file: BinaryIO = self._file
+        file.write(_record_header.pack(direction, timestamp_ns, len(data)))
+        file.write(data)
+        file.flush()
+
+
+class ReplaySerial:
+    """A stand-in for serial.Serial that plays back a capture.
+
+    Reads return exactly what was read when the capture was recorded, including reads
+    that timed out, and never block, and in_waiting returns the counts seen when it
+    was recorded, in turn. Writes are checked against what was written, so a
+    ReplayMismatchError is raised as soon as a replay stops following the capture.
+    """
+
+    verify_writes = True
+
+    def __init__(
+        self,
+        path: str,
+        baudrate: int = 115200,
+        timeout: Optional[float] = 1,
+    ) -> None:
+        self.port = path
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.dtr = True
+        self.is_open = True
+        self._capture = _Capture(path)
+        self._tx_records = self._capture.records(CAPTURE_TX)
+        self._rx_records = self._capture.records(CAPTURE_RX)
+        self._waiting_records = self._capture.records(CAPTURE_WAITING)
+        self._tx_pending = b""
+        self._rx_pending = b""
+        self._next_rx: Optional[bytes] = None
+
+    @property
+    def in_waiting(self) -> int:
+        record = next(self._waiting_records, None)
+        if record is not None:
+            n_waiting: int = _waiting.unpack(record.data)[0]
+            return n_waiting
+        # Captures made before in_waiting was recorded
+        next_rx = self._peek_rx()
+        return len(self._rx_pending) + (len(next_rx) if next_rx else 0)
+
+    def write(self, data: bytes) -> int:
+        if self.verify_writes:
+            expected = self._tx_pending
+            while len(expected) < len(data):
+                record = next(self._tx_records, None)
+                if record is None:
+                    break
+                expected += record.data
+            if expected[: len(data)] != data:
+                raise ReplayMismatchError(expected[: len(data)], bytes(data))
+            self._tx_pending = expected[len(data) :]
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._rx_pending
+        while len(data) < size:
+            record_data = self._take_rx()
+            if record_data is None:
+                break
+            n_needed = size - len(data)
+            data += record_data
+            if len(record_data) < n_needed:
+                # The recorded read timed out here
+                break
+        self._rx_pending = data[size:]
+        return data[:size]
+
+    def reset_input_buffer(self) -> None:
+        # Whatever was discarded when recording was never read, so was not recorded
+        pass
+
+    def open(self) -> None:
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+        self._tx_records.close()
+        self._rx_records.close()
+        self._waiting_records.close()
+        self._capture.close()
+
+    def _peek_rx(self) -> Optional[bytes]:
+        if self._next_rx is None:
+            record = next(self._rx_records, None)
+            self._next_rx = record.data if record is not None else None
+        return self._next_rx
+
+    def _take_rx(self) -> Optional[bytes]:
+        data = self._peek_rx()
+        self._next_rx = None
+        return data
+
+
+def _default_capture_path(port: str) -> str:
+    return re.sub(r"[^\w.-]", "_", port.strip("/\\")) + ".rpdcap"
+
+
+class RecordingSerialConnection(SerialConnection):
+    """A SerialConnection that records all of its traffic, for use as an Arduino
+    conn_class.
+
+    The capture for a port is written to the path given for it in capture_paths, or
+    otherwise to a file in the working directory named after the port."""
+
+    @classmethod
+    def build(
+        cls,
+        port: str,
+        baudrate: int = 115200,
+        timeout: int = 1,
+        reset_on_open: bool = True,
+    ) -> "SerialConnection":
+        connection = super().build(port, baudrate, timeout, reset_on_open)
+        path = capture_paths.get(port) or _default_capture_path(port)
+        connection.conn = RecordingSerial(connection.conn, path)  # type: ignore
+        return connection
+
+
+class ReplaySerialConnection(SerialConnection):
+    """A SerialConnection that plays back a capture, for use as an Arduino conn_class.
+    The port is the path of the capture."""
+
+    @classmethod
+    def build(
+        cls,
+        port: str,
+        baudrate: int = 115200,
+        timeout: int = 1,
+        reset_on_open: bool = True,
+    ) -> "SerialConnection":
+        return cls(ReplaySerial(port, baudrate, timeout))  # type: ignore
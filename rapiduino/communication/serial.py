@@ -1,54 +1,567 @@
-import struct
-from typing import Tuple
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Container,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from serial import Serial
 
-from rapiduino.communication.command_spec import CommandSpec
+from rapiduino.communication.command_spec import (
+    CMD_PARROT,
+    CMD_POLL,
+    STREAM_END,
+    STREAM_FRAME,
+    CommandSpec,
+    stream_frame_struct,
+)
+from rapiduino.communication.framing import (
+    FRAME_BAD_CRC,
+    FRAME_DUPLICATE,
+    FRAME_EVENT,
+    FRAME_OK,
+    FRAME_OUT_OF_ORDER,
+    FrameDecoder,
+    encode_frame,
+)
+from rapiduino.communication.metrics import ConnectionMetrics
+from rapiduino.communication.timeouts import AdaptiveTimeout
 from rapiduino.exceptions import (
+    SerialConnectionFrameError,
+    SerialConnectionNotReadyError,
     SerialConnectionReceiveDataError,
     SerialConnectionSendDataError,
 )
 
+Command = Tuple[CommandSpec, Tuple[int, ...]]
+T = TypeVar("T")
+
 
 class SerialConnection:
+    max_retries = 3
+    # Each retry spends one unit of the budget and each successful read refills part
+    # of one, so a connection that has stopped responding fails fast
+    retry_budget = 10.0
+    retry_budget_refill = 0.1
+    max_resync_bytes = 1024
+    adaptive_timeouts = True
+    ready_poll_interval_s = 0.05
+    # Sequence numbers are a single byte, and the Arduino tells frames that are ahead
+    # of the one it expects from those it has already run by which half of the range
+    # they are in, so at most this many frames are awaited at once
+    max_frames_in_flight = 128
+
     def __init__(self, conn: Serial) -> None:
         self.conn = conn
+        self.framing = False
+        self._next_seq = 0
+        self._sent_frames: Dict[int, bytes] = {}
+        # Frames without reply data that were sent without waiting for their replies,
+        # in the order they were sent. Their replies are awaited with the next frames
+        self._unconfirmed_frames: List[int] = []
+        # Set when a framed exchange fails, after which the Arduino may be expecting
+        # a frame that will never be sent
+        self._frames_out_of_step = False
+        self._decoder = FrameDecoder()
+        # Bodies of event frames, without the status, waiting for recv_events
+        self._events: Deque[bytes] = deque()
+        timeout = getattr(conn, "timeout", None)
+        baudrate = getattr(conn, "baudrate", None)
+        self.timeouts = AdaptiveTimeout(
+            timeout if isinstance(timeout, (int, float)) else None,
+            baudrate if isinstance(baudrate, int) else None,
+        )
+        self._applied_timeout = self.timeouts.max_timeout
+        # When the last single command was written, for measuring its round trip
+        self._written_at: Optional[float] = None
+        # Bytes written since the last successful read, which the Arduino may still
+        # be receiving ahead of the reply
+        self._tx_bytes_pending = 0
+        self._retry_tokens = self.retry_budget
+        self._n_resyncs = 0
+        self._extra_read_time_s = 0.0
+        # Only collected when set, e.g. by enable_metrics
+        self.metrics: Optional[ConnectionMetrics] = None
 
     @classmethod
     def build(
-        cls, port: str, baudrate: int = 115200, timeout: int = 1
+        cls,
+        port: str,
+        baudrate: int = 115200,
+        timeout: int = 1,
+        reset_on_open: bool = True,
     ) -> "SerialConnection":
-        conn = Serial(port, baudrate=baudrate, timeout=timeout)
+        """Open the serial port. Most Arduinos reset when DTR is asserted on opening
+        the port; with reset_on_open=False, DTR is held low instead where the
+        operating system allows it, so the sketch carries on running"""
+        if reset_on_open:
+            conn = Serial(port, baudrate=baudrate, timeout=timeout)
+        else:
+            conn = Serial(baudrate=baudrate, timeout=timeout)
+            conn.port = port
+            conn.dtr = False
+            conn.open()
         return cls(conn)
 
+    def wait_until_ready(self, timeout: float = 5) -> None:
+        """Poll the Arduino until it replies, for example while the bootloader runs
+        after a reset, rather than sleeping for a fixed time"""
+        deadline = time.perf_counter() + timeout
+        self._set_timeout(self.ready_poll_interval_s)
+        try:
+            while True:
+                self.conn.reset_input_buffer()
+                self._write(CMD_POLL.encode())
+                if self.conn.read(CMD_POLL.rx_size) == b"\x01":
+                    break
+                if time.perf_counter() > deadline:
+                    raise SerialConnectionNotReadyError(timeout)
+            # A reply to an earlier poll may still be on its way
+            self._resync()
+        finally:
+            self._set_timeout(self.timeouts.max_timeout)
+
+    @property
+    def baudrate(self) -> int:
+        return int(self.conn.baudrate)
+
+    def set_baudrate(self, baudrate: int) -> None:
+        """Change the baud rate of this end of the connection only, discarding
+        anything received at the old baud rate"""
+        self.conn.baudrate = baudrate
+        self.conn.reset_input_buffer()
+        self._decoder = FrameDecoder()
+        self.timeouts = AdaptiveTimeout(self.timeouts.max_timeout, baudrate)
+
+    def enable_framing(self) -> None:
+        """Wrap every command in a frame with a sequence number, length and checksum.
+        Replies are matched to commands by sequence number, and commands that are
+        corrupted on the way to or from the Arduino are resent. Only sketches from
+        FRAMED_PROTOCOL_VERSION onwards understand frames.
+        """
+        self.framing = True
+
+    def enable_metrics(self) -> ConnectionMetrics:
+        if self.metrics is None:
+            self.metrics = ConnectionMetrics()
+        return self.metrics
+
+    @contextmanager
+    def slow_replies(self, extra_time_s: float) -> Iterator[None]:
+        """Allow replies to take up to extra_time_s longer than the longest timeout,
+        for commands that keep the Arduino busy. Their round trip times are not used
+        to adapt the timeouts"""
+        self._extra_read_time_s = extra_time_s
+        try:
+            yield
+        finally:
+            self._extra_read_time_s = 0.0
+            self._set_timeout(self.timeouts.max_timeout)
+
     def process_command(self, command: CommandSpec, *args: int) -> Tuple[int, ...]:
-        if len(args) != command.tx_len:
-            raise ValueError(
-                f"Expected args to be length {command.tx_len}, "
-                f"but received length {len(args)}"
-            )
+        if self.metrics is None:
+            return self._process_command(command, args)
+        return self.metrics.measure_command(
+            command.cmd, lambda: self._process_command(command, args)
+        )
+
+    def process_commands(self, commands: Sequence[Command]) -> List[Tuple[int, ...]]:
+        """Send several commands in a single write and collect all of the replies
+        with a single read. Replies are returned in the order the commands were given.
+        """
+        if self.metrics is None:
+            return self._process_commands(commands)
+        return self.metrics.measure_batch(
+            [command.cmd for command, _ in commands],
+            lambda: self._process_commands(commands),
+        )
+
+    def _process_command(
+        self, command: CommandSpec, args: Tuple[int, ...]
+    ) -> Tuple[int, ...]:
+        if self.framing:
+            return self._process_framed([(command, args)])[0]
 
         self._send(command, args)
 
-        return self._recv(command)
+        try:
+            return self._recv(command)
+        except SerialConnectionReceiveDataError as e:
+            return self._retry(lambda: self._send_and_recv(command, args), e)
 
-    def _send(self, cmd_spec: CommandSpec, data: Tuple[int, ...]) -> None:
-        bytes_to_send = struct.pack(
-            f"B{cmd_spec.tx_len}{cmd_spec.tx_type}", cmd_spec.cmd, *data
+    def _process_commands(self, commands: Sequence[Command]) -> List[Tuple[int, ...]]:
+        if self.framing:
+            replies = []
+            for i in range(0, len(commands), self.max_frames_in_flight):
+                replies += self._process_framed(
+                    commands[i : i + self.max_frames_in_flight]
+                )
+            return replies
+
+        bytes_to_send = bytearray(sum(command.tx_size for command, _ in commands))
+        offset = 0
+        for command, args in commands:
+            command.encode_into(bytes_to_send, offset, *args)
+            offset += command.tx_size
+        rx_size = sum(command.rx_size for command, _ in commands)
+        try:
+            bytes_read = self._send_and_read(bytes_to_send, rx_size, len(commands))
+        except SerialConnectionReceiveDataError as e:
+            bytes_read = self._retry(
+                lambda: self._send_and_read(bytes_to_send, rx_size, len(commands)), e
+            )
+
+        replies = []
+        offset = 0
+        for command, _ in commands:
+            replies.append(command.decode(bytes_read[offset:]))
+            offset += command.rx_size
+        return replies
+
+    def recv_stream_frame(self, n_values: int) -> Optional[Tuple[int, ...]]:
+        """Read one frame sent by the Arduino while streaming, returning the timestamp
+        followed by the values, or None if the frame marks the end of the stream.
+        Bytes that do not start a frame are skipped until the stream is back in sync.
+        """
+        # Frames arrive at the stream's rate, which is unrelated to the round trip time
+        frame_struct = stream_frame_struct(n_values)
+        frame = self._read(frame_struct.size, adaptive=False)
+        while frame[0] not in (STREAM_FRAME, STREAM_END):
+            frame = frame[1:] + self._read(1, adaptive=False)
+        if frame[0] == STREAM_END:
+            return None
+        return frame_struct.unpack(frame)[1:]
+
+    def recv_stream_frames(self, n_values: int, max_frames: int) -> Tuple[bytes, bool]:
+        """Read up to max_frames frames sent by the Arduino while streaming, as many as
+        have already arrived but at least one, and return them undecoded, along with
+        whether the stream has ended. The frames returned are whole and in sync, as
+        for recv_stream_frame
+        """
+        frame_size = stream_frame_struct(n_values).size
+        n_frames = min(max(self.conn.in_waiting // frame_size, 1), max_frames)
+        data = self._read(n_frames * frame_size, adaptive=False)
+        if all(header == STREAM_FRAME for header in data[::frame_size]):
+            return data, False
+        # Out of sync, or the end of the stream, so sort the rest out frame by frame
+        frames = b""
+        offset = 0
+        while offset < len(data):
+            if data[offset] not in (STREAM_FRAME, STREAM_END):
+                offset += 1
+                continue
+            frame = data[offset : offset + frame_size]
+            frame += self._read(frame_size - len(frame), adaptive=False)
+            if frame[0] == STREAM_END:
+                return frames, True
+            frames += frame
+            offset += frame_size
+        return frames, False
+
+    def recv_events(self, timeout: float = 0) -> List[bytes]:
+        """Return the bodies, after the status, of the event frames the Arduino has
+        pushed since the last call, waiting up to timeout seconds for one if there are
+        none. Events only arrive over a framed connection"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            n_waiting = self.conn.in_waiting
+            remaining = deadline - time.perf_counter()
+            if not n_waiting and (self._events or remaining <= 0):
+                break
+            # Once part of a frame has arrived, the rest follows promptly
+            self._set_timeout(
+                self.timeouts.max_timeout if n_waiting else max(remaining, 0)
+            )
+            n_bytes = self._decoder.bytes_needed
+            bytes_read = self.conn.read(n_bytes)
+            if self.metrics is not None:
+                self.metrics.record_bytes(n_received=len(bytes_read))
+            for frame in self._decoder.feed(bytes_read):
+                # Anything else is a late reply to a frame that was resent
+                if frame.body[:1] == bytes((FRAME_EVENT,)):
+                    self._events.append(frame.body[1:])
+            if not bytes_read and remaining <= 0:
+                break
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def flush(self) -> None:
+        """Send any commands that are being held back. Commands are always sent
+        straight away by this class, so there is nothing to do"""
+
+    def send_unframed(self, command: CommandSpec, *args: int) -> None:
+        """Send a command without a reply unframed, even if framing is enabled. This
+        is for commands such as CMD_STREAMSTOP, whose framed reply could not be told
+        apart from the stream data around it"""
+        self._write(command.encode(*args))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _encode_command(self, command: CommandSpec, args: Tuple[int, ...]) -> bytes:
+        """The bytes to send for a command, framed if framing is enabled. Frames are
+        kept until their sequence number is reused, so that they can be resent"""
+        if not self.framing:
+            return command.encode(*args)
+        seq = self._next_seq
+        self._next_seq = (seq + 1) % 256
+        frame = encode_frame(seq, command.encode(*args))
+        self._sent_frames[seq] = frame
+        return frame
+
+    def _process_framed(self, commands: Sequence[Command]) -> List[Tuple[int, ...]]:
+        if self._frames_out_of_step:
+            self._restart_frames()
+        n_in_flight = len(self._unconfirmed_frames) + len(commands)
+        if n_in_flight > self.max_frames_in_flight:
+            self._confirm_frames()
+        bytes_to_send = bytearray()
+        seqs = []
+        for command, args in commands:
+            frame = self._encode_command(command, args)
+            bytes_to_send += frame
+            seqs.append(frame[2])
+        pending = self._unconfirmed_frames + seqs
+        self._write(bytes_to_send, n_commands=len(pending))
+
+        self._unconfirmed_frames = []
+        replies = self._recv_framed_replies(
+            pending,
+            {seq for seq, (command, _) in zip(seqs, commands) if command.rx_len},
         )
+
+        results: List[Tuple[int, ...]] = []
+        for seq, (command, _) in zip(seqs, commands):
+            if not command.rx_len:
+                results.append(())
+                continue
+            if len(replies[seq]) != command.rx_size:
+                raise SerialConnectionReceiveDataError(
+                    n_bytes_intended=command.rx_size, n_bytes_actual=len(replies[seq])
+                )
+            results.append(command.decode(replies[seq]))
+        return results
+
+    def _restart_frames(self) -> None:
+        """Throw away whatever is left of a failed framed exchange. The unframed
+        commands this sends make the Arduino run the next frame whatever its number"""
+        try:
+            self._resync()
+        except SerialConnectionReceiveDataError as e:
+            # The Arduino skips bytes for a while after a bad frame
+            self._retry(lambda: None, e)
+        self._decoder = FrameDecoder()
+        self._frames_out_of_step = False
+
+    def _confirm_frames(self) -> None:
+        """Wait for the replies to the frames sent without waiting for them"""
+        pending = self._unconfirmed_frames
+        self._unconfirmed_frames = []
+        self._recv_framed_replies(pending, ())
+
+    def _recv_framed_replies(
+        self, pending: List[int], needs_data: Container[int]
+    ) -> Dict[int, bytes]:
+        """Read reply frames until every pending frame, given in the order they were
+        sent, is known to have run, returning the reply data of those in needs_data"""
+        try:
+            return self._read_framed_replies(pending, needs_data)
+        except Exception:
+            self._frames_out_of_step = True
+            raise
+
+    def _read_framed_replies(
+        self, pending: List[int], needs_data: Container[int]
+    ) -> Dict[int, bytes]:
+        """The Arduino runs frames in order, so a reply to one frame shows that every
+        frame sent before it has run. A frame that is lost or rejected is resent
+        along with every frame after it, which the Arduino will have refused to run
+        out of order. A frame that has already run is never run again"""
+        replies: Dict[int, bytes] = {}
+        n_resent: Dict[int, int] = {}
+        n_replies: Dict[int, int] = {}
+        while pending:
+            n_bytes = self._decoder.bytes_needed
+            self._set_read_timeout(n_bytes, adaptive=True)
+            bytes_read = self.conn.read(n_bytes)
+            if self.metrics is not None:
+                self.metrics.record_bytes(n_received=len(bytes_read))
+                if len(bytes_read) < n_bytes:
+                    self.metrics.record_timeout()
+            frames = self._decoder.feed(bytes_read)
+            if len(bytes_read) < n_bytes:
+                frames += self._decoder.skip_frame()
+                if not frames:
+                    # Nothing more is coming, so whatever is still pending was lost
+                    self._resend(pending, n_resent)
+                    continue
+
+            for frame in frames:
+                status = frame.body[0] if frame.body else FRAME_BAD_CRC
+                if status == FRAME_EVENT:
+                    self._events.append(frame.body[1:])
+                    continue
+                if frame.seq not in pending:
+                    # A late reply to a frame that was resent
+                    continue
+                n_replies[frame.seq] = n_replies.get(frame.seq, 0) + 1
+                if status in (FRAME_BAD_CRC, FRAME_OUT_OF_ORDER):
+                    # An error in reply to an earlier copy of the frame was dealt
+                    # with when the frame was resent
+                    if n_replies[frame.seq] > n_resent.get(frame.seq, 0):
+                        self._resend(pending, n_resent)
+                    continue
+                if status not in (FRAME_OK, FRAME_DUPLICATE):
+                    raise SerialConnectionFrameError(frame.seq, status)
+                index = pending.index(frame.seq)
+                for seq in pending[:index]:
+                    if seq in needs_data:
+                        # It ran, but its reply was lost and cannot be sent again
+                        raise SerialConnectionFrameError(seq, None)
+                if frame.seq in needs_data:
+                    if status == FRAME_DUPLICATE:
+                        raise SerialConnectionFrameError(frame.seq, status)
+                    replies[frame.seq] = frame.body[1:]
+                pending = pending[index + 1 :]
+        self._read_succeeded(record_rtt=not n_resent and not self._extra_read_time_s)
+        return replies
+
+    def _resend(self, seqs: List[int], n_resent: Dict[int, int]) -> None:
+        for seq in seqs:
+            n_resent[seq] = n_resent.get(seq, 0) + 1
+            if (
+                seq not in self._sent_frames
+                or n_resent[seq] > self.max_retries
+                or self._retry_tokens < 1
+            ):
+                raise SerialConnectionFrameError(seq, None)
+            self._retry_tokens -= 1
+        if seqs:
+            if self.metrics is not None:
+                self.metrics.record_retries(len(seqs))
+            self._write(
+                b"".join(self._sent_frames[seq] for seq in seqs), n_commands=len(seqs)
+            )
+
+    def _retry(self, function: Callable[[], T], error: Exception) -> T:
+        """Resync and call function again after it failed with error, until it
+        succeeds, it has been retried max_retries times or the retry budget runs out"""
+        for _ in range(self.max_retries):
+            if self._retry_tokens < 1:
+                break
+            self._retry_tokens -= 1
+            if self.metrics is not None:
+                self.metrics.record_retries()
+            try:
+                self._resync()
+                return function()
+            except SerialConnectionReceiveDataError as e:
+                error = e
+            except SerialConnectionSendDataError:
+                # Retrying cannot help if nothing can be sent
+                break
+        raise error
+
+    def _resync(self) -> None:
+        """Throw away whatever is left of a failed exchange: everything already
+        received, then everything up to the echoes of a pair of parrot commands"""
+        self.conn.reset_input_buffer()
+        self._n_resyncs = (self._n_resyncs + 1) % 256
+        marker = bytes((self._n_resyncs, self._n_resyncs ^ 0xFF))
+        self._write(
+            CMD_PARROT.encode(marker[0]) + CMD_PARROT.encode(marker[1]), n_commands=2
+        )
+        received = self._read(2)
+        for _ in range(self.max_resync_bytes):
+            if received == marker:
+                return
+            received = received[1:] + self._read(1)
+        raise SerialConnectionReceiveDataError(n_bytes_intended=2, n_bytes_actual=0)
+
+    def _send_and_recv(
+        self, cmd_spec: CommandSpec, data: Tuple[int, ...]
+    ) -> Tuple[int, ...]:
+        self._send(cmd_spec, data)
+        return self._recv(cmd_spec)
+
+    def _send_and_read(
+        self, bytes_to_send: Union[bytes, bytearray], n_bytes: int, n_commands: int
+    ) -> bytes:
+        self._write(bytes_to_send, n_commands)
+        return self._read(n_bytes)
+
+    def _send(self, cmd_spec: CommandSpec, data: Tuple[int, ...]) -> None:
+        self._write(cmd_spec.encode(*data))
+
+    def _recv(self, cmd_spec: CommandSpec) -> Tuple[int, ...]:
+        if cmd_spec.rx_len == 0:
+            return ()
+        return cmd_spec.decode(self._read(cmd_spec.rx_size))
+
+    def _write(
+        self, bytes_to_send: Union[bytes, bytearray], n_commands: int = 1
+    ) -> None:
+        """Write bytes_to_send, which holds n_commands commands. The round trip is
+        only measured for a single command"""
         n_bytes_written = self.conn.write(bytes_to_send)
         if n_bytes_written != len(bytes_to_send):
             raise SerialConnectionSendDataError(
                 n_bytes_intended=len(bytes_to_send), n_bytes_actual=n_bytes_written
             )
+        self._tx_bytes_pending += n_bytes_written
+        self._written_at = time.perf_counter() if n_commands == 1 else None
+        if self.metrics is not None:
+            self.metrics.record_bytes(n_sent=n_bytes_written)
 
-    def _recv(self, cmd_spec: CommandSpec) -> Tuple[int, ...]:
-        if cmd_spec.rx_len == 0:
-            return ()
-        bytes_read = self.conn.read(cmd_spec.rx_len)
-        if len(bytes_read) != cmd_spec.rx_len:
+    def _read(self, n_bytes: int, adaptive: bool = True) -> bytes:
+        if n_bytes == 0:
+            return bytes()
+        self._set_read_timeout(n_bytes, adaptive)
+        bytes_read = self.conn.read(n_bytes)
+        if self.metrics is not None:
+            self.metrics.record_bytes(n_received=len(bytes_read))
+        if len(bytes_read) != n_bytes:
+            if self.metrics is not None:
+                self.metrics.record_timeout()
             raise SerialConnectionReceiveDataError(
-                n_bytes_intended=cmd_spec.rx_len,
+                n_bytes_intended=n_bytes,
                 n_bytes_actual=len(bytes_read),
             )
-        return struct.unpack(f"{cmd_spec.rx_len}{cmd_spec.rx_type}", bytes_read)
+        self._read_succeeded(record_rtt=adaptive and not self._extra_read_time_s)
+        return bytes_read
+
+    def _read_succeeded(self, record_rtt: bool) -> None:
+        if record_rtt and self._written_at is not None:
+            self.timeouts.record(time.perf_counter() - self._written_at)
+            self._written_at = None
+        self._tx_bytes_pending = 0
+        if self._retry_tokens < self.retry_budget:
+            self._retry_tokens += self.retry_budget_refill
+
+    def _set_read_timeout(self, n_bytes: int, adaptive: bool) -> None:
+        max_timeout = self.timeouts.max_timeout
+        if self._extra_read_time_s:
+            if max_timeout is not None:
+                self._set_timeout(max_timeout + self._extra_read_time_s)
+        elif self.adaptive_timeouts:
+            self._set_timeout(
+                self.timeouts.timeout(n_bytes, self._tx_bytes_pending)
+                if adaptive
+                else max_timeout
+            )
+
+    def _set_timeout(self, timeout: Optional[float]) -> None:
+        if timeout != self._applied_timeout:
+            self.conn.timeout = timeout
+            self._applied_timeout = timeout
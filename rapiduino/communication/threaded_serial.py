@@ -0,0 +1,149 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+from serial import Serial
+
+from rapiduino.communication.command_spec import CommandSpec
+from rapiduino.communication.serial import Command, SerialConnection
+from rapiduino.exceptions import SerialConnectionReceiveDataError
+
+
+class _Request:
+    def __init__(self, command: CommandSpec, args: Tuple[int, ...]) -> None:
+        self.command = command
+        self.args = args
+        self.bytes_to_send = command.encode(*args)
+        self.future: "Future[Tuple[int, ...]]" = Future()
+
+
+class _Job:
+    def __init__(self, function: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        self.function = function
+        self.args = args
+        self.future: "Future[Any]" = Future()
+
+
+class ThreadedSerialConnection(SerialConnection):
+    """A SerialConnection that can be shared between threads.
+
+    A single I/O thread owns the serial port. Callers queue commands and wait for
+    their replies; the I/O thread sends everything that is queued in one write and
+    resolves each caller's future as the replies are read back.
+    """
+
+    max_batch_size = 64
+
+    def __init__(self, conn: Serial) -> None:
+        super().__init__(conn)
+        self._queue: "queue.Queue[Optional[Union[_Request, _Job]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, command: CommandSpec, *args: int) -> "Future[Tuple[int, ...]]":
+        """Queue a command without waiting for it. The returned future resolves to
+        the reply once the I/O thread has read it"""
+        request = _Request(command, args)
+        self._queue.put(request)
+        return request.future
+
+    def _process_command(
+        self, command: CommandSpec, args: Tuple[int, ...]
+    ) -> Tuple[int, ...]:
+        return self.submit(command, *args).result()
+
+    def _process_commands(self, commands: Sequence[Command]) -> List[Tuple[int, ...]]:
+        futures = [self.submit(command, *args) for command, args in commands]
+        return [future.result() for future in futures]
+
+    def recv_stream_frame(self, n_values: int) -> Optional[Tuple[int, ...]]:
+        return self._run_on_io_thread(super().recv_stream_frame, n_values)
+
+    def recv_stream_frames(self, n_values: int, max_frames: int) -> Tuple[bytes, bool]:
+        return self._run_on_io_thread(super().recv_stream_frames, n_values, max_frames)
+
+    def recv_events(self, timeout: float = 0) -> List[bytes]:
+        return self._run_on_io_thread(super().recv_events, timeout)
+
+    def send_unframed(self, command: CommandSpec, *args: int) -> None:
+        self._run_on_io_thread(super().send_unframed, command, *args)
+
+    def wait_until_ready(self, timeout: float = 5) -> None:
+        self._run_on_io_thread(super().wait_until_ready, timeout)
+
+    def set_baudrate(self, baudrate: int) -> None:
+        self._run_on_io_thread(super().set_baudrate, baudrate)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self.conn.close()
+
+    def _run_on_io_thread(self, function: Callable[..., Any], *args: Any) -> Any:
+        job = _Job(function, args)
+        self._queue.put(job)
+        return job.future.result()
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.max_batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            requests: List[_Request] = []
+            for item in items:
+                if isinstance(item, _Request):
+                    requests.append(item)
+                    continue
+                self._process_requests(requests)
+                requests = []
+                if item is None:
+                    return
+                self._process_job(item)
+            self._process_requests(requests)
+
+    def _process_requests(self, requests: List[_Request]) -> None:
+        if not requests:
+            return
+        if self.framing:
+            self._process_framed_requests(requests)
+            return
+        bytes_to_send = b"".join(request.bytes_to_send for request in requests)
+        rx_size = sum(r.command.rx_size for r in requests)
+        try:
+            try:
+                bytes_read = self._send_and_read(bytes_to_send, rx_size, len(requests))
+            except SerialConnectionReceiveDataError as e:
+                bytes_read = self._retry(
+                    lambda: self._send_and_read(bytes_to_send, rx_size, len(requests)),
+                    e,
+                )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for request in requests:
+            request.future.set_result(request.command.decode(bytes_read[offset:]))
+            offset += request.command.rx_size
+
+    def _process_framed_requests(self, requests: List[_Request]) -> None:
+        try:
+            replies = super()._process_commands([(r.command, r.args) for r in requests])
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for request, reply in zip(requests, replies):
+            request.future.set_result(reply)
+
+    @staticmethod
+    def _process_job(job: _Job) -> None:
+        try:
+            job.future.set_result(job.function(*job.args))
+        except Exception as e:
+            job.future.set_exception(e)
@@ -0,0 +1,55 @@
+from collections import deque
+from typing import Deque, Optional
+
+
+class AdaptiveTimeout:
+    """Chooses read timeouts from recently measured round trip times.
+
+    The timeout for a read is the percentile of the last window_size round trip
+    times, plus a margin and the time to transfer the bytes being read and the bytes
+    still being sent ahead of them, but never more than max_timeout. Until min_samples
+    round trips have been measured, max_timeout is used. Only round trips of single
+    commands should be recorded, as the time taken by a batch depends on its size.
+    """
+
+    window_size = 256
+    min_samples = 20
+    percentile = 0.99
+    margin_s = 0.005
+    min_timeout_s = 0.002
+
+    def __init__(self, max_timeout: Optional[float], baudrate: Optional[int]) -> None:
+        self.max_timeout = max_timeout
+        self.byte_time_s = 10 / baudrate if baudrate else 0.0
+        self._samples: Deque[float] = deque(maxlen=self.window_size)
+        self._n_since_update = 0
+        self._rtt_percentile: Optional[float] = None
+
+    @property
+    def rtt_percentile(self) -> Optional[float]:
+        return self._rtt_percentile
+
+    def record(self, rtt_s: float) -> None:
+        self._samples.append(rtt_s)
+        self._n_since_update += 1
+        # Sorting the window on every command would cost more than it saves, and
+        # the percentile moves slowly anyway
+        if len(self._samples) >= self.min_samples and (
+            self._rtt_percentile is None or self._n_since_update >= 32
+        ):
+            ordered = sorted(self._samples)
+            index = min(int(len(ordered) * self.percentile), len(ordered) - 1)
+            self._rtt_percentile = ordered[index]
+            self._n_since_update = 0
+
+    def timeout(self, n_bytes: int, tx_bytes: int = 0) -> Optional[float]:
+        if self._rtt_percentile is None:
+            return self.max_timeout
+        transfer_time_s = (n_bytes + tx_bytes) * self.byte_time_s
+        timeout = max(
+            self._rtt_percentile + self.margin_s + transfer_time_s, self.min_timeout_s
+        )
+        if self.max_timeout is not None:
+            timeout = min(timeout, self.max_timeout)
+        # Changing the timeout reconfigures the port, so only whole milliseconds
+        return round(timeout, 3)
@@ -0,0 +1,704 @@
+import bisect
+import struct
+from dataclasses import dataclass
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+
+from rapiduino.boards.pins import Pin, get_uno_pins
+from rapiduino.communication.command_spec import (
+    BAUD_RATES,
+    EVENT_ANALOG_DELTA,
+    EVENT_ANALOG_FALL,
+    EVENT_ANALOG_RISE,
+    EVENT_DIGITAL,
+    MAX_ANALOG_WATCHED,
+    MAX_MACRO_SIZE,
+    MAX_MACROS,
+    MAX_OVERSAMPLE,
+    MAX_SCHEDULED,
+    MAX_WATCHED,
+    NO_THRESHOLD,
+    OVERSAMPLE_MEDIAN,
+    SCHEDULE_ALL,
+    SCHEDULE_FULL,
+    STREAM_END,
+    STREAM_FRAME,
+    UNWATCH_ALL,
+    WATCH_FULL,
+    WATCH_INTERRUPT,
+    WATCH_POLLING,
+    event_struct,
+)
+from rapiduino.communication.framing import (
+    FRAME_BAD_CRC,
+    FRAME_DUPLICATE,
+    FRAME_EVENT,
+    FRAME_OK,
+    FRAME_OUT_OF_ORDER,
+    FRAME_START,
+    FRAME_TOO_LONG,
+    FRAME_UNKNOWN_COMMAND,
+    MAX_FRAME_BODY,
+    crc8,
+    encode_frame,
+)
+from rapiduino.globals.common import INPUT, INPUT_PULLUP, OUTPUT
+
+# Handlers for commands with arguments are generators, receiving each byte of their
+# arguments from a `yield` expression, just as the sketch calls recvByte
+CommandHandler = Generator[None, int, None]
+
+
+@dataclass
+class EmulatedPin:
+    mode: int = INPUT.value
+    output_state: int = 0
+    pwm_value: int = 0
+    input_state: int = 0
+    analog_value: int = 0
+
+
+@dataclass
+class ScheduledAction:
+    pin_no: int
+    state: int
+    next_us: int
+    high_us: int
+    low_us: int
+    # 0 repeats until cancelled
+    edges_left: int
+
+
+@dataclass
+class WatchedPin:
+    pin_no: int
+    debounce_us: int
+    raw: int
+    reported: int
+    changed_us: int
+
+
+@dataclass
+class AnalogWatch:
+    pin_no: int
+    threshold: int
+    hysteresis: int
+    min_delta: int
+    interval_us: int
+    next_us: int
+    last_reported: int
+    above: bool
+
+
+class EmulatedBoard:
+    """A pure-Python model of an Arduino running the Rapiduino sketch.
+
+    Bytes sent by the host are fed in with `receive` and the bytes the sketch would
+    send back accumulate in `output`. Time on the board is simulated in microseconds
+    and only moves forward when `service` is called.
+    """
+
+    version = (0, 11, 0)
+    # Bitmask of the BAUD_RATES the board claims to support
+    supported_baudrates = 0b11111
+    baud_revert_delay_us = 500000
+    # Pins with a hardware interrupt, as on the Uno
+    interrupt_pins = (2, 3)
+
+    def __init__(self, pins: Optional[Tuple[Pin, ...]] = None) -> None:
+        self.pins = [EmulatedPin() for _ in (pins or get_uno_pins())]
+        self.output = bytearray()
+        self._reply: Optional[bytearray] = None
+        self.micros = 0
+        self.stream_pins: List[int] = []
+        self.stream_period_us = 0
+        self.next_sample_us: Optional[int] = None
+        self.baudrate = BAUD_RATES[0]
+        self.baud_revert_us: Optional[int] = None
+        self._previous_baudrate = self.baudrate
+        self.scheduled: List[Optional[ScheduledAction]] = [None] * MAX_SCHEDULED
+        # Times in microseconds at which digital inputs change, as (time, pin, state)
+        self.input_changes: List[Tuple[int, int, int]] = []
+        self.macros = [bytearray() for _ in range(MAX_MACROS)]
+        self.watched: List[WatchedPin] = []
+        self.analog_watched: List[AnalogWatch] = []
+        self._event_seq = 0
+        # The sequence number of the next frame to run, or None until a frame sets it
+        self._expected_seq: Optional[int] = None
+        self._last_reply = b""
+        self._handlers: Dict[int, Callable[[], Optional[CommandHandler]]] = {
+            0: self._poll,
+            1: self._parrot,
+            2: self._version,
+            3: self._baudrates,
+            4: self._set_baud,
+            10: self._pin_mode,
+            20: self._digital_read,
+            21: self._digital_write,
+            22: self._digital_write_many,
+            23: self._digital_read_all,
+            30: self._analog_read,
+            31: self._analog_write,
+            32: self._analog_read_many,
+            33: self._analog_read_oversampled,
+            40: self._stream_start,
+            41: self._stream_stop,
+            50: self._schedule,
+            51: self._cancel_schedule,
+            52: self._pulse_in,
+            60: self._macro_write,
+            61: self._macro_run,
+            70: self._watch_digital,
+            71: self._unwatch,
+            72: self._watch_analog,
+        }
+        self._parser = self._loop()
+        next(self._parser)
+
+    def receive(self, data: bytes) -> None:
+        for byte in data:
+            self._parser.send(byte)
+        self._record_changes()
+
+    def take_output(self, n_bytes: Optional[int] = None) -> bytes:
+        n_bytes = len(self.output) if n_bytes is None else n_bytes
+        data = bytes(self.output[:n_bytes])
+        del self.output[:n_bytes]
+        return data
+
+    def service(self, until_us: Optional[int] = None) -> None:
+        """Run the board's background work, advancing the clock to until_us. With no
+        time given, the clock jumps straight to the next piece of scheduled work."""
+        if until_us is None:
+            scheduled = [
+                time_us
+                for time_us in (
+                    self.next_sample_us,
+                    self.baud_revert_us,
+                    self._next_edge_us(),
+                    self._next_event_us(),
+                )
+                if time_us is not None
+            ]
+            if not scheduled:
+                return
+            until_us = min(scheduled)
+        next_edge_us = self._next_edge_us()
+        while next_edge_us is not None and next_edge_us <= until_us:
+            self._report_changes(next_edge_us)
+            self._run_edges(next_edge_us)
+            self._record_changes()
+            next_edge_us = self._next_edge_us()
+        self._report_changes(until_us)
+        self._sample_analog_watches(until_us)
+        while self.next_sample_us is not None and self.next_sample_us <= until_us:
+            self.micros = self.next_sample_us
+            self.next_sample_us += self.stream_period_us
+            self._send_stream_frame(STREAM_FRAME)
+        if self.baud_revert_us is not None and self.baud_revert_us <= until_us:
+            self.baudrate = self._previous_baudrate
+            self.baud_revert_us = None
+        self.micros = max(self.micros, until_us)
+
+    @property
+    def has_background_work(self) -> bool:
+        """Whether the board has work that will send something to the host"""
+        return (
+            self.next_sample_us is not None
+            or self.baud_revert_us is not None
+            or self._next_event_us() is not None
+        )
+
+    def set_digital_input(self, pin_no: int, state: int) -> None:
+        self.pins[pin_no].input_state = state
+        self._record_changes()
+
+    def set_analog_input(self, pin_no: int, value: int) -> None:
+        self.pins[pin_no].analog_value = value
+
+    def schedule_digital_input(self, pin_no: int, state: int, at_us: int) -> None:
+        """Change a digital input once the board's clock reaches at_us"""
+        bisect.insort(self.input_changes, (at_us, pin_no, state))
+
+    def digital_read(self, pin_no: int) -> int:
+        pin = self.pins[pin_no]
+        if pin.mode == OUTPUT.value:
+            return pin.output_state
+        if pin.mode == INPUT_PULLUP.value and not pin.input_state:
+            return 1
+        return pin.input_state
+
+    def analog_read(self, pin_no: int) -> int:
+        return self.pins[pin_no].analog_value if pin_no < len(self.pins) else 0
+
+    def _next_edge_us(self) -> Optional[int]:
+        times = [action.next_us for action in self.scheduled if action is not None]
+        if self.input_changes:
+            times.append(self.input_changes[0][0])
+        return min(times) if times else None
+
+    def _run_edges(self, time_us: int) -> None:
+        self.micros = max(self.micros, time_us)
+        while self.input_changes and self.input_changes[0][0] <= time_us:
+            _, pin_no, state = self.input_changes.pop(0)
+            self.pins[pin_no].input_state = state
+        for slot, action in enumerate(self.scheduled):
+            if action is None or action.next_us > time_us:
+                continue
+            if self._valid_pin(action.pin_no):
+                pin = self.pins[action.pin_no]
+                pin.output_state = action.state
+                pin.pwm_value = 255 * action.state
+            if action.edges_left == 1:
+                self.scheduled[slot] = None
+                continue
+            if action.edges_left > 0:
+                action.edges_left -= 1
+            action.next_us += action.high_us if action.state else action.low_us
+            action.state = 1 - action.state
+
+    def _next_event_us(self) -> Optional[int]:
+        """When the next change to a watched pin is due to be reported, or failing
+        that, when the next change to one happens"""
+        if self.next_sample_us is not None:
+            return None
+        watched_pins = {watched.pin_no for watched in self.watched}
+        times = [
+            watched.changed_us + watched.debounce_us
+            for watched in self.watched
+            if watched.raw != watched.reported
+        ]
+        times += [
+            action.next_us
+            for action in self.scheduled
+            if action is not None and action.pin_no in watched_pins
+        ]
+        times += [
+            at_us for at_us, pin_no, _ in self.input_changes if pin_no in watched_pins
+        ]
+        # Analog values only change when set, so the next sample gives an event now
+        # or never
+        times += [
+            watch.next_us
+            for watch in self.analog_watched
+            if self._analog_event_type(watch, self.analog_read(watch.pin_no))
+            is not None
+        ]
+        return min(times) if times else None
+
+    def _analog_event_type(self, watch: AnalogWatch, value: int) -> Optional[int]:
+        if watch.threshold != NO_THRESHOLD:
+            if not watch.above and value >= watch.threshold:
+                return EVENT_ANALOG_RISE
+            if watch.above and value + watch.hysteresis < watch.threshold:
+                return EVENT_ANALOG_FALL
+        if watch.min_delta and abs(value - watch.last_reported) >= watch.min_delta:
+            return EVENT_ANALOG_DELTA
+        return None
+
+    def _sample_analog_watches(self, until_us: int) -> None:
+        if self.next_sample_us is not None:
+            return
+        for watch in self.analog_watched:
+            if watch.next_us > until_us:
+                continue
+            value = self.analog_read(watch.pin_no)
+            event_type = self._analog_event_type(watch, value)
+            if event_type is not None:
+                if event_type != EVENT_ANALOG_DELTA:
+                    watch.above = event_type == EVENT_ANALOG_RISE
+                watch.last_reported = value
+                self._send_event(event_type, watch.pin_no, value, watch.next_us)
+            # The value cannot change again before until_us, so skip the samples
+            # that would find it unchanged
+            n_samples = (until_us - watch.next_us) // watch.interval_us + 1
+            watch.next_us += n_samples * watch.interval_us
+
+    def _record_changes(self) -> None:
+        for watched in self.watched:
+            state = self.digital_read(watched.pin_no)
+            if state != watched.raw:
+                watched.raw = state
+                watched.changed_us = self.micros
+
+    def _report_changes(self, until_us: int) -> None:
+        # Unframed stream frames cannot be mixed with events
+        if self.next_sample_us is not None:
+            return
+        for watched in self.watched:
+            if (
+                watched.raw != watched.reported
+                and watched.changed_us + watched.debounce_us <= until_us
+            ):
+                watched.reported = watched.raw
+                self._send_event(
+                    EVENT_DIGITAL, watched.pin_no, watched.raw, watched.changed_us
+                )
+
+    def _send_event(
+        self, event_type: int, pin_no: int, value: int, timestamp_us: int
+    ) -> None:
+        body = bytes((FRAME_EVENT,)) + event_struct.pack(
+            event_type, pin_no, value, timestamp_us & 0xFFFFFFFF
+        )
+        self.output += encode_frame(self._event_seq, body)
+        self._event_seq = (self._event_seq + 1) % 256
+
+    def _wait_while_level(self, pin_no: int, level: int, deadline_us: int) -> bool:
+        """Advance the clock until the pin leaves level, returning False if it is
+        still there at deadline_us"""
+        while self.digital_read(pin_no) == level:
+            next_edge_us = self._next_edge_us()
+            if next_edge_us is None or next_edge_us > deadline_us:
+                self.service(deadline_us)
+                return False
+            self.service(next_edge_us)
+        return True
+
+    def _loop(self) -> CommandHandler:
+        while True:
+            cmd = yield
+            if cmd == FRAME_START:
+                yield from self._recv_frame()
+                continue
+            self._expected_seq = None
+            handler = self._handlers.get(cmd)
+            if handler is None:
+                continue
+            args_parser = handler()
+            if args_parser is not None:
+                yield from args_parser
+
+    def _recv_frame(self) -> CommandHandler:
+        length = yield
+        seq = yield
+        body = bytearray()
+        for _ in range(length):
+            body.append((yield))
+        crc = yield
+        if length > MAX_FRAME_BODY:
+            reply = bytes((FRAME_TOO_LONG,))
+        elif crc8(bytes((length, seq)) + body) != crc:
+            reply = bytes((FRAME_BAD_CRC,))
+        else:
+            offset = (
+                0 if self._expected_seq is None else (seq - self._expected_seq) % 256
+            )
+            if offset == 0:
+                status, data = self._run_framed_command(bytes(body))
+                self._last_reply = bytes((status,)) + data
+                self._expected_seq = (seq + 1) % 256
+                reply = self._last_reply
+            elif offset < 128:
+                reply = bytes((FRAME_OUT_OF_ORDER,))
+            elif offset == 255:
+                # The last frame run, resent because its reply was lost
+                reply = self._last_reply
+            else:
+                reply = bytes((FRAME_DUPLICATE,))
+        self.output += encode_frame(seq, reply)
+
+    def _run_commands(self, code: bytes) -> bool:
+        """Run a macro, returning False if it stopped at a command that cannot be
+        run. Like recvByte in the sketch, reading past the end of the macro gives
+        zeros"""
+        args = iter(code)
+        for cmd in args:
+            handler = self._handlers.get(cmd)
+            # Macros cannot change or run macros
+            if handler is None or cmd in (60, 61):
+                return False
+            args_parser = handler()
+            if args_parser is not None:
+                next(args_parser)
+                try:
+                    while True:
+                        args_parser.send(next(args, 0))
+                except StopIteration:
+                    pass
+        return True
+
+    def _run_framed_command(self, body: bytes) -> Tuple[int, bytes]:
+        handler = self._handlers.get(body[0]) if body else None
+        if handler is None:
+            return FRAME_UNKNOWN_COMMAND, b""
+        self._reply = bytearray()
+        try:
+            args_parser = handler()
+            if args_parser is not None:
+                # Like recvByte in the sketch, reading past the end of the frame
+                # gives zeros
+                next(args_parser)
+                args = iter(body[1:])
+                try:
+                    while True:
+                        args_parser.send(next(args, 0))
+                except StopIteration:
+                    pass
+            return FRAME_OK, bytes(self._reply)
+        finally:
+            self._reply = None
+
+    def _send(self, data_format: str, *values: int) -> None:
+        data = struct.pack(f"<{data_format}", *values)
+        if self._reply is not None:
+            self._reply += data
+        else:
+            self.output += data
+
+    def _recv_uint16(self) -> Generator[None, int, int]:
+        low = yield
+        high = yield
+        return low | (high << 8)
+
+    def _recv_uint32(self) -> Generator[None, int, int]:
+        low = yield from self._recv_uint16()
+        high = yield from self._recv_uint16()
+        return low | (high << 16)
+
+    def _valid_pin(self, pin_no: int) -> bool:
+        return pin_no < len(self.pins)
+
+    def _poll(self) -> None:
+        self._send("B", 1)
+
+    def _parrot(self) -> CommandHandler:
+        value = yield
+        self._send("B", value)
+        self.baud_revert_us = None
+
+    def _version(self) -> None:
+        self._send("3B", *self.version)
+
+    def _baudrates(self) -> None:
+        self._send("B", self.supported_baudrates)
+
+    def _set_baud(self) -> CommandHandler:
+        index = yield
+        if index >= len(BAUD_RATES) or not self.supported_baudrates & (1 << index):
+            self._send("B", 0xFF)
+            return
+        self._send("B", index)
+        self._previous_baudrate = self.baudrate
+        self.baudrate = BAUD_RATES[index]
+        self.baud_revert_us = self.micros + self.baud_revert_delay_us
+
+    def _pin_mode(self) -> CommandHandler:
+        pin_no = yield
+        mode = yield
+        if self._valid_pin(pin_no) and mode in (
+            INPUT.value,
+            OUTPUT.value,
+            INPUT_PULLUP.value,
+        ):
+            self.pins[pin_no].mode = mode
+
+    def _digital_read(self) -> CommandHandler:
+        pin_no = yield
+        self._send("B", self.digital_read(pin_no) if self._valid_pin(pin_no) else 0)
+
+    def _digital_write(self) -> CommandHandler:
+        pin_no = yield
+        state = yield
+        if self._valid_pin(pin_no) and state in (0, 1):
+            self.pins[pin_no].output_state = state
+            self.pins[pin_no].pwm_value = 255 * state
+
+    def _digital_write_many(self) -> CommandHandler:
+        n_bytes = yield
+        masks = []
+        for _ in range(n_bytes):
+            masks.append((yield))
+        for i, mask in enumerate(masks):
+            states = yield
+            for bit in range(8):
+                pin_no = i * 8 + bit
+                if mask & (1 << bit) and self._valid_pin(pin_no):
+                    state = (states >> bit) & 1
+                    self.pins[pin_no].output_state = state
+                    self.pins[pin_no].pwm_value = 255 * state
+
+    def _digital_read_all(self) -> CommandHandler:
+        n_bytes = yield
+        for i in range(n_bytes):
+            states = 0
+            for bit in range(8):
+                pin_no = i * 8 + bit
+                if self._valid_pin(pin_no) and self.digital_read(pin_no):
+                    states |= 1 << bit
+            self._send("B", states)
+
+    def _analog_read(self) -> CommandHandler:
+        pin_no = yield
+        self._send("H", self.analog_read(pin_no))
+
+    def _analog_write(self) -> CommandHandler:
+        pin_no = yield
+        value = yield
+        if self._valid_pin(pin_no):
+            self.pins[pin_no].mode = OUTPUT.value
+            self.pins[pin_no].pwm_value = value
+            self.pins[pin_no].output_state = 1 if value >= 128 else 0
+
+    def _analog_read_many(self) -> CommandHandler:
+        n_pins = yield
+        for _ in range(n_pins):
+            pin_no = yield
+            self._send("H", self.analog_read(pin_no))
+
+    def _analog_read_oversampled(self) -> CommandHandler:
+        pin_no = (yield from self._recv_uint32()) & 0xFF
+        n_samples = min(max((yield from self._recv_uint32()), 1), MAX_OVERSAMPLE)
+        mode = (yield from self._recv_uint32()) & 0xFF
+        # The smallest number of bits such that 4 ** extra_bits >= n_samples
+        extra_bits = ((n_samples - 1).bit_length() + 1) // 2
+        samples = sorted(self.analog_read(pin_no) for _ in range(n_samples))
+        if mode == OVERSAMPLE_MEDIAN:
+            middle = samples[(n_samples - 1) // 2] + samples[n_samples // 2]
+            self._send("H", (middle << extra_bits) >> 1)
+        else:
+            self._send("H", sum(samples) >> extra_bits)
+
+    def _stream_start(self) -> CommandHandler:
+        rate_hz = yield from self._recv_uint16()
+        n_pins = yield from self._recv_uint16()
+        pins = []
+        for _ in range(n_pins):
+            pins.append((yield from self._recv_uint16()))
+        self.stream_pins = pins[:16]
+        self.stream_period_us = 1000000 // max(rate_hz, 1)
+        self.next_sample_us = self.micros
+
+    def _stream_stop(self) -> None:
+        self.next_sample_us = None
+        self._send_stream_frame(STREAM_END)
+
+    def _send_stream_frame(self, header: int) -> None:
+        values = [
+            self.analog_read(pin_no) if header == STREAM_FRAME else 0
+            for pin_no in self.stream_pins
+        ]
+        # Stream frames are never wrapped in a reply frame
+        self.output += struct.pack(
+            f"<BI{len(values)}H", header, self.micros & 0xFFFFFFFF, *values
+        )
+
+    def _schedule(self) -> CommandHandler:
+        pin_no = (yield from self._recv_uint32()) & 0xFF
+        state = yield from self._recv_uint32()
+        delay_us = yield from self._recv_uint32()
+        high_us = yield from self._recv_uint32()
+        low_us = yield from self._recv_uint32()
+        n_edges = yield from self._recv_uint32()
+        if None in self.scheduled:
+            slot = self.scheduled.index(None)
+            self.scheduled[slot] = ScheduledAction(
+                pin_no,
+                1 if state else 0,
+                self.micros + delay_us,
+                high_us,
+                low_us,
+                n_edges,
+            )
+            self._send("B", slot)
+        else:
+            self._send("B", SCHEDULE_FULL)
+
+    def _cancel_schedule(self) -> CommandHandler:
+        slot = yield
+        for i in range(MAX_SCHEDULED):
+            if slot in (SCHEDULE_ALL, i):
+                self.scheduled[i] = None
+
+    def _pulse_in(self) -> CommandHandler:
+        pin_no = (yield from self._recv_uint32()) & 0xFF
+        state = 1 if (yield from self._recv_uint32()) else 0
+        timeout_us = yield from self._recv_uint32()
+        deadline_us = self.micros + timeout_us
+        if not self._valid_pin(pin_no) or not (
+            self._wait_while_level(pin_no, state, deadline_us)
+            and self._wait_while_level(pin_no, 1 - state, deadline_us)
+        ):
+            self._send("I", 0)
+            return
+        start_us = self.micros
+        if not self._wait_while_level(pin_no, state, deadline_us):
+            self._send("I", 0)
+            return
+        self._send("I", self.micros - start_us)
+
+    def _macro_write(self) -> CommandHandler:
+        slot = yield
+        offset = yield
+        n_bytes = yield
+        data = bytearray()
+        for _ in range(n_bytes):
+            data.append((yield))
+        if slot < MAX_MACROS:
+            macro = self.macros[slot]
+            macro[offset:] = data
+            del macro[MAX_MACRO_SIZE:]
+
+    def _macro_run(self) -> CommandHandler:
+        slot = yield
+        n_repeats = yield
+        if slot < MAX_MACROS:
+            for _ in range(n_repeats):
+                if not self._run_commands(bytes(self.macros[slot])):
+                    break
+
+    def _watch_digital(self) -> CommandHandler:
+        pin_no = (yield from self._recv_uint32()) & 0xFF
+        debounce_us = yield from self._recv_uint32()
+        use_interrupt = yield from self._recv_uint32()
+        self.watched = [watched for watched in self.watched if watched.pin_no != pin_no]
+        if len(self.watched) == MAX_WATCHED or not self._valid_pin(pin_no):
+            self._send("2B", WATCH_FULL, 0)
+            return
+        state = self.digital_read(pin_no)
+        self.watched.append(WatchedPin(pin_no, debounce_us, state, state, self.micros))
+        mode = (
+            WATCH_INTERRUPT
+            if use_interrupt and pin_no in self.interrupt_pins
+            else WATCH_POLLING
+        )
+        self._send("2B", mode, state)
+
+    def _unwatch(self) -> CommandHandler:
+        pin_no = yield
+        self.watched = [
+            watched
+            for watched in self.watched
+            if pin_no != UNWATCH_ALL and watched.pin_no != pin_no
+        ]
+        self.analog_watched = [
+            watch
+            for watch in self.analog_watched
+            if pin_no != UNWATCH_ALL and watch.pin_no != pin_no
+        ]
+
+    def _watch_analog(self) -> CommandHandler:
+        pin_no = (yield from self._recv_uint32()) & 0xFF
+        threshold = (yield from self._recv_uint32()) & 0xFFFF
+        hysteresis = (yield from self._recv_uint32()) & 0xFFFF
+        min_delta = (yield from self._recv_uint32()) & 0xFFFF
+        interval_us = max((yield from self._recv_uint32()), 1)
+        self.analog_watched = [
+            watch for watch in self.analog_watched if watch.pin_no != pin_no
+        ]
+        if len(self.analog_watched) == MAX_ANALOG_WATCHED:
+            self._send("2H", WATCH_FULL, 0)
+            return
+        value = self.analog_read(pin_no)
+        self.analog_watched.append(
+            AnalogWatch(
+                pin_no,
+                threshold,
+                hysteresis,
+                min_delta,
+                interval_us,
+                self.micros + interval_us,
+                value,
+                threshold != NO_THRESHOLD and value >= threshold,
+            )
+        )
+        self._send("2H", WATCH_POLLING, value)
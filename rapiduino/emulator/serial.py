@@ -0,0 +1,117 @@
+import os
+import select
+import threading
+import time
+from typing import Dict, Optional
+
+from rapiduino.communication.serial import SerialConnection
+from rapiduino.emulator.board import EmulatedBoard
+
+emulated_boards: Dict[str, EmulatedBoard] = {}
+
+
+class EmulatedSerial:
+    """An in-process stand-in for serial.Serial, connected to an EmulatedBoard.
+
+    Reads never block: like a real port whose timeout has expired, read returns
+    whatever the board has sent so far. While the board has background work, such as
+    streaming, its clock is advanced until there is enough data to satisfy a read.
+
+    Nothing gets through while the baud rate differs from the board's, or is above
+    max_baudrate, which models the fastest baud rate the link can carry.
+    """
+
+    max_baudrate: Optional[int] = None
+
+    def __init__(
+        self,
+        board: EmulatedBoard,
+        port: str = "",
+        baudrate: int = 115200,
+        timeout: Optional[float] = 1,
+    ) -> None:
+        self.board = board
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.board.output)
+
+    @property
+    def _baudrate_too_high(self) -> bool:
+        return self.max_baudrate is not None and self.baudrate > self.max_baudrate
+
+    def write(self, data: bytes) -> int:
+        if self.baudrate == self.board.baudrate and not self._baudrate_too_high:
+            self.board.receive(data)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        if self._baudrate_too_high:
+            # The read times out, and the board's clock moves on meanwhile
+            self.board.service(self.board.micros + int((self.timeout or 0) * 1e6))
+            return b""
+        while len(self.board.output) < size and self.board.has_background_work:
+            self.board.service()
+        return self.board.take_output(size)
+
+    def reset_input_buffer(self) -> None:
+        self.board.take_output()
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+class EmulatedSerialConnection(SerialConnection):
+    """A SerialConnection to an emulated board, for use as an Arduino conn_class.
+
+    The board used for a port can be chosen by adding it to emulated_boards, keyed by
+    the port name; otherwise a new Uno is emulated."""
+
+    @classmethod
+    def build(
+        cls,
+        port: str,
+        baudrate: int = 115200,
+        timeout: int = 1,
+        reset_on_open: bool = True,
+    ) -> "SerialConnection":
+        board = emulated_boards.get(port) or EmulatedBoard()
+        return cls(EmulatedSerial(board, port, baudrate, timeout))  # type: ignore
+
+
+class PtyServer:
+    """Serve an EmulatedBoard on a pseudo-terminal, so that anything able to open a
+    serial port, including SerialConnection.build, can talk to it. The board's clock
+    follows the wall clock. POSIX only."""
+
+    def __init__(self, board: EmulatedBoard) -> None:
+        import tty
+
+        self.board = board
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.001)
+            if readable:
+                self.board.receive(os.read(self._master, 4096))
+            now_us = int((time.perf_counter() - self._start) * 1e6)
+            self.board.service(now_us)
+            if self.board.output:
+                os.write(self._master, self.board.take_output())
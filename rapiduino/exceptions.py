@@ -21,6 +21,34 @@ class SerialConnectionReceiveDataError(Exception):
         super().__init__(message)
 
 
+class SerialConnectionNotReadyError(Exception):
+    def __init__(self, timeout: float) -> None:
+        message = f"The Arduino did not reply to a poll within {timeout} seconds"
+        super().__init__(message)
+
+
+class SerialConnectionAckError(Exception):
+    def __init__(self, expected_seq: int, actual_seq: Optional[int]) -> None:
+        received = "nothing" if actual_seq is None else f"{actual_seq}"
+        message = (
+            f"Expected acknowledgement {expected_seq} but received {received}."
+            " Some deferred commands may have been lost or rejected"
+        )
+        super().__init__(message)
+
+
+class SerialConnectionFrameError(Exception):
+    def __init__(self, seq: int, status: Optional[int]) -> None:
+        if status is None:
+            reason = "no valid reply was received"
+        else:
+            reason = f"the Arduino rejected it with status {status}"
+        message = f"Frame {seq} failed: {reason}"
+        super().__init__(message)
+        self.seq = seq
+        self.status = status
+
+
 class NotAnalogPinError(Exception):
     def __init__(self, pin_no: int) -> None:
         message = f"cannot complete operation as is_analog=False for pin {pin_no}"
@@ -102,3 +130,30 @@ class ArduinoSketchVersionIncompatibleError(Exception):
             f" Greater or equal to {min_version_str}, less than {max_version_str}"
         )
         super().__init__(message)
+
+
+class ReplayMismatchError(Exception):
+    def __init__(self, expected: bytes, actual: bytes) -> None:
+        message = (
+            f"Replay diverged from the capture: expected {expected!r} to be written,"
+            f" but got {actual!r}"
+        )
+        super().__init__(message)
+
+
+class ArduinoScheduleFullError(Exception):
+    def __init__(self, max_scheduled: int) -> None:
+        message = (
+            f"The Arduino is already running {max_scheduled} scheduled actions."
+            " Cancel one before scheduling another"
+        )
+        super().__init__(message)
+
+
+class ArduinoWatchListFullError(Exception):
+    def __init__(self, max_watched: int) -> None:
+        message = (
+            f"The Arduino is already watching {max_watched} pins."
+            " Stop watching one before watching another"
+        )
+        super().__init__(message)
@@ -0,0 +1,87 @@
+import struct
+from typing import Any, Sequence
+
+import pytest
+
+from rapiduino.boards.acquisition import SampleBuffer
+from rapiduino.communication.command_spec import STREAM_FRAME
+
+
+def pack_frames(timestamps: Sequence[int], values: Sequence[int]) -> bytes:
+    return b"".join(
+        struct.pack("<BIHH", STREAM_FRAME, timestamp, value, value + 1)
+        for timestamp, value in zip(timestamps, values)
+    )
+
+
+@pytest.fixture(params=[False, True], ids=["array", "numpy"])
+def use_numpy(request: Any) -> bool:
+    if request.param:
+        pytest.importorskip("numpy")
+    return bool(request.param)
+
+
+def test_frames_are_decoded_into_the_ring(use_numpy: bool) -> None:
+    buffer = SampleBuffer(2, 4, use_numpy=use_numpy)
+
+    assert buffer.extend_frames(pack_frames([10, 20, 30], [1, 2, 3])) == 3
+    assert len(buffer) == 3
+    timestamps_us, values = buffer.to_arrays()
+    assert list(timestamps_us) == [10, 20, 30]
+    if use_numpy:
+        assert values.tolist() == [[1, 2], [2, 3], [3, 4]]
+    else:
+        assert list(values) == [1, 2, 2, 3, 3, 4]
+
+
+def test_oldest_frames_are_overwritten_once_full(use_numpy: bool) -> None:
+    buffer = SampleBuffer(2, 4, use_numpy=use_numpy)
+    buffer.extend_frames(pack_frames([10, 20, 30], [1, 2, 3]))
+    buffer.extend_frames(pack_frames([40, 50, 60], [4, 5, 6]))
+
+    assert len(buffer) == 4
+    assert buffer.n_frames_dropped == 2
+    assert [list(timestamps) for timestamps, _ in buffer.views()] == [
+        [30, 40],
+        [50, 60],
+    ]
+    assert list(buffer.to_arrays()[0]) == [30, 40, 50, 60]
+
+    buffer.extend_frames(pack_frames(range(70, 170, 10), range(10)))
+    assert list(buffer.to_arrays()[0]) == [130, 140, 150, 160]
+
+
+def test_views_share_memory_with_the_buffer(use_numpy: bool) -> None:
+    buffer = SampleBuffer(2, 4, use_numpy=use_numpy)
+    buffer.extend_frames(pack_frames([10, 20], [1, 2]))
+
+    ((timestamps_us, _),) = buffer.views()
+    buffer.timestamps_us[0] = 99
+    assert timestamps_us[0] == 99
+
+
+def test_clock_wraps_are_taken_out_of_timestamps(use_numpy: bool) -> None:
+    buffer = SampleBuffer(2, 4, use_numpy=use_numpy)
+    buffer.extend_frames(pack_frames([0xFFFFFF00], [1]))
+    buffer.extend_frames(pack_frames([0x10, 0x20], [2, 3]))
+
+    assert list(buffer.to_arrays()[0]) == [0xFFFFFF00, 0x100000010, 0x100000020]
+
+
+def test_a_clock_wrap_within_a_batch_is_taken_out(use_numpy: bool) -> None:
+    buffer = SampleBuffer(2, 4, use_numpy=use_numpy)
+    buffer.extend_frames(pack_frames([0xFFFFFF00], [1]))
+    timestamps = [0xFFFFFF10, 0xFFFFFF20, 0xFFFFFF30, 0x10, 0x20]
+    buffer.extend_frames(pack_frames(timestamps, [2, 3, 4, 5, 6]))
+
+    timestamps_us, values = buffer.to_arrays()
+    assert list(timestamps_us) == [0xFFFFFF20, 0xFFFFFF30, 0x100000010, 0x100000020]
+    if use_numpy:
+        assert values.tolist() == [[3, 4], [4, 5], [5, 6], [6, 7]]
+    else:
+        assert list(values) == [3, 4, 4, 5, 5, 6, 6, 7]
+
+
+def test_partial_frames_are_rejected() -> None:
+    with pytest.raises(ValueError):
+        SampleBuffer(2, 4).extend_frames(pack_frames([10], [1])[:-1])
@@ -1,5 +1,5 @@
 from typing import Any, Tuple
-from unittest.mock import Mock
+from unittest.mock import Mock, call
 
 import pytest
 
@@ -8,6 +8,7 @@ import rapiduino.globals.arduino_nano as nano_analog_alias
 import rapiduino.globals.arduino_uno as uno_analog_alias
 from rapiduino.boards.arduino import Arduino
 from rapiduino.boards.pins import Pin, get_mega_pins, get_nano_pins, get_uno_pins
+from rapiduino.boards.stream import StreamFrame
 from rapiduino.communication.command_spec import (
     CMD_ANALOGREAD,
     CMD_ANALOGWRITE,
@@ -16,8 +17,13 @@ from rapiduino.communication.command_spec import (
     CMD_PARROT,
     CMD_PINMODE,
     CMD_POLL,
+    CMD_STREAMSTOP,
     CMD_VERSION,
     CommandSpec,
+    cmd_analogreadmany,
+    cmd_digitalreadall,
+    cmd_digitalwritemany,
+    cmd_streamstart,
 )
 from rapiduino.communication.serial import SerialConnection
 from rapiduino.exceptions import (
@@ -29,6 +35,8 @@ from rapiduino.exceptions import (
     PinDoesNotExistError,
     PinIsReservedForSerialCommsError,
     ProtectedPinError,
+    SerialConnectionAckError,
+    SerialConnectionReceiveDataError,
 )
 from rapiduino.globals.common import HIGH, INPUT, LOW, OUTPUT
 
@@ -52,6 +60,16 @@ def get_mock_conn_class() -> Mock:
             data = (100,)
         elif command == CMD_ANALOGWRITE:
             data = ()
+        elif command == CMD_STREAMSTOP:
+            data = ()
+        elif command == cmd_digitalwritemany(args[0]):
+            data = ()
+        elif command == cmd_digitalreadall(args[0]):
+            data = (0b00001010,) + (0,) * (args[0] - 1)
+        elif command == cmd_analogreadmany(args[0]):
+            data = tuple(100 + pin_no for pin_no in args[1:])
+        elif command == cmd_streamstart(args[1]):
+            data = ()
         else:
             raise ValueError(f"Mock Arduino does not know how to process {CommandSpec}")
         return data
@@ -447,3 +465,381 @@ def test_component_can_be_re_registered_after_being_deregistered(
     test_arduino.register_component("component_id_1", pins=(Pin(0), Pin(1)))
     test_arduino.deregister_component("component_id_1")
     test_arduino.register_component("component_id_1", pins=(Pin(2), Pin(3)))
+
+
+def test_batch_sends_queued_writes_in_one_call(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    with test_arduino.batch():
+        test_arduino.pin_mode(0, OUTPUT)
+        test_arduino.digital_write(0, HIGH)
+        test_arduino.analog_write(2, 100)
+        connection.process_commands.assert_not_called()
+
+    connection.process_commands.assert_called_once_with(
+        [
+            (CMD_PINMODE, (0, OUTPUT.value)),
+            (CMD_DIGITALWRITE, (0, HIGH.value)),
+            (CMD_ANALOGWRITE, (2, 100)),
+        ]
+    )
+
+
+def test_batch_flushes_queued_writes_before_a_read(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    manager = Mock()
+    manager.attach_mock(connection.process_commands, "process_commands")
+    manager.attach_mock(connection.process_command, "process_command")
+
+    with test_arduino.batch():
+        test_arduino.digital_write(0, HIGH)
+        assert test_arduino.digital_read(1) == HIGH
+        test_arduino.digital_write(0, LOW)
+
+    assert manager.mock_calls == [
+        call.process_commands([(CMD_DIGITALWRITE, (0, HIGH.value))]),
+        call.process_command(CMD_DIGITALREAD, 1),
+        call.process_commands([(CMD_DIGITALWRITE, (0, LOW.value))]),
+    ]
+
+
+def test_batch_can_be_nested(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    with test_arduino.batch():
+        test_arduino.digital_write(0, HIGH)
+        with test_arduino.batch():
+            test_arduino.digital_write(3, HIGH)
+        connection.process_commands.assert_not_called()
+
+    connection.process_commands.assert_called_once_with(
+        [(CMD_DIGITALWRITE, (0, HIGH.value)), (CMD_DIGITALWRITE, (3, HIGH.value))]
+    )
+
+
+def test_batch_discards_queued_writes_on_error(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    with pytest.raises(PinDoesNotExistError):
+        with test_arduino.batch():
+            test_arduino.digital_write(0, HIGH)
+            test_arduino.digital_write(6, HIGH)
+
+    connection.process_commands.assert_not_called()
+    test_arduino.digital_write(0, LOW)
+    connection.process_command.assert_called_with(CMD_DIGITALWRITE, 0, LOW.value)
+
+
+def test_batch_ends_when_sending_it_fails(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    connection.process_commands.side_effect = SerialConnectionReceiveDataError(3, 0)
+    test_arduino.enable_cache()
+    with pytest.raises(SerialConnectionReceiveDataError):
+        with test_arduino.batch():
+            test_arduino.digital_write(0, HIGH)
+
+    test_arduino.digital_write(0, HIGH)
+    connection.process_command.assert_called_with(CMD_DIGITALWRITE, 0, HIGH.value)
+
+
+def test_digital_write_many_packs_pins_into_a_bitmask(test_arduino: Arduino) -> None:
+    test_arduino.digital_write_many({0: HIGH, 2: LOW, 3: HIGH})
+    test_arduino.connection.process_command.assert_called_with(  # type: ignore
+        cmd_digitalwritemany(1), 1, 0b00001101, 0b00001001
+    )
+
+
+def test_digital_write_many_packs_pins_over_several_bytes() -> None:
+    arduino = Arduino.mega(port="", conn_class=get_mock_conn_class())
+    arduino.digital_write_many({2: HIGH, 9: HIGH, 69: LOW})
+    arduino.connection.process_command.assert_called_with(  # type: ignore
+        cmd_digitalwritemany(9),
+        9,
+        *(0b00000100, 0b00000010, 0, 0, 0, 0, 0, 0, 0b00100000),
+        *(0b00000100, 0b00000010, 0, 0, 0, 0, 0, 0, 0),
+    )
+
+
+def test_digital_write_many_with_reserved_pin(test_arduino: Arduino) -> None:
+    with pytest.raises(PinIsReservedForSerialCommsError):
+        test_arduino.digital_write_many({0: HIGH, 4: HIGH})
+
+
+def test_digital_write_many_with_pin_no_out_of_range(test_arduino: Arduino) -> None:
+    with pytest.raises(PinDoesNotExistError):
+        test_arduino.digital_write_many({6: HIGH})
+
+
+def test_digital_write_many_with_protected_pin(test_arduino: Arduino) -> None:
+    test_arduino.register_component("component_id_1", pins=(Pin(0),))
+    with pytest.raises(ProtectedPinError):
+        test_arduino.digital_write_many({0: HIGH})
+    test_arduino.digital_write_many({0: HIGH}, token="component_id_1")
+
+
+def test_digital_read_all_unpacks_bitfield(test_arduino: Arduino) -> None:
+    states = test_arduino.digital_read_all()
+    assert states == {0: LOW, 1: HIGH, 2: LOW, 3: HIGH}
+
+
+def test_digital_read_all_omits_protected_pins(test_arduino: Arduino) -> None:
+    test_arduino.register_component("component_id_1", pins=(Pin(1),))
+    assert test_arduino.digital_read_all() == {0: LOW, 2: LOW, 3: HIGH}
+    assert test_arduino.digital_read_all(token="component_id_1") == {
+        0: LOW,
+        1: HIGH,
+        2: LOW,
+        3: HIGH,
+    }
+
+
+def test_analog_read_many_with_valid_args() -> None:
+    arduino = Arduino.uno(port="", conn_class=get_mock_conn_class())
+    assert arduino.analog_read_many([14, 16, 15]) == (114, 116, 115)
+
+
+def test_analog_read_many_with_non_analog_pin(test_arduino: Arduino) -> None:
+    with pytest.raises(NotAnalogPinError):
+        test_arduino.analog_read_many([1, 0])
+
+
+def test_analog_read_many_with_reserved_pin(test_arduino: Arduino) -> None:
+    with pytest.raises(PinIsReservedForSerialCommsError):
+        test_arduino.analog_read_many([1, 4])
+
+
+def test_stream_yields_frames_until_closed(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    connection.recv_stream_frame.side_effect = [(10, 500), (20, 501), (30, 502), None]
+
+    stream = test_arduino.stream([1], 1000)
+    assert next(stream) == StreamFrame(10, (500,))
+    assert next(stream) == StreamFrame(20, (501,))
+    stream.close()
+
+    connection.process_command.assert_called_with(cmd_streamstart(1), 1000, 1, 1)
+    connection.send_unframed.assert_called_once_with(CMD_STREAMSTOP)
+    assert connection.recv_stream_frame.call_count == 4
+
+
+def test_stream_unwraps_timestamp_overflow(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    connection.recv_stream_frame.side_effect = [
+        (2**32 - 10, 1),
+        (5, 2),
+        (2**32 - 1, 3),
+        (0, 4),
+        None,
+    ]
+
+    timestamps = []
+    for frame in test_arduino.stream([1], 1000):
+        timestamps.append(frame.timestamp_us)
+        if len(timestamps) == 4:
+            break
+
+    assert timestamps == [2**32 - 10, 2**32 + 5, 2**33 - 1, 2**33]
+
+
+def test_stream_with_non_analog_pin(test_arduino: Arduino) -> None:
+    with pytest.raises(NotAnalogPinError):
+        test_arduino.stream([0], 1000)
+
+
+def test_stream_with_invalid_rate(test_arduino: Arduino) -> None:
+    with pytest.raises(ValueError):
+        test_arduino.stream([1], 0)
+    with pytest.raises(ValueError):
+        test_arduino.stream([1], 65536)
+
+
+def test_stream_with_invalid_number_of_pins(test_arduino: Arduino) -> None:
+    with pytest.raises(ValueError):
+        test_arduino.stream([], 1000)
+
+
+def test_negative_pin_numbers_do_not_exist(test_arduino: Arduino) -> None:
+    with pytest.raises(PinDoesNotExistError):
+        test_arduino.digital_write(-1, HIGH)
+    with pytest.raises(PinDoesNotExistError):
+        test_arduino.analog_read(-5)
+
+
+def test_trusted_components_skip_pin_capability_checks(
+    test_arduino: Arduino,
+) -> None:
+    test_arduino.register_component("component_id_1", pins=(Pin(0),))
+    with pytest.raises(NotPwmPinError):
+        test_arduino.analog_write(0, 100, token="component_id_1")
+
+    test_arduino.trust_components = True
+    test_arduino.analog_write(0, 100, token="component_id_1")
+    with pytest.raises(ValueError):
+        test_arduino.analog_write(0, 256, token="component_id_1")
+    with pytest.raises(ProtectedPinError):
+        test_arduino.digital_write(0, HIGH, token="component_id_2")
+
+
+def test_deregistered_pins_are_unprotected(test_arduino: Arduino) -> None:
+    test_arduino.register_component("component_id_1", pins=(Pin(0),))
+    test_arduino.deregister_component("component_id_1")
+    test_arduino.digital_write(0, HIGH)
+
+
+def test_cache_skips_writes_that_do_not_change_anything(
+    test_arduino: Arduino,
+) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    connection.process_command.reset_mock()
+
+    test_arduino.pin_mode(0, OUTPUT)
+    test_arduino.pin_mode(0, OUTPUT)
+    test_arduino.digital_write(0, HIGH)
+    test_arduino.digital_write(0, HIGH)
+    test_arduino.analog_write(2, 100)
+    test_arduino.analog_write(2, 100)
+    test_arduino.digital_write_many({0: HIGH, 3: LOW})
+
+    assert connection.process_command.mock_calls == [
+        call(CMD_PINMODE, 0, OUTPUT.value),
+        call(CMD_DIGITALWRITE, 0, HIGH.value),
+        call(CMD_ANALOGWRITE, 2, 100),
+        call(cmd_digitalwritemany(1), 1, 0b00001000, 0),
+    ]
+
+
+def test_cache_answers_digital_reads_of_output_pins(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.pin_mode(0, OUTPUT)
+    test_arduino.digital_write(0, HIGH)
+    test_arduino.pin_mode(1, INPUT)
+    connection.process_command.reset_mock()
+
+    assert test_arduino.digital_read(0) == HIGH
+    assert test_arduino.digital_read(1) == HIGH
+    assert test_arduino.digital_read(1) == HIGH
+    assert connection.process_command.mock_calls == [
+        call(CMD_DIGITALREAD, 1),
+        call(CMD_DIGITALREAD, 1),
+    ]
+
+
+def test_cache_forgets_state_when_pin_mode_changes(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.pin_mode(0, OUTPUT)
+    test_arduino.digital_write(0, HIGH)
+    test_arduino.pin_mode(0, INPUT)
+    test_arduino.pin_mode(0, OUTPUT)
+    connection.process_command.reset_mock()
+
+    test_arduino.digital_write(0, HIGH)
+    connection.process_command.assert_called_once_with(CMD_DIGITALWRITE, 0, HIGH.value)
+
+
+def test_cache_can_be_invalidated(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.digital_write(0, HIGH)
+    test_arduino.invalidate_cache(0)
+    connection.process_command.reset_mock()
+
+    test_arduino.digital_write(0, HIGH)
+    connection.process_command.assert_called_once_with(CMD_DIGITALWRITE, 0, HIGH.value)
+
+
+def test_cache_is_invalidated_when_a_batch_fails(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    with pytest.raises(PinDoesNotExistError):
+        with test_arduino.batch():
+            test_arduino.digital_write(0, HIGH)
+            test_arduino.digital_write(6, HIGH)
+
+    test_arduino.digital_write(0, HIGH)
+    connection.process_command.assert_called_with(CMD_DIGITALWRITE, 0, HIGH.value)
+
+
+def test_cache_is_not_updated_by_a_write_that_fails(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.digital_write(0, LOW)
+    connection.process_command.side_effect = SerialConnectionReceiveDataError(3, 0)
+    with pytest.raises(SerialConnectionReceiveDataError):
+        test_arduino.digital_write(0, HIGH)
+    connection.process_command.side_effect = None
+    connection.process_command.reset_mock()
+
+    test_arduino.digital_write(0, LOW)
+    connection.process_command.assert_called_once_with(CMD_DIGITALWRITE, 0, LOW.value)
+
+
+def test_cache_is_invalidated_by_a_lost_deferred_write(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.digital_write(0, HIGH)
+    connection.flush.side_effect = SerialConnectionAckError(0, None)
+    with pytest.raises(SerialConnectionAckError):
+        test_arduino.flush()
+    connection.process_command.reset_mock()
+
+    test_arduino.digital_write(0, HIGH)
+    connection.process_command.assert_called_once_with(CMD_DIGITALWRITE, 0, HIGH.value)
+
+
+def test_cache_can_be_resynced_from_the_board(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    test_arduino.enable_cache()
+    test_arduino.pin_mode(1, OUTPUT)
+    test_arduino.digital_write(1, LOW)
+    test_arduino.resync_cache()
+    connection.process_command.reset_mock()
+
+    assert test_arduino.digital_read(1) == HIGH
+    connection.process_command.assert_not_called()
+
+
+def test_flush_sends_batched_and_buffered_writes(test_arduino: Arduino) -> None:
+    connection: Any = test_arduino.connection
+    with test_arduino.batch():
+        test_arduino.digital_write(0, HIGH)
+        test_arduino.flush()
+        connection.process_commands.assert_called_once_with(
+            [(CMD_DIGITALWRITE, (0, HIGH.value))]
+        )
+        connection.flush.assert_called_once_with()
+
+
+def test_negotiate_baudrate_with_old_sketch_keeps_baudrate(
+    test_arduino: Arduino,
+) -> None:
+    connection: Any = test_arduino.connection
+    connection.baudrate = 115200
+    assert test_arduino.negotiate_baudrate() == 115200
+    connection.set_baudrate.assert_not_called()
+
+
+def test_arduino_waits_until_ready_before_checking_version() -> None:
+    conn_class = get_mock_conn_class()
+    connection = conn_class.build.return_value
+    manager = Mock()
+    manager.attach_mock(connection.wait_until_ready, "wait_until_ready")
+    manager.attach_mock(connection.process_command, "process_command")
+
+    Arduino(pins=(), port="", conn_class=conn_class, ready_timeout=2)
+
+    conn_class.build.assert_called_once_with("", reset_on_open=True)
+    assert manager.mock_calls == [
+        call.wait_until_ready(2),
+        call.process_command(CMD_VERSION),
+    ]
+
+
+def test_arduino_can_cache_sketch_version(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(Arduino, "version_cache", {})
+    Arduino(pins=(), port="port", conn_class=get_mock_conn_class(), cache_version=True)
+    conn_class = get_mock_conn_class()
+
+    Arduino(pins=(), port="port", conn_class=conn_class, cache_version=True)
+
+    conn_class.build.return_value.process_command.assert_not_called()
+    assert Arduino.version_cache == {"port": Arduino.min_version}
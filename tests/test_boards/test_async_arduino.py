@@ -0,0 +1,165 @@
+import asyncio
+from typing import Any, Awaitable, Tuple, TypeVar
+
+import pytest
+
+from rapiduino.boards.async_arduino import AsyncArduino
+from rapiduino.boards.pins import Pin
+from rapiduino.communication.async_serial import AsyncSerialConnection
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_DIGITALREAD,
+    CMD_PARROT,
+    CMD_POLL,
+    CMD_VERSION,
+    CommandSpec,
+    cmd_analogreadmany,
+    cmd_digitalreadall,
+)
+from rapiduino.exceptions import (
+    ArduinoSketchVersionIncompatibleError,
+    NotAnalogPinError,
+    PinIsReservedForSerialCommsError,
+    ProtectedPinError,
+)
+from rapiduino.globals.common import HIGH, LOW, OUTPUT
+
+T = TypeVar("T")
+
+PINS = (
+    Pin(0),
+    Pin(1, is_analog=True),
+    Pin(2, is_pwm=True),
+    Pin(3),
+    Pin(4),
+    Pin(5),
+)
+
+
+class FakeConnection(AsyncSerialConnection):
+    sketch_version: Tuple[int, ...] = AsyncArduino.min_version
+
+    def __init__(self) -> None:
+        self.calls: list = []
+
+    @classmethod
+    async def build(
+        cls, port: str, baudrate: int = 115200, timeout: float = 1
+    ) -> "FakeConnection":
+        return cls()
+
+    async def process_command(
+        self, command: CommandSpec, *args: int
+    ) -> Tuple[int, ...]:
+        self.calls.append((command, args))
+        await asyncio.sleep(0)
+        if command == CMD_POLL:
+            return (1,)
+        if command == CMD_PARROT:
+            return (args[0],)
+        if command == CMD_VERSION:
+            return self.sketch_version
+        if command == CMD_DIGITALREAD:
+            return (args[0] % 2,)
+        if command == CMD_ANALOGREAD:
+            return (100,)
+        if command.rx_len == 0:
+            return ()
+        if command == cmd_digitalreadall(args[0]):
+            return (0b00001010,)
+        if command == cmd_analogreadmany(args[0]):
+            return tuple(100 + pin_no for pin_no in args[1:])
+        raise ValueError(f"Fake connection does not know how to process {command}")
+
+
+def run(coroutine: Awaitable[T]) -> T:
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def connect() -> AsyncArduino:
+    return await AsyncArduino.connect(
+        PINS, "", rx_pin=4, tx_pin=5, conn_class=FakeConnection
+    )
+
+
+def test_connect_checks_sketch_version() -> None:
+    class OldSketchConnection(FakeConnection):
+        sketch_version = (0, 0, 0)
+
+    with pytest.raises(ArduinoSketchVersionIncompatibleError):
+        run(AsyncArduino.uno("", conn_class=OldSketchConnection))
+
+
+def test_uno_sets_pins() -> None:
+    arduino = run(AsyncArduino.uno("", conn_class=FakeConnection))
+    assert len(arduino.pins) == 20
+
+
+def test_concurrent_reads() -> None:
+    async def test() -> Any:
+        arduino = await connect()
+        return await asyncio.gather(
+            arduino.poll(),
+            arduino.parrot(9),
+            arduino.digital_read(1),
+            arduino.digital_read(2),
+            arduino.analog_read(1),
+        )
+
+    assert run(test()) == [1, 9, HIGH, LOW, 100]
+
+
+def test_writes_are_validated_and_sent() -> None:
+    async def test() -> Any:
+        arduino = await connect()
+        await arduino.pin_mode(0, OUTPUT)
+        await arduino.digital_write(0, HIGH)
+        await arduino.analog_write(2, 100)
+        await arduino.digital_write_many({0: LOW, 3: HIGH})
+        return arduino.connection.calls[1:]  # type: ignore
+
+    calls = run(test())
+    assert [(command.cmd, args) for command, args in calls] == [
+        (10, (0, 1)),
+        (21, (0, 1)),
+        (31, (2, 100)),
+        (22, (1, 0b00001001, 0b00001000)),
+    ]
+
+
+def test_bulk_reads() -> None:
+    async def test() -> Any:
+        arduino = await connect()
+        return await arduino.digital_read_all(), await arduino.analog_read_many([1])
+
+    assert run(test()) == ({0: LOW, 1: HIGH, 2: LOW, 3: HIGH}, (101,))
+
+
+def test_analog_read_with_non_analog_pin() -> None:
+    with pytest.raises(NotAnalogPinError):
+        run(connect_and(lambda arduino: arduino.analog_read(0)))
+
+
+def test_digital_write_with_reserved_pin() -> None:
+    with pytest.raises(PinIsReservedForSerialCommsError):
+        run(connect_and(lambda arduino: arduino.digital_write(4, HIGH)))
+
+
+def test_protected_pin_needs_token() -> None:
+    async def test() -> Any:
+        arduino = await connect()
+        arduino.register_component("component_id_1", pins=(Pin(0),))
+        await arduino.digital_write(0, HIGH, token="component_id_1")
+        await arduino.digital_write(0, HIGH)
+
+    with pytest.raises(ProtectedPinError):
+        run(test())
+
+
+async def connect_and(action: Any) -> Any:
+    arduino = await connect()
+    return await action(arduino)
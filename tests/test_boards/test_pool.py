@@ -0,0 +1,126 @@
+import time
+from unittest.mock import Mock, call
+
+import pytest
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.boards.pool import BoardHealth, BoardPool
+from rapiduino.globals.common import HIGH, OUTPUT
+
+
+def get_mock_board(delay: float = 0, analog_value: int = 100) -> Mock:
+    def analog_read(pin_no: int) -> int:
+        time.sleep(delay)
+        return analog_value
+
+    board = Mock(spec=Arduino)
+    board.analog_read.side_effect = analog_read
+    board.poll.return_value = 1
+    return board
+
+
+def test_connect_opens_every_port() -> None:
+    factory = Mock(side_effect=lambda port: get_mock_board())
+    pool = BoardPool.connect(["port_a", "port_b"], factory=factory)
+    pool.close()
+
+    assert set(pool.boards) == {"port_a", "port_b"}
+    assert sorted(factory.call_args_list) == [call("port_a"), call("port_b")]
+
+
+def test_connect_closes_opened_boards_when_one_fails() -> None:
+    opened = get_mock_board()
+
+    def factory(port: str) -> Mock:
+        if port == "port_b":
+            raise OSError("no such port")
+        return opened
+
+    with pytest.raises(OSError):
+        BoardPool.connect(["port_a", "port_b"], factory=factory)
+    opened.close.assert_called_once_with()
+
+
+def test_close_closes_every_board() -> None:
+    boards = {"a": get_mock_board(), "b": get_mock_board()}
+    with BoardPool(boards):
+        pass
+
+    for board in boards.values():
+        board.close.assert_called_once_with()
+
+
+def test_close_closes_the_other_boards_when_one_fails() -> None:
+    boards = {"a": get_mock_board(), "b": get_mock_board()}
+    boards["a"].close.side_effect = OSError("port closed")
+    pool = BoardPool(boards)
+
+    with pytest.raises(OSError):
+        pool.close()
+    boards["b"].close.assert_called_once_with()
+
+
+def test_analog_read_returns_value_per_board() -> None:
+    pool = BoardPool({"a": get_mock_board(analog_value=1), "b": get_mock_board()})
+    assert pool.analog_read(14) == {"a": 1, "b": 100}
+    pool.close()
+
+
+def test_operations_run_concurrently() -> None:
+    pool = BoardPool({str(i): get_mock_board(delay=0.2) for i in range(5)})
+
+    start = time.perf_counter()
+    pool.analog_read(14)
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    assert elapsed < 0.6
+    assert all(latency >= 0.2 for latency in pool.latencies.values())
+
+
+def test_writes_are_sent_to_every_board() -> None:
+    boards = {"a": get_mock_board(), "b": get_mock_board()}
+    pool = BoardPool(boards)
+    pool.pin_mode(13, OUTPUT)
+    pool.digital_write(13, HIGH)
+    pool.close()
+
+    for board in boards.values():
+        board.pin_mode.assert_called_once_with(13, OUTPUT)
+        board.digital_write.assert_called_once_with(13, HIGH)
+
+
+def test_map_raises_first_error() -> None:
+    failing = get_mock_board()
+    failing.digital_read.side_effect = OSError("port closed")
+    pool = BoardPool({"a": get_mock_board(), "b": failing})
+
+    with pytest.raises(OSError):
+        pool.digital_read(2)
+    pool.close()
+
+
+def test_map_waits_for_every_board_before_raising() -> None:
+    failing = get_mock_board()
+    failing.analog_read.side_effect = OSError("port closed")
+    slow = get_mock_board(delay=0.2)
+    pool = BoardPool({"a": failing, "b": slow})
+
+    with pytest.raises(OSError):
+        pool.analog_read(14)
+    pool.close()
+
+    assert "b" in pool.latencies
+
+
+def test_health_reports_failing_boards() -> None:
+    failing = get_mock_board()
+    failing.poll.side_effect = OSError("port closed")
+    pool = BoardPool({"a": get_mock_board(), "b": failing})
+
+    health = pool.health()
+    pool.close()
+
+    assert health["a"].ok is True
+    assert health["a"].latency_s is not None
+    assert health["b"] == BoardHealth(ok=False, latency_s=None, error="port closed")
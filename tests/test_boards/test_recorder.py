@@ -0,0 +1,143 @@
+import csv
+from contextlib import closing
+from typing import Any
+
+import pytest
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.boards.recorder import Sample, SampleRecorder
+from rapiduino.emulator.serial import EmulatedSerialConnection
+
+
+@pytest.fixture
+def path(tmp_path: Any) -> str:
+    return str(tmp_path / "samples.rpdring")
+
+
+def test_oldest_samples_are_overwritten_once_full(path: str) -> None:
+    with SampleRecorder(path, capacity=4) as recorder:
+        for timestamp_us in range(10, 70, 10):
+            recorder.record(14, timestamp_us // 10, timestamp_us)
+
+        assert len(recorder) == 4
+        assert [sample.timestamp_us for sample in recorder.query()] == [30, 40, 50, 60]
+
+
+def test_query_finds_a_time_range(path: str) -> None:
+    with SampleRecorder(path, capacity=8) as recorder:
+        for timestamp_us in range(0, 100, 10):
+            recorder.record(14 + timestamp_us % 20 // 10, timestamp_us, timestamp_us)
+
+        assert recorder.query(35, 70) == [
+            Sample(40, 14, 40),
+            Sample(50, 15, 50),
+            Sample(60, 14, 60),
+        ]
+        assert recorder.query(35, 70, pin_no=15) == [Sample(50, 15, 50)]
+        assert recorder.query(100) == []
+
+
+def test_reopening_carries_on_the_recording(path: str) -> None:
+    with SampleRecorder(path, capacity=4) as recorder:
+        recorder.record(14, 1, 10)
+    with SampleRecorder(path) as recorder:
+        recorder.record(14, 2, 20)
+        assert recorder.capacity == 4
+        assert recorder.query() == [Sample(10, 14, 1), Sample(20, 14, 2)]
+
+
+def test_default_timestamps_stay_in_order_across_reopening(
+    path: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr("time.time", lambda: 1000.0)
+    with SampleRecorder(path, capacity=4) as recorder:
+        monkeypatch.setattr("time.time", lambda: 1000.02)
+        recorder.record(14, 1)
+    monkeypatch.setattr("time.time", lambda: 1000.03)
+    with SampleRecorder(path) as recorder:
+        recorder.record(14, 2)
+        assert recorder.query(start_us=20000) == [
+            Sample(20000, 14, 1),
+            Sample(30000, 14, 2),
+        ]
+
+
+def test_timestamps_older_than_the_newest_are_rejected(path: str) -> None:
+    with SampleRecorder(path, capacity=4) as recorder:
+        recorder.record(14, 1, 20)
+    with SampleRecorder(path) as recorder:
+        with pytest.raises(ValueError):
+            recorder.record(14, 2, 10)
+        recorder.record(14, 3, 20)
+        assert recorder.query() == [Sample(20, 14, 1), Sample(20, 14, 3)]
+
+
+def test_recordings_export_to_csv(path: str, tmp_path: Any) -> None:
+    csv_path = str(tmp_path / "samples.csv")
+    with SampleRecorder(path, capacity=2) as recorder:
+        for timestamp_us in (10, 20, 30):
+            recorder.record(14, timestamp_us, timestamp_us)
+        recorder.to_csv(csv_path)
+
+    with open(csv_path, newline="") as f:
+        assert list(csv.reader(f)) == [
+            ["timestamp_us", "pin_no", "value"],
+            ["20", "14", "20"],
+            ["30", "14", "30"],
+        ]
+
+
+def test_recordings_export_to_npy(path: str, tmp_path: Any) -> None:
+    npy_path = str(tmp_path / "samples.npy")
+    with SampleRecorder(path, capacity=2) as recorder:
+        for timestamp_us in (10, 20, 30):
+            recorder.record(14, timestamp_us, timestamp_us)
+        recorder.to_npy(npy_path, start_us=25)
+
+    with open(npy_path, "rb") as f:
+        data = f.read()
+    assert data[:8] == b"\x93NUMPY\x01\x00"
+    assert len(data) % 64 == 12
+
+    np = pytest.importorskip("numpy")
+    samples = np.load(npy_path)
+    assert samples.tolist() == [(30, 14, 30)]
+
+
+def test_stream_frames_are_recorded_as_they_pass(
+    path: str, monkeypatch: Any
+) -> None:
+    arduino = Arduino.uno("", conn_class=EmulatedSerialConnection)
+    monkeypatch.setattr("time.time", lambda: 1000.0)
+    with SampleRecorder(path, capacity=16) as recorder:
+        monkeypatch.setattr("time.time", lambda: 1000.5)
+        with closing(arduino.stream([14, 15], 500)) as stream:
+            frames = recorder.recording(stream, [14, 15])
+            next(frames)
+            next(frames)
+        assert recorder.query(start_us=501000) == [
+            Sample(502000, 14, 0),
+            Sample(502000, 15, 0),
+        ]
+
+
+def test_streams_from_a_restarted_board_stay_in_order(
+    path: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr("time.time", lambda: 1000.0)
+    with SampleRecorder(path, capacity=16) as recorder:
+        arduino = Arduino.uno("", conn_class=EmulatedSerialConnection)
+        with closing(arduino.stream([14], 500)) as stream:
+            frames = recorder.recording(stream, [14])
+            for _ in range(3):
+                next(frames)
+        recorder.record(14, 1)
+    monkeypatch.setattr("time.time", lambda: 1010.0)
+    with SampleRecorder(path) as recorder:
+        arduino = Arduino.uno("", conn_class=EmulatedSerialConnection)
+        with closing(arduino.stream([14], 500)) as stream:
+            frames = recorder.recording(stream, [14])
+            for _ in range(2):
+                next(frames)
+        timestamps_us = [sample.timestamp_us for sample in recorder.query()]
+    assert timestamps_us == [0, 2000, 4000, 4000, 10_000_000, 10_002_000]
@@ -0,0 +1,124 @@
+import asyncio
+import struct
+from typing import Any, Awaitable, Callable, Tuple, TypeVar
+from unittest.mock import Mock
+
+import pytest
+
+from rapiduino.communication.async_serial import AsyncSerialConnection
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_VERSION,
+)
+from rapiduino.exceptions import SerialConnectionReceiveDataError
+
+T = TypeVar("T")
+
+
+def run(test: Callable[[AsyncSerialConnection, Mock], Awaitable[T]]) -> T:
+    async def run_test() -> T:
+        writer = Mock(spec=asyncio.WriteTransport)
+        connection = AsyncSerialConnection(asyncio.StreamReader(), writer, timeout=0.1)
+        return await test(connection, writer)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_test())
+    finally:
+        loop.close()
+
+
+def test_process_command_returns_reply() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        connection.reader.feed_data(bytes([1, 2, 3]))
+        return await connection.process_command(CMD_VERSION)
+
+    assert run(test) == (1, 2, 3)
+
+
+def test_process_command_with_zero_length_reply_does_not_wait() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        return await connection.process_command(CMD_DIGITALWRITE, 1, 1)
+
+    assert run(test) == ()
+
+
+def test_concurrent_commands_are_pipelined() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        tasks = asyncio.gather(
+            connection.process_command(CMD_PARROT, 7),
+            connection.process_command(CMD_ANALOGREAD, 14),
+            connection.process_command(CMD_VERSION),
+        )
+        await asyncio.sleep(0)
+        written = b"".join(args[0] for args, _ in writer.write.call_args_list)
+        assert written == bytes([1, 7, 30, 14, 2])
+
+        connection.reader.feed_data(bytes([7]) + struct.pack("<H", 1023))
+        await asyncio.sleep(0)
+        connection.reader.feed_data(bytes([0, 3, 0]))
+        return await tasks
+
+    assert run(test) == [(7,), (1023,), (0, 3, 0)]
+
+
+def test_cancelled_request_still_consumes_its_reply() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Tuple[int, ...]:
+        cancelled = asyncio.ensure_future(connection.process_command(CMD_PARROT, 1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        remaining = asyncio.ensure_future(connection.process_command(CMD_PARROT, 2))
+        connection.reader.feed_data(bytes([1, 2]))
+        return await remaining
+
+    assert run(test) == (2,)
+
+
+def test_missing_reply_fails_all_pending_requests() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        connection.reader.feed_data(bytes([1, 2]))
+        return await asyncio.gather(
+            connection.process_command(CMD_VERSION),
+            connection.process_command(CMD_PARROT, 1),
+            return_exceptions=True,
+        )
+
+    results = run(test)
+    assert all(isinstance(r, SerialConnectionReceiveDataError) for r in results)
+
+
+def test_late_reply_is_not_matched_to_the_next_request() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        with pytest.raises(SerialConnectionReceiveDataError):
+            await connection.process_command(CMD_VERSION)
+        assert writer.write.call_args[0][0] == bytes([1, 1, 1, 0xFE])
+
+        # The late reply to CMD_VERSION arrives before the resync marker's echoes
+        connection.reader.feed_data(bytes([0, 3, 0, 1, 0xFE, 42]))
+        return await connection.process_command(CMD_PARROT, 42)
+
+    assert run(test) == (42,)
+
+
+def test_failed_resync_fails_requests_and_resyncs_again() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        with pytest.raises(SerialConnectionReceiveDataError):
+            await connection.process_command(CMD_VERSION)
+        with pytest.raises(SerialConnectionReceiveDataError):
+            await connection.process_command(CMD_PARROT, 42)
+        assert writer.write.call_args[0][0] == bytes([1, 2, 1, 0xFD])
+
+        connection.reader.feed_data(bytes([2, 0xFD, 42]))
+        return await connection.process_command(CMD_PARROT, 42)
+
+    assert run(test) == (42,)
+
+
+def test_process_command_with_invalid_arg_length() -> None:
+    async def test(connection: AsyncSerialConnection, writer: Mock) -> Any:
+        return await connection.process_command(CMD_DIGITALWRITE, 1, 1, 1)
+
+    with pytest.raises(ValueError):
+        run(test)
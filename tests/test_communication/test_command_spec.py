@@ -0,0 +1,55 @@
+import struct
+
+import pytest
+
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_DIGITALWRITE,
+    CMD_POLL,
+    CommandSpec,
+    cmd_analogreadmany,
+)
+
+
+def test_structs_are_compiled_once() -> None:
+    assert CMD_ANALOGREAD.tx_struct.format == "<B1B"
+    assert CMD_ANALOGREAD.rx_struct.format == "<1H"
+    assert CMD_ANALOGREAD.tx_size == 2
+    assert CMD_ANALOGREAD.rx_size == 2
+
+
+def test_command_without_reply_has_zero_rx_size() -> None:
+    assert CMD_DIGITALWRITE.rx_size == 0
+    assert CMD_DIGITALWRITE.decode(b"") == ()
+
+
+def test_equality_ignores_compiled_structs() -> None:
+    assert CMD_POLL == CommandSpec(cmd=0, tx_len=0, tx_type="B", rx_len=1, rx_type="B")
+    assert cmd_analogreadmany(3) is cmd_analogreadmany(3)
+
+
+def test_encode() -> None:
+    assert CMD_DIGITALWRITE.encode(13, 1) == bytes([21, 13, 1])
+
+
+def test_encode_into_reuses_buffer() -> None:
+    buffer = bytearray(6)
+    CMD_DIGITALWRITE.encode_into(buffer, 0, 13, 1)
+    CMD_DIGITALWRITE.encode_into(buffer, 3, 12, 0)
+    assert buffer == bytes([21, 13, 1, 21, 12, 0])
+
+
+def test_encode_with_invalid_arg_length() -> None:
+    with pytest.raises(ValueError):
+        CMD_DIGITALWRITE.encode(13)
+    with pytest.raises(ValueError):
+        CMD_DIGITALWRITE.encode_into(bytearray(3), 0, 13, 1, 1)
+
+
+def test_encode_with_out_of_range_arg() -> None:
+    with pytest.raises(struct.error):
+        CMD_DIGITALWRITE.encode(256, 1)
+
+
+def test_decode() -> None:
+    assert CMD_ANALOGREAD.decode(struct.pack("<H", 1000)) == (1000,)
@@ -0,0 +1,184 @@
+import time
+from typing import List
+from unittest.mock import Mock
+
+import pytest
+from serial import Serial
+
+from rapiduino.communication.command_spec import (
+    CMD_DIGITALREAD,
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_PINMODE,
+)
+from rapiduino.communication.deferred_serial import DeferredSerialConnection
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import EmulatedSerial
+from rapiduino.exceptions import SerialConnectionAckError
+from rapiduino.globals.common import HIGH, OUTPUT
+
+
+class RecordingSerial(EmulatedSerial):
+    def __init__(self, board: EmulatedBoard) -> None:
+        super().__init__(board)
+        self.writes: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.writes.append(bytes(data))
+        return super().write(data)
+
+
+@pytest.fixture
+def serial() -> RecordingSerial:
+    return RecordingSerial(EmulatedBoard())
+
+
+@pytest.fixture
+def connection(serial: RecordingSerial) -> DeferredSerialConnection:
+    connection = DeferredSerialConnection(serial)  # type: ignore
+    connection.max_delay = 60
+    return connection
+
+
+def test_writes_are_held_until_the_buffer_is_full(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.max_buffer_size = 9
+    connection.process_command(CMD_PINMODE, 13, OUTPUT.value)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    assert serial.writes == []
+
+    connection.process_command(CMD_DIGITALWRITE, 12, HIGH.value)
+    assert serial.writes == [bytes((10, 13, 1, 21, 13, 1, 21, 12, 1))]
+    assert serial.board.digital_read(13) == 1
+
+
+def test_writes_are_sent_after_max_delay_without_another_call(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.max_delay = 0.05
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    assert serial.writes == []
+
+    time.sleep(0.2)
+    assert serial.writes == [bytes((21, 13, 1))]
+
+
+def test_close_sends_held_writes(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    connection.close()
+    assert serial.writes == [bytes((21, 13, 1))]
+
+
+def test_writes_are_sent_once_they_are_old_enough(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.max_delay = 0
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    assert serial.writes == [bytes((21, 13, 1))]
+
+
+def test_writes_are_sent_before_a_command_with_a_reply(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.process_command(CMD_PINMODE, 13, OUTPUT.value)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    assert connection.process_command(CMD_DIGITALREAD, 13) == (1,)
+    assert serial.writes == [bytes((10, 13, 1, 21, 13, 1)), bytes((20, 13))]
+
+
+def test_flush_sends_the_buffer_with_an_acknowledgement(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    connection.flush()
+    connection.process_command(CMD_DIGITALWRITE, 12, HIGH.value)
+    connection.flush()
+    assert serial.writes == [bytes((21, 13, 1, 1, 0)), bytes((21, 12, 1, 1, 1))]
+    assert serial.in_waiting == 0
+
+
+def test_acknowledgements_are_requested_every_ack_interval(
+    serial: RecordingSerial, connection: DeferredSerialConnection
+) -> None:
+    connection.max_delay = 0
+    connection.ack_interval = 2
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    connection.process_command(CMD_DIGITALWRITE, 12, HIGH.value)
+    connection.process_command(CMD_DIGITALWRITE, 11, HIGH.value)
+    assert serial.writes == [
+        bytes((21, 13, 1)),
+        bytes((21, 12, 1, CMD_PARROT.cmd, 0)),
+        bytes((21, 11, 1)),
+    ]
+    assert serial.in_waiting == 0
+
+
+def test_wrong_acknowledgement_raises_error() -> None:
+    mock_serial = Mock(spec=Serial)
+    mock_serial.write.side_effect = len
+    mock_serial.read.return_value = bytes((7,))
+    connection = DeferredSerialConnection(mock_serial)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    with pytest.raises(SerialConnectionAckError):
+        connection.flush()
+
+
+def test_missing_acknowledgement_raises_error() -> None:
+    mock_serial = Mock(spec=Serial)
+    mock_serial.write.side_effect = len
+    mock_serial.read.return_value = bytes()
+    connection = DeferredSerialConnection(mock_serial)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    with pytest.raises(SerialConnectionAckError):
+        connection.flush()
+
+
+class DroppingSerial(RecordingSerial):
+    """Drops the given number of writes"""
+
+    def __init__(self, board: EmulatedBoard, n_writes_to_drop: int) -> None:
+        super().__init__(board)
+        self.n_writes_to_drop = n_writes_to_drop
+
+    def write(self, data: bytes) -> int:
+        if self.n_writes_to_drop:
+            self.n_writes_to_drop -= 1
+            self.writes.append(bytes(data))
+            return len(data)
+        return super().write(data)
+
+
+def test_framed_writes_are_acknowledged_with_the_next_reply() -> None:
+    serial = RecordingSerial(EmulatedBoard())
+    connection = DeferredSerialConnection(serial)  # type: ignore
+    connection.max_delay = 60
+    connection.enable_framing()
+    connection.process_command(CMD_PINMODE, 13, OUTPUT.value)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+
+    assert connection.process_command(CMD_DIGITALREAD, 13) == (1,)
+    assert len(serial.writes) == 2
+    assert serial.in_waiting == 0
+
+
+def test_lost_framed_writes_are_resent() -> None:
+    serial = DroppingSerial(EmulatedBoard(), n_writes_to_drop=1)
+    connection = DeferredSerialConnection(serial)  # type: ignore
+    connection.enable_framing()
+    connection.process_command(CMD_PINMODE, 13, OUTPUT.value)
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    connection.flush()
+
+    assert serial.board.digital_read(13) == 1
+
+
+def test_framed_writes_that_are_never_acknowledged_raise_error() -> None:
+    serial = DroppingSerial(EmulatedBoard(), n_writes_to_drop=100)
+    connection = DeferredSerialConnection(serial)  # type: ignore
+    connection.enable_framing()
+    connection.process_command(CMD_DIGITALWRITE, 13, HIGH.value)
+    with pytest.raises(SerialConnectionAckError):
+        connection.flush()
@@ -0,0 +1,50 @@
+import pytest
+
+from rapiduino.communication.framing import (
+    FRAME_START,
+    MAX_FRAME_BODY,
+    Frame,
+    FrameDecoder,
+    crc8,
+    encode_frame,
+)
+
+
+def test_crc8_check_value() -> None:
+    assert crc8(b"123456789") == 0xF4
+
+
+def test_encode_frame() -> None:
+    assert encode_frame(5, bytes([20, 13])) == bytes(
+        [FRAME_START, 2, 5, 20, 13, crc8(bytes([2, 5, 20, 13]))]
+    )
+
+
+def test_encode_frame_with_body_too_long() -> None:
+    with pytest.raises(ValueError):
+        encode_frame(0, bytes(MAX_FRAME_BODY + 1))
+
+
+def test_decoder_reassembles_frames_split_across_chunks() -> None:
+    data = encode_frame(1, b"\x00\x07") + encode_frame(2, b"\x00")
+    decoder = FrameDecoder()
+    assert decoder.bytes_needed == 2
+    assert decoder.feed(data[:3]) == []
+    assert decoder.bytes_needed == 3
+    assert decoder.feed(data[3:]) == [Frame(1, b"\x00\x07"), Frame(2, b"\x00")]
+    assert decoder.bytes_needed == 2
+
+
+def test_decoder_skips_junk_and_corrupt_frames() -> None:
+    corrupt = bytearray(encode_frame(1, b"\x00\x07"))
+    corrupt[4] ^= 0xFF
+    decoder = FrameDecoder()
+    frames = decoder.feed(b"\x01\x02" + corrupt + encode_frame(2, b"\x00"))
+    assert frames == [Frame(2, b"\x00")]
+    assert decoder.n_corrupt == 1
+
+
+def test_decoder_can_give_up_on_an_incomplete_frame() -> None:
+    decoder = FrameDecoder()
+    assert decoder.feed(bytes([FRAME_START, 60]) + encode_frame(3, b"\x00")) == []
+    assert decoder.skip_frame() == [Frame(3, b"\x00")]
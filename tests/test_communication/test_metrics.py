@@ -0,0 +1,102 @@
+from typing import List, Optional, Tuple
+
+import pytest
+
+from rapiduino.communication.command_spec import (
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_POLL,
+)
+from rapiduino.communication.metrics import (
+    LATENCY_BUCKETS_S,
+    ConnectionMetrics,
+    Histogram,
+)
+from rapiduino.communication.serial import SerialConnection
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import EmulatedSerial
+from rapiduino.exceptions import SerialConnectionReceiveDataError
+
+
+@pytest.fixture
+def connection() -> SerialConnection:
+    return SerialConnection(EmulatedSerial(EmulatedBoard()))  # type: ignore
+
+
+def test_histogram_counts_are_cumulative() -> None:
+    histogram = Histogram()
+    histogram.observe(0.0001)
+    histogram.observe(0.003)
+    histogram.observe(5)
+    cumulative = histogram.cumulative_counts()
+    assert cumulative[0] == 1
+    assert cumulative[LATENCY_BUCKETS_S.index(0.005)] == 2
+    assert cumulative[-1] == 3
+    assert histogram.count == 3
+    assert histogram.sum == pytest.approx(5.0031)
+
+
+def test_metrics_are_not_collected_by_default(connection: SerialConnection) -> None:
+    connection.process_command(CMD_POLL)
+    assert connection.metrics is None
+
+
+def test_metrics_count_commands_and_bytes(connection: SerialConnection) -> None:
+    metrics = connection.enable_metrics()
+    connection.process_command(CMD_PARROT, 1)
+    connection.process_command(CMD_PARROT, 2)
+    connection.process_commands([(CMD_DIGITALWRITE, (13, 1)), (CMD_POLL, ())])
+
+    snapshot = metrics.snapshot()
+    assert snapshot.commands == {CMD_PARROT.cmd: 2, CMD_DIGITALWRITE.cmd: 1, 0: 1}
+    assert snapshot.latency[str(CMD_PARROT.cmd)].count == 2
+    assert snapshot.latency["batch"].count == 1
+    assert snapshot.bytes_sent == 2 + 2 + 3 + 1
+    assert snapshot.bytes_received == 1 + 1 + 1
+    assert snapshot.errors == {}
+
+
+def test_metrics_count_errors_timeouts_and_retries() -> None:
+    serial = EmulatedSerial(EmulatedBoard())
+    serial.write = lambda data: len(data)  # type: ignore
+    connection = SerialConnection(serial)  # type: ignore
+    metrics = connection.enable_metrics()
+
+    with pytest.raises(SerialConnectionReceiveDataError):
+        connection.process_command(CMD_POLL)
+
+    snapshot = metrics.snapshot()
+    assert snapshot.errors == {"SerialConnectionReceiveDataError": 1}
+    assert snapshot.timeouts == 1 + SerialConnection.max_retries
+    assert snapshot.retries == SerialConnection.max_retries
+
+
+def test_callbacks_are_called_after_each_command(
+    connection: SerialConnection,
+) -> None:
+    calls: List[Tuple[Optional[int], Optional[BaseException]]] = []
+    metrics = connection.enable_metrics()
+    metrics.callbacks.append(lambda cmd, latency, error: calls.append((cmd, error)))
+
+    connection.process_command(CMD_POLL)
+    connection.process_commands([(CMD_POLL, ())])
+    assert calls == [(0, None), (None, None)]
+
+
+def test_prometheus_text(connection: SerialConnection) -> None:
+    metrics = connection.enable_metrics()
+    connection.process_command(CMD_POLL)
+
+    text = metrics.to_prometheus(labels={"port": "COM3"})
+    assert 'rapiduino_commands_total{port="COM3",cmd="0"} 1' in text
+    assert (
+        'rapiduino_command_latency_seconds_bucket{port="COM3",cmd="0",le="+Inf"} 1'
+        in text
+    )
+    assert 'rapiduino_bytes_sent_total{port="COM3"} 1' in text
+    assert "# TYPE rapiduino_command_latency_seconds histogram" in text
+
+
+def test_prometheus_text_without_labels() -> None:
+    text = ConnectionMetrics().to_prometheus()
+    assert "rapiduino_timeouts_total 0\n" in text
@@ -0,0 +1,122 @@
+from typing import Any, Iterator, List, Tuple
+from unittest.mock import Mock, patch
+
+import pytest
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.communication.recording import (
+    CAPTURE_RX,
+    CAPTURE_TX,
+    CAPTURE_WAITING,
+    RecordingSerial,
+    RecordingSerialConnection,
+    ReplaySerial,
+    ReplaySerialConnection,
+    capture_paths,
+    read_capture,
+)
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import EmulatedSerial
+from rapiduino.exceptions import ReplayMismatchError
+from rapiduino.globals.common import HIGH, OUTPUT
+
+
+def run_session(arduino: Arduino) -> Tuple[Any, ...]:
+    arduino.pin_mode(13, OUTPUT)
+    arduino.digital_write(13, HIGH)
+    return (
+        arduino.digital_read(13),
+        arduino.analog_read(14),
+        arduino.parrot(42),
+    )
+
+
+@pytest.fixture
+def capture_path(tmp_path: Any) -> Iterator[str]:
+    board = EmulatedBoard()
+    board.set_analog_input(14, 321)
+    path = str(tmp_path / "session.rpdcap")
+    capture_paths["COM9"] = path
+    with patch("rapiduino.communication.serial.Serial") as mock_serial:
+        mock_serial.side_effect = lambda port, baudrate, timeout: EmulatedSerial(
+            board, port, baudrate, timeout
+        )
+        arduino = Arduino.uno("COM9", conn_class=RecordingSerialConnection)
+    with arduino:
+        assert run_session(arduino) == (HIGH, 321, 42)
+    yield path
+    del capture_paths["COM9"]
+
+
+def test_replay_reproduces_recorded_session(capture_path: str) -> None:
+    arduino = Arduino.uno(capture_path, conn_class=ReplaySerialConnection)
+    assert run_session(arduino) == (HIGH, 321, 42)
+
+
+def test_replay_raises_when_writes_diverge(capture_path: str) -> None:
+    arduino = Arduino.uno(capture_path, conn_class=ReplaySerialConnection)
+    with pytest.raises(ReplayMismatchError):
+        arduino.parrot(43)
+
+
+def test_capture_records_have_directions_and_timestamps(capture_path: str) -> None:
+    records = list(read_capture(capture_path))
+    assert records[0].direction == CAPTURE_TX
+    assert {record.direction for record in records} == {CAPTURE_TX, CAPTURE_RX}
+    timestamps = [record.timestamp_ns for record in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_replay_repeats_reads_that_timed_out(tmp_path: Any) -> None:
+    path = str(tmp_path / "timeouts.rpdcap")
+    reads: List[bytes] = [b"\x01", b"", b"\x02\x03"]
+    mock_serial = Mock()
+    mock_serial.read.side_effect = reads
+    recording = RecordingSerial(mock_serial, path)
+    recording.write(b"\x00")
+    for _ in reads:
+        recording.read(2)
+    recording.timeout = 0.5
+    recording.close()
+    assert mock_serial.timeout == 0.5
+
+    replay = ReplaySerial(path)
+    replay.write(b"\x00")
+    assert replay.in_waiting == 1
+    assert [replay.read(2) for _ in reads] == reads
+    assert replay.read() == b""
+
+
+def test_records_are_written_to_the_capture_as_they_are_made(tmp_path: Any) -> None:
+    path = str(tmp_path / "unclosed.rpdcap")
+    recording = RecordingSerial(Mock(), path)
+    recording.write(b"\x00")
+
+    assert [record.data for record in read_capture(path)] == [b"\x00"]
+    recording.close()
+
+
+def test_replay_repeats_recorded_in_waiting_counts(tmp_path: Any) -> None:
+    path = str(tmp_path / "polling.rpdcap")
+    mock_serial = Mock()
+    mock_serial.read.return_value = b"\x01\x02"
+    recording = RecordingSerial(mock_serial, path)
+    for n_waiting in (0, 0, 2):
+        mock_serial.in_waiting = n_waiting
+        assert recording.in_waiting == n_waiting
+    recording.read(2)
+    recording.close()
+    assert [record.direction for record in read_capture(path)].count(
+        CAPTURE_WAITING
+    ) == 3
+
+    replay = ReplaySerial(path)
+    assert [replay.in_waiting for _ in range(3)] == [0, 0, 2]
+    assert replay.read(2) == b"\x01\x02"
+
+
+def test_replay_rejects_other_files(tmp_path: Any) -> None:
+    path = tmp_path / "not_a_capture"
+    path.write_bytes(b"hello world")
+    with pytest.raises(ValueError):
+        ReplaySerial(str(path))
@@ -1,12 +1,29 @@
 import struct
+from typing import List
 from unittest.mock import Mock, patch
 
 import pytest
 from serial import Serial
 
-from rapiduino.communication.command_spec import CMD_DIGITALWRITE, CMD_VERSION
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_DIGITALREAD,
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_VERSION,
+    STREAM_END,
+    STREAM_FRAME,
+    CommandSpec,
+    cmd_analogreadmany,
+)
+from rapiduino.communication.framing import encode_frame
 from rapiduino.communication.serial import SerialConnection
+from rapiduino.communication.timeouts import AdaptiveTimeout
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import EmulatedSerial
 from rapiduino.exceptions import (
+    SerialConnectionFrameError,
+    SerialConnectionNotReadyError,
     SerialConnectionReceiveDataError,
     SerialConnectionSendDataError,
 )
@@ -38,6 +55,16 @@ def test_builder_sets_overridden_values(mock_serial: Mock) -> None:
     mock_serial.assert_called_once_with("port", baudrate=123, timeout=321)
 
 
+@patch("rapiduino.communication.serial.Serial")
+def test_builder_can_open_without_resetting(mock_serial: Mock) -> None:
+    SerialConnection.build("port", reset_on_open=False)
+    mock_serial.assert_called_once_with(baudrate=115200, timeout=1)
+    conn = mock_serial.return_value
+    assert conn.port == "port"
+    assert conn.dtr is False
+    conn.open.assert_called_once_with()
+
+
 def test_process_command_with_valid_command_returning_bytes() -> None:
     mock_serial = get_mock_serial(1, CMD_VERSION_RX_BYTES)
 
@@ -56,6 +83,27 @@ def test_process_command_with_valid_command_returning_zero_bytes() -> None:
     assert received == ()
 
 
+def test_process_command_with_16_bit_reply() -> None:
+    mock_serial = get_mock_serial(2, struct.pack("<H", 1023))
+
+    serial_connection = SerialConnection(mock_serial)
+    received = serial_connection.process_command(CMD_ANALOGREAD, 14)
+
+    assert received == (1023,)
+    mock_serial.read.assert_called_once_with(2)
+
+
+def test_process_command_with_variable_length_command() -> None:
+    mock_serial = get_mock_serial(4, struct.pack("<HH", 512, 3))
+
+    serial_connection = SerialConnection(mock_serial)
+    received = serial_connection.process_command(cmd_analogreadmany(2), 2, 14, 15)
+
+    assert received == (512, 3)
+    mock_serial.write.assert_called_once_with(bytes([32, 2, 14, 15]))
+    mock_serial.read.assert_called_once_with(4)
+
+
 def test_process_command_with_invalid_arg_length() -> None:
     mock_serial = get_mock_serial(3, bytes())
 
@@ -80,3 +128,359 @@ def test_process_command_with_invalid_number_of_bytes_return_from_recv() -> None
 
     with pytest.raises(SerialConnectionReceiveDataError):
         serial_connection.process_command(CMD_VERSION)
+
+
+def test_process_commands_sends_one_write_and_one_read() -> None:
+    mock_serial = get_mock_serial(6, CMD_VERSION_RX_BYTES + bytes([7]))
+
+    serial_connection = SerialConnection(mock_serial)
+    received = serial_connection.process_commands(
+        [(CMD_DIGITALWRITE, (1, 1)), (CMD_VERSION, ()), (CMD_PARROT, (7,))]
+    )
+
+    assert received == [(), CMD_VERSION_RX_DATA, (7,)]
+    mock_serial.write.assert_called_once_with(bytes([21, 1, 1, 2, 1, 7]))
+    mock_serial.read.assert_called_once_with(4)
+
+
+def test_process_commands_with_only_writes_does_not_read() -> None:
+    mock_serial = get_mock_serial(6, bytes())
+
+    serial_connection = SerialConnection(mock_serial)
+    received = serial_connection.process_commands(
+        [(CMD_DIGITALWRITE, (1, 1)), (CMD_DIGITALWRITE, (2, 0))]
+    )
+
+    assert received == [(), ()]
+    mock_serial.read.assert_not_called()
+
+
+def test_process_commands_with_invalid_arg_length_sends_nothing() -> None:
+    mock_serial = get_mock_serial(3, bytes())
+
+    serial_connection = SerialConnection(mock_serial)
+    with pytest.raises(ValueError):
+        serial_connection.process_commands(
+            [(CMD_DIGITALWRITE, (1, 1)), (CMD_DIGITALWRITE, (1,))]
+        )
+    mock_serial.write.assert_not_called()
+
+
+def test_process_commands_with_invalid_number_of_bytes_return_from_recv() -> None:
+    mock_serial = get_mock_serial(3, CMD_VERSION_RX_BYTES)
+
+    serial_connection = SerialConnection(mock_serial)
+
+    with pytest.raises(SerialConnectionReceiveDataError):
+        serial_connection.process_commands([(CMD_VERSION, ()), (CMD_PARROT, (1,))])
+
+
+def test_recv_stream_frame_decodes_frame() -> None:
+    mock_serial = get_mock_serial(0, struct.pack("<BIHH", STREAM_FRAME, 1000, 1, 2))
+
+    serial_connection = SerialConnection(mock_serial)
+
+    assert serial_connection.recv_stream_frame(2) == (1000, 1, 2)
+    mock_serial.read.assert_called_once_with(9)
+
+
+def test_recv_stream_frame_returns_none_at_end_of_stream() -> None:
+    mock_serial = get_mock_serial(0, struct.pack("<BIH", STREAM_END, 1000, 0))
+
+    serial_connection = SerialConnection(mock_serial)
+
+    assert serial_connection.recv_stream_frame(1) is None
+
+
+def test_recv_stream_frame_skips_bytes_until_in_sync() -> None:
+    data = bytes([0, 1]) + struct.pack("<BIH", STREAM_FRAME, 5, 6)
+    mock_serial = Mock(spec=Serial)
+    mock_serial.read.side_effect = [data[:7], data[7:8], data[8:9]]
+
+    serial_connection = SerialConnection(mock_serial)
+
+    assert serial_connection.recv_stream_frame(1) == (5, 6)
+
+
+def test_recv_stream_frames_reads_what_has_arrived_in_one_go() -> None:
+    data = b"".join(struct.pack("<BIH", STREAM_FRAME, t, t) for t in range(3))
+    mock_serial = Mock(spec=Serial)
+    mock_serial.in_waiting = len(data)
+    mock_serial.read.side_effect = [data]
+
+    serial_connection = SerialConnection(mock_serial)
+
+    assert serial_connection.recv_stream_frames(1, max_frames=10) == (data, False)
+
+
+def test_recv_stream_frames_resyncs_and_stops_at_end_of_stream() -> None:
+    frame = struct.pack("<BIH", STREAM_FRAME, 5, 6)
+    data = bytes([0]) + frame + struct.pack("<BIH", STREAM_END, 0, 0)
+    mock_serial = Mock(spec=Serial)
+    mock_serial.in_waiting = len(data) - 1
+    mock_serial.read.side_effect = [data[:-1], data[-1:]]
+
+    serial_connection = SerialConnection(mock_serial)
+
+    assert serial_connection.recv_stream_frames(1, max_frames=2) == (frame, True)
+
+
+class FaultySerial(EmulatedSerial):
+    """Corrupts the first write and the first reply it is told to"""
+
+    def __init__(self, corrupt_write: bool = False, corrupt_read: bool = False) -> None:
+        super().__init__(EmulatedBoard())
+        self.corrupt_write = corrupt_write
+        self.corrupt_read = corrupt_read
+        self.writes: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.writes.append(bytes(data))
+        if self.corrupt_write:
+            self.corrupt_write = False
+            data = data[:-1] + bytes([data[-1] ^ 0xFF])
+        return super().write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = super().read(size)
+        if self.corrupt_read and len(data) > 2:
+            self.corrupt_read = False
+            data = data[:-1] + bytes([data[-1] ^ 0xFF])
+        return data
+
+
+def get_framed_connection(serial: EmulatedSerial) -> SerialConnection:
+    serial_connection = SerialConnection(serial)  # type: ignore
+    serial_connection.enable_framing()
+    return serial_connection
+
+
+def test_framed_process_command() -> None:
+    serial = FaultySerial()
+    serial_connection = get_framed_connection(serial)
+
+    assert serial_connection.process_command(CMD_PARROT, 42) == (42,)
+    assert serial.writes == [encode_frame(0, CMD_PARROT.encode(42))]
+
+
+def test_framed_process_commands_matches_replies_to_commands() -> None:
+    serial_connection = get_framed_connection(FaultySerial())
+
+    assert serial_connection.process_commands(
+        [(CMD_PARROT, (1,)), (CMD_DIGITALWRITE, (13, 1)), (CMD_VERSION, ())]
+    ) == [(1,), (), EmulatedBoard.version]
+
+
+def test_framed_command_is_resent_when_rejected_by_the_arduino() -> None:
+    serial = FaultySerial(corrupt_write=True)
+    serial_connection = get_framed_connection(serial)
+
+    assert serial_connection.process_command(CMD_PARROT, 42) == (42,)
+    assert serial.writes == [encode_frame(0, CMD_PARROT.encode(42))] * 2
+
+
+def test_framed_command_is_resent_when_reply_is_corrupt() -> None:
+    serial = FaultySerial(corrupt_read=True)
+    serial_connection = get_framed_connection(serial)
+
+    assert serial_connection.process_command(CMD_PARROT, 42) == (42,)
+    assert len(serial.writes) == 2
+
+
+def test_framed_command_unknown_to_the_arduino() -> None:
+    serial_connection = get_framed_connection(FaultySerial())
+
+    with pytest.raises(SerialConnectionFrameError):
+        serial_connection.process_command(CommandSpec(99, 0, "B", 1, "B"))
+
+
+def test_framed_command_without_reply_is_retried_then_fails() -> None:
+    mock_serial = get_mock_serial(6, bytes())
+    serial_connection = SerialConnection(mock_serial)
+    serial_connection.enable_framing()
+
+    with pytest.raises(SerialConnectionFrameError):
+        serial_connection.process_command(CMD_PARROT, 42)
+    assert mock_serial.write.call_count == 1 + SerialConnection.max_retries
+
+
+class DroppingSerial(EmulatedSerial):
+    """Corrupts the first frame of the first write, or drops the write entirely"""
+
+    def __init__(self, drop: bool = False) -> None:
+        super().__init__(EmulatedBoard())
+        self.drop = drop
+        self.n_writes = 0
+
+    def write(self, data: bytes) -> int:
+        self.n_writes += 1
+        if self.n_writes == 1:
+            if self.drop:
+                return len(data)
+            data = data[:6] + bytes([data[6] ^ 0xFF]) + data[7:]
+        return super().write(data)
+
+
+def test_frame_rejected_by_the_arduino_is_not_run_after_later_frames() -> None:
+    serial = DroppingSerial()
+    serial_connection = get_framed_connection(serial)
+
+    serial_connection.process_commands(
+        [(CMD_DIGITALWRITE, (13, 1)), (CMD_DIGITALWRITE, (13, 0))]
+    )
+    assert serial_connection.process_command(CMD_DIGITALREAD, 13) == (0,)
+    assert serial.board.pins[13].output_state == 0
+
+
+def test_lost_frame_without_reply_data_is_resent() -> None:
+    serial = DroppingSerial(drop=True)
+    serial_connection = get_framed_connection(serial)
+
+    serial_connection.process_command(CMD_DIGITALWRITE, 13, 1)
+    assert serial.n_writes == 2
+    assert serial.board.pins[13].output_state == 1
+
+
+def test_framed_exchange_recovers_after_failing() -> None:
+    serial = LossySerial(1 + SerialConnection.max_retries)
+    serial_connection = get_framed_connection(serial)
+
+    with pytest.raises(SerialConnectionFrameError):
+        serial_connection.process_command(CMD_PARROT, 42)
+    assert serial_connection.process_command(CMD_PARROT, 43) == (43,)
+
+
+class LossySerial(EmulatedSerial):
+    """Loses the replies to the given number of writes"""
+
+    def __init__(self, n_replies_to_lose: int) -> None:
+        super().__init__(EmulatedBoard())
+        self.n_replies_to_lose = n_replies_to_lose
+
+    def write(self, data: bytes) -> int:
+        n_bytes = super().write(data)
+        if self.n_replies_to_lose:
+            self.n_replies_to_lose -= 1
+            self.board.take_output()
+        return n_bytes
+
+
+def test_lost_reply_is_retried_after_resync() -> None:
+    serial_connection = SerialConnection(LossySerial(1))  # type: ignore
+
+    assert serial_connection.process_command(CMD_PARROT, 42) == (42,)
+
+
+def test_lost_replies_are_retried_up_to_max_retries() -> None:
+    serial = LossySerial(1 + SerialConnection.max_retries)
+    serial_connection = SerialConnection(serial)  # type: ignore
+
+    with pytest.raises(SerialConnectionReceiveDataError):
+        serial_connection.process_command(CMD_PARROT, 42)
+    assert serial_connection.process_command(CMD_PARROT, 42) == (42,)
+
+
+def test_lost_reply_fails_fast_when_retry_budget_is_spent() -> None:
+    serial = LossySerial(1)
+    serial_connection = SerialConnection(serial)  # type: ignore
+    serial_connection._retry_tokens = 0
+
+    with pytest.raises(SerialConnectionReceiveDataError):
+        serial_connection.process_command(CMD_PARROT, 42)
+
+
+def test_resync_skips_stale_replies() -> None:
+    serial = EmulatedSerial(EmulatedBoard())
+    serial_connection = SerialConnection(serial)  # type: ignore
+    serial.board.output += bytes([1, 2, 3])
+    serial.reset_input_buffer = lambda: None  # type: ignore
+
+    serial_connection._resync()
+    assert serial.in_waiting == 0
+
+
+def test_timeout_adapts_to_round_trip_time() -> None:
+    serial = EmulatedSerial(EmulatedBoard(), timeout=1)
+    serial_connection = SerialConnection(serial)  # type: ignore
+
+    for _ in range(AdaptiveTimeout.min_samples + 1):
+        serial_connection.process_command(CMD_PARROT, 1)
+    assert serial.timeout is not None and serial.timeout < 0.1
+
+    serial.board.output += struct.pack("<BIH", STREAM_END, 0, 0)
+    serial_connection.recv_stream_frame(1)
+    assert serial.timeout == 1
+
+
+def test_timeout_of_a_batch_covers_sending_it() -> None:
+    serial = EmulatedSerial(EmulatedBoard(), timeout=1)
+    serial_connection = SerialConnection(serial)  # type: ignore
+    for _ in range(AdaptiveTimeout.min_samples + 1):
+        serial_connection.process_command(CMD_PARROT, 1)
+
+    # 80 bytes are sent and 40 received
+    serial_connection.process_commands([(CMD_PARROT, (1,))] * 40)
+    byte_time_s = serial_connection.timeouts.byte_time_s
+    assert serial.timeout is not None
+    assert serial.timeout > AdaptiveTimeout.margin_s + 110 * byte_time_s
+
+
+def test_round_trip_of_a_batch_is_not_recorded() -> None:
+    serial = EmulatedSerial(EmulatedBoard(), timeout=1)
+    serial_connection = SerialConnection(serial)  # type: ignore
+
+    with patch.object(AdaptiveTimeout, "record") as record:
+        serial_connection.process_commands([(CMD_PARROT, (1,))] * 2)
+        record.assert_not_called()
+        serial_connection.process_command(CMD_PARROT, 1)
+        record.assert_called_once()
+
+
+def test_slow_replies_extend_the_timeout() -> None:
+    serial = EmulatedSerial(EmulatedBoard(), timeout=1)
+    serial_connection = SerialConnection(serial)  # type: ignore
+
+    read = serial.read
+    timeouts = []
+
+    def read_and_record_timeout(size: int = 1) -> bytes:
+        timeouts.append(serial.timeout)
+        return read(size)
+
+    serial.read = read_and_record_timeout  # type: ignore
+    with serial_connection.slow_replies(2.5):
+        serial_connection.process_command(CMD_PARROT, 1)
+    assert timeouts == [3.5]
+    assert serial.timeout == 1
+    assert serial_connection.timeouts.rtt_percentile is None
+
+
+class BootingSerial(EmulatedSerial):
+    """Ignores everything sent until the given number of writes have been made"""
+
+    def __init__(self, n_writes_while_booting: int) -> None:
+        super().__init__(EmulatedBoard(), timeout=1)
+        self.n_writes_while_booting = n_writes_while_booting
+
+    def write(self, data: bytes) -> int:
+        if self.n_writes_while_booting:
+            self.n_writes_while_booting -= 1
+            return len(data)
+        return super().write(data)
+
+
+def test_wait_until_ready_polls_until_the_arduino_replies() -> None:
+    serial = BootingSerial(3)
+    serial_connection = SerialConnection(serial)  # type: ignore
+
+    serial_connection.wait_until_ready()
+    assert serial.n_writes_while_booting == 0
+    assert serial.timeout == 1
+    assert serial_connection.process_command(CMD_PARROT, 5) == (5,)
+
+
+def test_wait_until_ready_gives_up_after_timeout() -> None:
+    serial_connection = SerialConnection(BootingSerial(1000))  # type: ignore
+
+    with pytest.raises(SerialConnectionNotReadyError):
+        serial_connection.wait_until_ready(timeout=0)
@@ -0,0 +1,116 @@
+import struct
+import threading
+from typing import Dict, List
+from unittest.mock import Mock
+
+import pytest
+from serial import Serial
+
+from rapiduino.communication.command_spec import (
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_VERSION,
+    STREAM_FRAME,
+)
+from rapiduino.communication.threaded_serial import ThreadedSerialConnection
+from rapiduino.exceptions import SerialConnectionReceiveDataError
+
+
+class ParrotSerial:
+    """Replies to parrot commands and records every write"""
+
+    def __init__(self) -> None:
+        self.writes: List[bytes] = []
+        self.replies = b""
+        self.write_started = threading.Event()
+        self.write_allowed = threading.Event()
+        self.write_allowed.set()
+
+    def write(self, data: bytes) -> int:
+        self.write_started.set()
+        self.write_allowed.wait()
+        self.writes.append(data)
+        for i in range(0, len(data), 2):
+            self.replies += data[i + 1 : i + 2]
+        return len(data)
+
+    def read(self, n_bytes: int) -> bytes:
+        data, self.replies = self.replies[:n_bytes], self.replies[n_bytes:]
+        return data
+
+    def close(self) -> None:
+        pass
+
+
+def test_process_command_from_many_threads() -> None:
+    serial = ParrotSerial()
+    connection = ThreadedSerialConnection(serial)  # type: ignore
+    results: Dict[int, int] = {}
+
+    def worker(value: int) -> None:
+        for _ in range(20):
+            results[value] = connection.process_command(CMD_PARROT, value)[0]
+            assert results[value] == value
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connection.close()
+
+    assert results == {i: i for i in range(10)}
+
+
+def test_queued_commands_are_coalesced_into_one_write() -> None:
+    serial = ParrotSerial()
+    serial.write_allowed.clear()
+    connection = ThreadedSerialConnection(serial)  # type: ignore
+
+    first = connection.submit(CMD_PARROT, 1)
+    serial.write_started.wait()
+    futures = [connection.submit(CMD_PARROT, i) for i in range(2, 6)]
+    serial.write_allowed.set()
+
+    assert first.result() == (1,)
+    assert [future.result() for future in futures] == [(2,), (3,), (4,), (5,)]
+    assert serial.writes == [bytes([1, 1]), bytes([1, 2, 1, 3, 1, 4, 1, 5])]
+    connection.close()
+
+
+def test_process_commands_returns_replies_in_order() -> None:
+    connection = ThreadedSerialConnection(ParrotSerial())  # type: ignore
+    replies = connection.process_commands([(CMD_PARROT, (1,)), (CMD_PARROT, (2,))])
+    connection.close()
+    assert replies == [(1,), (2,)]
+
+
+def test_failed_read_is_raised_in_calling_thread() -> None:
+    mock_serial = Mock(spec=Serial)
+    mock_serial.write.return_value = 1
+    mock_serial.read.return_value = bytes([1])
+    connection = ThreadedSerialConnection(mock_serial)
+
+    with pytest.raises(SerialConnectionReceiveDataError):
+        connection.process_command(CMD_VERSION)
+    connection.close()
+
+
+def test_invalid_args_are_raised_before_queueing() -> None:
+    mock_serial = Mock(spec=Serial)
+    connection = ThreadedSerialConnection(mock_serial)
+
+    with pytest.raises(ValueError):
+        connection.submit(CMD_DIGITALWRITE, 1)
+    connection.close()
+    mock_serial.write.assert_not_called()
+
+
+def test_recv_stream_frame_reads_on_io_thread() -> None:
+    mock_serial = Mock(spec=Serial)
+    mock_serial.read.return_value = struct.pack("<BIH", STREAM_FRAME, 10, 20)
+    connection = ThreadedSerialConnection(mock_serial)
+
+    assert connection.recv_stream_frame(1) == (10, 20)
+    connection.close()
+    mock_serial.close.assert_called_once_with()
@@ -0,0 +1,40 @@
+from rapiduino.communication.timeouts import AdaptiveTimeout
+
+
+def test_max_timeout_is_used_until_enough_samples() -> None:
+    timeouts = AdaptiveTimeout(1, 115200)
+    for _ in range(AdaptiveTimeout.min_samples - 1):
+        timeouts.record(0.001)
+    assert timeouts.timeout(1) == 1
+
+
+def test_timeout_is_percentile_plus_margin_and_transfer_time() -> None:
+    timeouts = AdaptiveTimeout(1, 10000)
+    for i in range(AdaptiveTimeout.min_samples):
+        timeouts.record(0.010 if i == 0 else 0.001)
+    assert timeouts.rtt_percentile == 0.010
+    assert timeouts.timeout(10) == round(0.010 + AdaptiveTimeout.margin_s + 0.01, 3)
+
+
+def test_timeout_covers_bytes_still_being_sent() -> None:
+    timeouts = AdaptiveTimeout(1, 10000)
+    for _ in range(AdaptiveTimeout.min_samples):
+        timeouts.record(0.001)
+    assert timeouts.timeout(2, tx_bytes=80) == round(
+        0.001 + AdaptiveTimeout.margin_s + 0.082, 3
+    )
+
+
+def test_timeout_is_never_more_than_max_timeout() -> None:
+    timeouts = AdaptiveTimeout(0.1, 115200)
+    for _ in range(AdaptiveTimeout.min_samples):
+        timeouts.record(0.5)
+    assert timeouts.timeout(1) == 0.1
+
+
+def test_timeout_without_max_timeout() -> None:
+    timeouts = AdaptiveTimeout(None, None)
+    assert timeouts.timeout(1) is None
+    for _ in range(AdaptiveTimeout.min_samples):
+        timeouts.record(0)
+    assert timeouts.timeout(1) == AdaptiveTimeout.margin_s
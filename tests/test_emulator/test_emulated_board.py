@@ -0,0 +1,182 @@
+import struct
+
+import pytest
+
+from rapiduino.boards.pins import get_mega_pins
+from rapiduino.communication.command_spec import (
+    CMD_ANALOGREAD,
+    CMD_ANALOGWRITE,
+    CMD_BAUDRATES,
+    CMD_DIGITALREAD,
+    CMD_DIGITALWRITE,
+    CMD_PARROT,
+    CMD_PINMODE,
+    CMD_POLL,
+    CMD_SETBAUD,
+    CMD_STREAMSTOP,
+    CMD_VERSION,
+    STREAM_END,
+    STREAM_FRAME,
+    cmd_analogreadmany,
+    cmd_digitalreadall,
+    cmd_digitalwritemany,
+    cmd_macrorun,
+    cmd_macrowrite,
+    cmd_streamstart,
+)
+from rapiduino.communication.framing import (
+    FRAME_BAD_CRC,
+    FRAME_DUPLICATE,
+    FRAME_OK,
+    FRAME_OUT_OF_ORDER,
+    encode_frame,
+)
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.globals.common import INPUT_PULLUP, OUTPUT
+
+
+@pytest.fixture
+def board() -> EmulatedBoard:
+    return EmulatedBoard()
+
+
+def test_poll_parrot_and_version(board: EmulatedBoard) -> None:
+    board.receive(CMD_POLL.encode() + CMD_PARROT.encode(42) + CMD_VERSION.encode())
+    assert board.take_output() == bytes([1, 42, *EmulatedBoard.version])
+
+
+def test_commands_can_arrive_a_byte_at_a_time(board: EmulatedBoard) -> None:
+    for byte in CMD_PARROT.encode(7):
+        board.receive(bytes([byte]))
+    assert board.take_output() == bytes([7])
+
+
+def test_digital_write_then_read_output_pin(board: EmulatedBoard) -> None:
+    board.receive(CMD_PINMODE.encode(13, OUTPUT.value))
+    board.receive(CMD_DIGITALWRITE.encode(13, 1))
+    board.receive(CMD_DIGITALREAD.encode(13))
+    assert board.take_output() == bytes([1])
+    assert board.pins[13].output_state == 1
+
+
+def test_digital_read_of_inputs(board: EmulatedBoard) -> None:
+    board.set_digital_input(2, 1)
+    board.receive(CMD_PINMODE.encode(3, INPUT_PULLUP.value))
+    board.receive(CMD_DIGITALREAD.encode(2) + CMD_DIGITALREAD.encode(3))
+    board.receive(CMD_DIGITALREAD.encode(4))
+    assert board.take_output() == bytes([1, 1, 0])
+
+
+def test_analog_read_and_write(board: EmulatedBoard) -> None:
+    board.set_analog_input(14, 1023)
+    board.receive(CMD_ANALOGREAD.encode(14) + CMD_ANALOGWRITE.encode(3, 200))
+    assert board.take_output() == struct.pack("<H", 1023)
+    assert board.pins[3].pwm_value == 200
+
+
+def test_bulk_commands() -> None:
+    board = EmulatedBoard(get_mega_pins())
+    board.set_analog_input(54, 1)
+    board.set_analog_input(55, 2)
+    board.receive(CMD_PINMODE.encode(2, OUTPUT.value))
+    board.receive(CMD_PINMODE.encode(69, OUTPUT.value))
+    board.receive(cmd_digitalwritemany(9).encode(9, 4, *[0] * 7, 32, 4, *[0] * 7, 32))
+    board.receive(cmd_digitalreadall(9).encode(9))
+    board.receive(cmd_analogreadmany(2).encode(2, 55, 54))
+    assert board.take_output() == bytes([4, *[0] * 7, 32]) + struct.pack("<HH", 2, 1)
+
+
+def test_stream_frames_follow_the_simulated_clock(board: EmulatedBoard) -> None:
+    board.set_analog_input(14, 300)
+    board.receive(cmd_streamstart(1).encode(1000, 1, 14))
+    board.service(2500)
+    board.receive(CMD_STREAMSTOP.encode())
+
+    frames = struct.unpack("<" + "BIH" * 4, board.take_output())
+    assert frames == (
+        STREAM_FRAME, 0, 300,
+        STREAM_FRAME, 1000, 300,
+        STREAM_FRAME, 2000, 300,
+        STREAM_END, 2500, 0,
+    )  # fmt: skip
+    assert not board.has_background_work
+
+
+def test_macro_stops_at_macro_commands(board: EmulatedBoard) -> None:
+    code = CMD_POLL.encode() + cmd_macrorun(0).encode(0, 1) + CMD_POLL.encode()
+    board.receive(cmd_macrowrite(len(code)).encode(0, 0, len(code), *code))
+    board.receive(cmd_macrorun(1).encode(0, 3))
+    assert board.take_output() == bytes([1])
+
+
+def test_unknown_commands_are_ignored(board: EmulatedBoard) -> None:
+    board.receive(bytes([99]) + CMD_POLL.encode())
+    assert board.take_output() == bytes([1])
+
+
+def test_framed_and_unframed_commands_can_be_mixed(board: EmulatedBoard) -> None:
+    board.receive(encode_frame(7, CMD_PARROT.encode(42)) + CMD_POLL.encode())
+    assert board.take_output() == encode_frame(7, bytes([FRAME_OK, 42])) + bytes([1])
+
+
+def test_framed_command_without_reply_is_acknowledged(board: EmulatedBoard) -> None:
+    board.receive(encode_frame(0, CMD_DIGITALWRITE.encode(13, 1)))
+    assert board.take_output() == encode_frame(0, bytes([FRAME_OK]))
+    assert board.pins[13].output_state == 1
+
+
+def test_frame_sent_after_a_lost_one_is_not_run(board: EmulatedBoard) -> None:
+    board.receive(encode_frame(0, CMD_DIGITALWRITE.encode(13, 1)))
+    board.receive(encode_frame(2, CMD_DIGITALWRITE.encode(13, 0)))
+    assert board.take_output() == encode_frame(0, bytes([FRAME_OK])) + encode_frame(
+        2, bytes([FRAME_OUT_OF_ORDER])
+    )
+    assert board.pins[13].output_state == 1
+
+
+def test_resent_frames_are_not_run_again(board: EmulatedBoard) -> None:
+    board.receive(encode_frame(0, CMD_DIGITALWRITE.encode(13, 1)))
+    board.receive(encode_frame(1, CMD_PARROT.encode(42)))
+    board.take_output()
+    board.receive(encode_frame(0, CMD_DIGITALWRITE.encode(13, 1)))
+    board.receive(encode_frame(1, CMD_PARROT.encode(42)))
+    assert board.take_output() == encode_frame(0, bytes([FRAME_DUPLICATE])) + (
+        encode_frame(1, bytes([FRAME_OK, 42]))
+    )
+
+
+def test_unframed_command_restarts_frame_numbering(board: EmulatedBoard) -> None:
+    board.receive(encode_frame(0, CMD_POLL.encode()))
+    board.receive(CMD_POLL.encode())
+    board.take_output()
+    board.receive(encode_frame(9, CMD_POLL.encode()))
+    assert board.take_output() == encode_frame(9, bytes([FRAME_OK, 1]))
+
+
+def test_framed_command_with_bad_crc_is_rejected(board: EmulatedBoard) -> None:
+    frame = bytearray(encode_frame(3, CMD_DIGITALWRITE.encode(13, 1)))
+    frame[-1] ^= 0xFF
+    board.receive(bytes(frame))
+    assert board.take_output() == encode_frame(3, bytes([FRAME_BAD_CRC]))
+    assert board.pins[13].output_state == 0
+
+
+def test_set_baud_reverts_without_confirmation(board: EmulatedBoard) -> None:
+    board.receive(CMD_SETBAUD.encode(4))
+    assert board.take_output() == bytes([4])
+    assert board.baudrate == 2000000
+    board.service()
+    assert board.baudrate == 115200
+
+
+def test_set_baud_is_kept_once_confirmed(board: EmulatedBoard) -> None:
+    board.receive(CMD_SETBAUD.encode(2) + CMD_PARROT.encode(1))
+    board.service(10000000)
+    assert board.baudrate == 500000
+
+
+def test_set_baud_with_unsupported_rate(board: EmulatedBoard) -> None:
+    board.supported_baudrates = 0b00001
+    board.receive(CMD_BAUDRATES.encode() + CMD_SETBAUD.encode(1))
+    assert board.take_output() == bytes([0b00001, 0xFF])
+    assert board.baudrate == 115200
@@ -0,0 +1,407 @@
+import asyncio
+import struct
+import sys
+from contextlib import closing
+from typing import List, Union
+
+import pytest
+
+from rapiduino.boards.arduino import Arduino
+from rapiduino.boards.events import AnalogEvent, DigitalEvent
+from rapiduino.boards.pins import get_mega_pins
+from rapiduino.communication.serial import SerialConnection
+from rapiduino.components.led.led import LED
+from rapiduino.emulator.board import EmulatedBoard
+from rapiduino.emulator.serial import (
+    EmulatedSerialConnection,
+    PtyServer,
+    emulated_boards,
+)
+from rapiduino.exceptions import (
+    ArduinoScheduleFullError,
+    ArduinoSketchVersionIncompatibleError,
+    ArduinoWatchListFullError,
+)
+from rapiduino.globals.common import HIGH, LOW, OUTPUT
+
+
+@pytest.fixture
+def arduino() -> Arduino:
+    return Arduino.uno("", conn_class=EmulatedSerialConnection)
+
+
+def get_board(arduino: Arduino) -> EmulatedBoard:
+    return arduino.connection.conn.board  # type: ignore
+
+
+def test_arduino_round_trip(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 512)
+    board.set_digital_input(2, 1)
+
+    assert arduino.poll() == 1
+    assert arduino.parrot(200) == 200
+    assert arduino.analog_read(14) == 512
+    assert arduino.digital_read(2) == HIGH
+
+    arduino.pin_mode(13, OUTPUT)
+    arduino.digital_write(13, HIGH)
+    assert arduino.digital_read(13) == HIGH
+
+
+def test_batch_and_bulk_commands(arduino: Arduino) -> None:
+    with arduino.batch():
+        for pin_no in range(2, 6):
+            arduino.pin_mode(pin_no, OUTPUT)
+        arduino.digital_write_many({2: HIGH, 3: LOW, 4: HIGH})
+
+    states = arduino.digital_read_all()
+    assert [states[pin_no] for pin_no in range(2, 6)] == [HIGH, LOW, HIGH, LOW]
+
+
+def test_stream(arduino: Arduino) -> None:
+    get_board(arduino).set_analog_input(15, 7)
+    with closing(arduino.stream([15], 500)) as stream:
+        frames = [next(stream) for _ in range(3)]
+
+    assert [frame.timestamp_us for frame in frames] == [0, 2000, 4000]
+    assert all(frame.values == (7,) for frame in frames)
+    assert arduino.poll() == 1
+
+
+def test_acquire_decodes_frames_into_a_buffer(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 3)
+    board.set_analog_input(15, 7)
+    buffer = arduino.acquire([14, 15], 500, n_frames=5)
+
+    timestamps_us, values = buffer.to_arrays()
+    assert list(timestamps_us) == [0, 2000, 4000, 6000, 8000]
+    assert values.tobytes()[:4] == struct.pack("=2H", 3, 7)
+    assert arduino.poll() == 1
+
+    arduino.acquire([14, 15], 500, n_frames=5, buffer=buffer)
+    assert buffer.n_frames_total == 10
+    with pytest.raises(ValueError):
+        arduino.acquire([14], 500, n_frames=5, buffer=buffer)
+
+
+def test_led_component(arduino: Arduino) -> None:
+    led = LED(arduino, 13)
+    led.toggle()
+    assert get_board(arduino).pins[13].output_state == 1
+    assert led.is_on()
+    led.toggle()
+    assert not led.is_on()
+
+
+def test_registered_board_is_used_for_port() -> None:
+    emulated_boards["mega"] = EmulatedBoard(get_mega_pins())
+    try:
+        arduino = Arduino.mega("mega", conn_class=EmulatedSerialConnection)
+        assert get_board(arduino) is emulated_boards["mega"]
+        assert arduino.digital_read(69) == LOW
+    finally:
+        del emulated_boards["mega"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs a pseudo-terminal")
+def test_pty_server_with_real_serial_connection() -> None:
+    server = PtyServer(EmulatedBoard())
+    try:
+        arduino = Arduino.uno(server.port, conn_class=SerialConnection)
+        assert arduino.parrot(123) == 123
+        arduino.connection.conn.close()
+    finally:
+        server.close()
+
+
+@pytest.fixture
+def fast_baud_switching(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(Arduino, "baud_switch_delay_s", 0)
+    monkeypatch.setattr(Arduino, "baud_revert_delay_s", 0)
+
+
+@pytest.mark.usefixtures("fast_baud_switching")
+def test_negotiate_baudrate_picks_the_fastest(arduino: Arduino) -> None:
+    assert arduino.negotiate_baudrate() == 2000000
+    assert get_board(arduino).baudrate == 2000000
+    assert arduino.parrot(3) == 3
+
+
+@pytest.mark.usefixtures("fast_baud_switching")
+def test_negotiate_baudrate_respects_max_baudrate(arduino: Arduino) -> None:
+    assert arduino.negotiate_baudrate(max_baudrate=1000000) == 1000000
+    assert get_board(arduino).baudrate == 1000000
+
+
+@pytest.mark.usefixtures("fast_baud_switching")
+def test_negotiate_baudrate_falls_back_when_link_is_unreliable(
+    arduino: Arduino,
+) -> None:
+    arduino.connection.conn.max_baudrate = 500000  # type: ignore
+    assert arduino.negotiate_baudrate() == 500000
+    assert get_board(arduino).baudrate == 500000
+    assert arduino.poll() == 1
+
+
+@pytest.mark.usefixtures("fast_baud_switching")
+def test_negotiate_baudrate_skips_unsupported_rates(arduino: Arduino) -> None:
+    get_board(arduino).supported_baudrates = 0b00011
+    assert arduino.negotiate_baudrate() == 250000
+
+
+def test_scheduled_write_happens_on_the_boards_clock(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    arduino.pin_mode(13, OUTPUT)
+    arduino.schedule(13, HIGH, delay_us=1000)
+
+    board.service(board.micros + 999)
+    assert board.pins[13].output_state == 0
+    board.service(board.micros + 1)
+    assert board.pins[13].output_state == 1
+    assert board.scheduled == [None] * len(board.scheduled)
+
+
+def test_pulse_train_can_be_measured_by_pulse_in(arduino: Arduino) -> None:
+    arduino.pin_mode(13, OUTPUT)
+    arduino.pulse_train(13, n_pulses=3, high_us=150, low_us=100, delay_us=10)
+
+    assert [arduino.pulse_in(13, HIGH) for _ in range(3)] == [150, 150, 150]
+    assert arduino.pulse_in(13, HIGH, timeout_us=5000) == 0
+    assert arduino.digital_read(13) == LOW
+
+
+def test_pulse_in_measures_inputs(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    start_us = board.micros
+    board.schedule_digital_input(7, 1, start_us + 500)
+    board.schedule_digital_input(7, 0, start_us + 1080)
+
+    assert arduino.pulse_in(7, HIGH) == 580
+
+
+def test_toggle_runs_until_cancelled(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    arduino.pin_mode(13, OUTPUT)
+    slot = arduino.toggle(13, period_us=1000)
+    board.service(board.micros)
+
+    states = []
+    for _ in range(4):
+        states.append(board.pins[13].output_state)
+        board.service(board.micros + 500)
+    assert states == [1, 0, 1, 0]
+
+    arduino.cancel_scheduled(slot)
+    state_when_cancelled = board.pins[13].output_state
+    board.service(board.micros + 5000)
+    assert board.pins[13].output_state == state_when_cancelled
+
+
+def test_schedule_raises_when_full(arduino: Arduino) -> None:
+    arduino.pin_mode(13, OUTPUT)
+    slots = [arduino.toggle(13, period_us=1000) for _ in range(8)]
+    assert slots == list(range(8))
+    with pytest.raises(ArduinoScheduleFullError):
+        arduino.toggle(13, period_us=1000)
+
+    arduino.cancel_scheduled()
+    assert arduino.toggle(13, period_us=1000) == 0
+
+
+def test_schedule_needs_a_recent_sketch(arduino: Arduino) -> None:
+    arduino.sketch_version = (0, 5, 0)
+    with pytest.raises(ArduinoSketchVersionIncompatibleError):
+        arduino.schedule(13, HIGH, delay_us=1000)
+
+
+def test_oversampled_analog_read_adds_resolution(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 512)
+    assert arduino.analog_read(14, oversample=16) == 512 << 2
+
+    samples = iter([500, 501, 900, 502] * 16)
+    board.analog_read = lambda pin_no: next(samples)  # type: ignore
+    assert arduino.analog_read(14, oversample=4) == (500 + 501 + 900 + 502) >> 1
+    assert arduino.analog_read(14, oversample=4, median=True) == 501 + 502
+
+
+def test_oversample_must_be_a_power_of_four(arduino: Arduino) -> None:
+    with pytest.raises(ValueError):
+        arduino.analog_read(14, oversample=8)
+    arduino.sketch_version = (0, 9, 0)
+    with pytest.raises(ArduinoSketchVersionIncompatibleError):
+        arduino.analog_read(14, oversample=4)
+    assert arduino.analog_read(14) == 0
+
+
+def test_macro_runs_recorded_commands_in_one_round_trip(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 600)
+    with arduino.record_macro() as macro:
+        arduino.pin_mode(13, OUTPUT)
+        arduino.digital_write(13, HIGH)
+        assert arduino.digital_read(13) == LOW
+        assert arduino.analog_read(14) == 0
+    assert board.pins[13].output_state == 0
+
+    metrics = arduino.enable_metrics()
+    assert arduino.run_macro(macro) == [(1,), (600,)]
+    assert arduino.run_macro(macro, n_repeats=2) == [(1,), (600,)] * 2
+    assert board.pins[13].output_state == 1
+    assert metrics.snapshot().commands == {61: 2}
+
+
+def test_macro_longer_than_a_chunk_is_uploaded_in_pieces(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    with arduino.record_macro(slot=3) as macro:
+        for pin_no in range(2, 14):
+            arduino.pin_mode(pin_no, OUTPUT)
+        arduino.digital_write(9, HIGH)
+    assert len(macro.code) == 39
+    assert bytes(board.macros[3]) == macro.code
+
+    arduino.run_macro(macro)
+    assert board.pins[9].output_state == 1
+
+
+def test_macro_rejects_commands_it_cannot_run(arduino: Arduino) -> None:
+    with pytest.raises(ValueError):
+        with arduino.record_macro():
+            arduino.pulse_in(7, HIGH)
+    with pytest.raises(ValueError):
+        with arduino.record_macro():
+            arduino.analog_read(14, oversample=64)
+    with pytest.raises(ValueError, match="cannot be run from a macro"):
+        with arduino.record_macro():
+            arduino.watch_digital(7)
+    with pytest.raises(ValueError, match="cannot be run from a macro"):
+        with arduino.record_macro():
+            arduino.watch_analog(14, threshold=512)
+    with pytest.raises(ValueError):
+        with arduino.record_macro():
+            arduino.stream([14], 100)
+    with pytest.raises(ValueError):
+        with arduino.record_macro():
+            for _ in range(17):
+                arduino.digital_write(13, HIGH)
+    assert arduino.poll() == 1
+
+
+def test_macro_replies_must_fit_in_a_frame(arduino: Arduino) -> None:
+    with arduino.record_macro() as macro:
+        arduino.analog_read_many([14, 15, 16, 17, 18, 19])
+    assert len(arduino.run_macro(macro, n_repeats=5)) == 5
+    with pytest.raises(ValueError):
+        arduino.run_macro(macro, n_repeats=6)
+
+
+def test_watched_pin_changes_are_pushed_as_events(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    start_us = board.micros
+    board.schedule_digital_input(7, 1, start_us + 1000)
+    board.schedule_digital_input(7, 0, start_us + 3000)
+    received: List[DigitalEvent] = []
+
+    assert arduino.watch_digital(7, received.append, debounce_us=50) == LOW
+    assert arduino.process_events() == []
+    events = arduino.process_events(timeout=1) + arduino.process_events(timeout=1)
+    assert events == [
+        DigitalEvent(7, HIGH, start_us + 1000),
+        DigitalEvent(7, LOW, start_us + 3000),
+    ]
+    assert received == events
+
+
+def test_bounces_shorter_than_the_debounce_time_are_ignored(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    start_us = board.micros
+    for offset_us, state in ((100, 1), (120, 0), (140, 1)):
+        board.schedule_digital_input(7, state, start_us + offset_us)
+
+    arduino.watch_digital(7, debounce_us=50)
+    assert arduino.process_events(timeout=1) == [DigitalEvent(7, HIGH, start_us + 140)]
+    assert arduino.process_events(timeout=0.01) == []
+
+
+def test_events_arriving_with_replies_are_kept(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    arduino.watch_digital(7, debounce_us=0)
+    board.set_digital_input(7, 1)
+    board.service(board.micros)
+
+    assert arduino.poll() == 1
+    assert arduino.process_events() == [DigitalEvent(7, HIGH, board.micros)]
+
+
+def test_unwatched_pins_send_no_events(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    arduino.watch_digital(7, debounce_us=0)
+    arduino.unwatch(7)
+    board.schedule_digital_input(7, 1, board.micros + 10)
+    assert arduino.process_events(timeout=0.01) == []
+
+    for pin_no in range(2, 18):
+        arduino.watch_digital(pin_no)
+    with pytest.raises(ArduinoWatchListFullError):
+        arduino.watch_digital(18)
+
+
+def test_events_can_be_iterated_asynchronously(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    arduino.watch_digital(7, debounce_us=0)
+
+    async def first_event() -> Union[DigitalEvent, AnalogEvent]:
+        events = arduino.events(poll_interval_s=0)
+        board.set_digital_input(7, 1)
+        board.service(board.micros)
+        async for event in events:
+            return event
+        raise AssertionError("No event")
+
+    assert asyncio.run(first_event()) == DigitalEvent(7, HIGH, board.micros)
+
+
+def test_analog_threshold_crossings_respect_hysteresis(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 100)
+    received: List[AnalogEvent] = []
+
+    assert (
+        arduino.watch_analog(14, received.append, threshold=500, hysteresis=20) == 100
+    )
+    assert arduino.process_events(timeout=0.01) == []
+    for value in (600, 490, 470):
+        board.set_analog_input(14, value)
+        arduino.process_events(timeout=0.05)
+    assert [(event.kind, event.value) for event in received] == [
+        ("rise", 600),
+        ("fall", 470),
+    ]
+
+
+def test_analog_deltas_are_measured_from_the_last_event(arduino: Arduino) -> None:
+    board = get_board(arduino)
+    board.set_analog_input(14, 100)
+    events: List[AnalogEvent] = []
+    arduino.watch_analog(14, events.append, min_delta=50, interval_us=100)
+    for value in (140, 160, 90):
+        board.set_analog_input(14, value)
+        arduino.process_events(timeout=0.05)
+    assert [(event.pin_no, event.value) for event in events] == [(14, 160), (14, 90)]
+    timestamps = [event.timestamp_us for event in events]
+    assert timestamps == sorted(timestamps)
+
+
+def test_watch_analog_needs_a_threshold_or_delta(arduino: Arduino) -> None:
+    with pytest.raises(ValueError):
+        arduino.watch_analog(14)
+
+
+def test_analog_watches_are_replaced_and_removed_per_pin(arduino: Arduino) -> None:
+    for pin_no in range(14, 20):
+        arduino.watch_analog(pin_no, min_delta=10)
+    arduino.watch_analog(14, threshold=300)
+    arduino.unwatch(15)
+    assert len(get_board(arduino).analog_watched) == 5